@@ -8,9 +8,10 @@ import asyncio
 import numpy as np
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
-import aiohttp
 import logging
 import sys
+from app import async_db, timing, upstream
+from app.cache import cache
 
 # Configurar logging más detallado
 logging.basicConfig(
@@ -34,12 +35,11 @@ class AgronomicEnrichmentPipeline:
     4-8. Insertar datos: climate, crop, soil, calendar, companions
     """
     
-    def __init__(self, db_connection):
+    def __init__(self):
         """
-        Args:
-            db_connection: conexión a la BD MySQL
+        El acceso a BD usa el pool asíncrono (app.async_db), así las consultas
+        no bloquean el event loop mientras corren las peticiones a Open-Meteo
         """
-        self.db = db_connection
         self.species_data = None
         self.occurrences = []
         self.climate_data = {
@@ -66,7 +66,8 @@ class AgronomicEnrichmentPipeline:
             
             # PASO 1: Obtener datos base de la especie
             logger.info(f"\n[1/8]  Obteniendo datos base de la especie...")
-            self.species_data = await self._get_species_data(id_species)
+            with timing.span("agronomic_enrichment", "species"):
+                self.species_data = await self._get_species_data(id_species)
             if not self.species_data:
                 logger.error(f" Especie {id_species} no encontrada")
                 return {"error": "Especie no encontrada", "id_species": id_species}
@@ -81,7 +82,8 @@ class AgronomicEnrichmentPipeline:
                 self._get_occurrences(id_species)
             )
             
-            self.occurrences = await occurrences_task
+            with timing.span("agronomic_enrichment", "occurrences"):
+                self.occurrences = await occurrences_task
             
             if not self.occurrences:
                 logger.warning(f"  No hay ocurrencias almacenadas para species {id_species}")
@@ -106,7 +108,8 @@ class AgronomicEnrichmentPipeline:
             
             # PASO 3: Enriquecer con WorldClim
             logger.info(f"\n[3/8]   Enriqueciendo con datos climáticos (WorldClim/Open-Meteo)...")
-            await self._enrich_with_worldclim()
+            with timing.span("agronomic_enrichment", "climate"):
+                await self._enrich_with_worldclim()
             
             # Validar que tenemos datos
             if not self.climate_data['temperatures']:
@@ -162,16 +165,22 @@ class AgronomicEnrichmentPipeline:
         SELECT id_species, canonical_name, genus, family FROM species WHERE id_species = ?
         """
         try:
-            with self.db.cursor() as cur:
-                sql = """
-                    SELECT 
-                        id_species, scientific_name, genus, family
-                    FROM species
-                    WHERE id_species = %s
-                """
-                cur.execute(sql, (id_species,))
-                result = cur.fetchone()
-                return result
+            cache_key = ("agronomic_species", id_species)
+            cached = cache.get("species", cache_key)
+            if cached is not None:
+                return dict(cached)
+            
+            generation = cache.generation("species")
+            sql = """
+                SELECT 
+                    id_species, scientific_name, genus, family
+                FROM species
+                WHERE id_species = %s
+            """
+            result = await async_db.fetch_one(sql, (id_species,))
+            if result:
+                cache.put("species", cache_key, dict(result), generation)
+            return result
         except Exception as e:
             logger.error(f"Error obteniendo datos de especie: {str(e)}")
             return None
@@ -184,22 +193,20 @@ class AgronomicEnrichmentPipeline:
         WHERE id_species = ? AND decimalLatitude IS NOT NULL
         """
         try:
-            with self.db.cursor() as cur:
-                sql = """
-                    SELECT 
-                        decimal_latitude,
-                        decimal_longitude,
-                        event_date,
-                        MONTH(event_date) as month
-                    FROM occurrences
-                    WHERE id_species = %s
-                    AND decimal_latitude IS NOT NULL
-                    AND decimal_longitude IS NOT NULL
-                    AND event_date IS NOT NULL
-                """
-                cur.execute(sql, (id_species,))
-                results = cur.fetchall()
-                return results if results else []
+            sql = """
+                SELECT 
+                    decimal_latitude,
+                    decimal_longitude,
+                    event_date,
+                    MONTH(event_date) as month
+                FROM occurrences
+                WHERE id_species = %s
+                AND decimal_latitude IS NOT NULL
+                AND decimal_longitude IS NOT NULL
+                AND event_date IS NOT NULL
+            """
+            # Cursor del lado del servidor: las filas llegan por lotes
+            return [row async for row in async_db.stream(sql, (id_species,))]
         except Exception as e:
             logger.error(f"Error obteniendo ocurrencias: {str(e)}")
             return []
@@ -219,43 +226,41 @@ class AgronomicEnrichmentPipeline:
         successful_enrichments = 0
         failed_enrichments = 0
         
-        # Usar aiohttp para requests paralelos
-        async with aiohttp.ClientSession() as session:
-            # Procesar en lotes para mejor control
-            batch_size = 10
-            for batch_start in range(0, len(self.occurrences), batch_size):
-                batch_end = min(batch_start + batch_size, len(self.occurrences))
-                batch = self.occurrences[batch_start:batch_end]
-                
-                logger.info(f" Procesando ocurrencias {batch_start + 1}-{batch_end} de {len(self.occurrences)}")
-                
-                tasks = [
-                    self._fetch_worldclim_data(
-                        session,
-                        occ['decimal_latitude'],
-                        occ['decimal_longitude'],
-                        idx = batch_start + i
-                    )
-                    for i, occ in enumerate(batch)
-                ]
-                
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                for result in results:
-                    if isinstance(result, Exception):
-                        logger.debug(f" Error en WorldClim: {str(result)}")
-                        failed_enrichments += 1
-                        continue
-                    if result:
-                        if 'temp' in result and result['temp'] is not None:
-                            self.climate_data['temperatures'].append(result['temp'])
-                            successful_enrichments += 1
-                        if 'rainfall' in result and result['rainfall'] is not None:
-                            self.climate_data['rainfall'].append(result['rainfall'])
-                        if 'altitude' in result and result['altitude'] is not None:
-                            self.climate_data['altitudes'].append(result['altitude'])
-                    else:
-                        failed_enrichments += 1
+        # Requests paralelos por la sesión aiohttp compartida (app.upstream)
+        # Procesar en lotes para mejor control
+        batch_size = 10
+        for batch_start in range(0, len(self.occurrences), batch_size):
+            batch_end = min(batch_start + batch_size, len(self.occurrences))
+            batch = self.occurrences[batch_start:batch_end]
+            
+            logger.info(f" Procesando ocurrencias {batch_start + 1}-{batch_end} de {len(self.occurrences)}")
+            
+            tasks = [
+                self._fetch_worldclim_data(
+                    occ['decimal_latitude'],
+                    occ['decimal_longitude'],
+                    idx = batch_start + i
+                )
+                for i, occ in enumerate(batch)
+            ]
+            
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.debug(f" Error en WorldClim: {str(result)}")
+                    failed_enrichments += 1
+                    continue
+                if result:
+                    if 'temp' in result and result['temp'] is not None:
+                        self.climate_data['temperatures'].append(result['temp'])
+                        successful_enrichments += 1
+                    if 'rainfall' in result and result['rainfall'] is not None:
+                        self.climate_data['rainfall'].append(result['rainfall'])
+                    if 'altitude' in result and result['altitude'] is not None:
+                        self.climate_data['altitudes'].append(result['altitude'])
+                else:
+                    failed_enrichments += 1
         
         logger.info(f" Datos climáticos recopilados: "
                    f"exitosas={successful_enrichments}, "
@@ -264,12 +269,13 @@ class AgronomicEnrichmentPipeline:
                    f"rain={len(self.climate_data['rainfall'])}, "
                    f"alt={len(self.climate_data['altitudes'])}")
     
-    async def _fetch_worldclim_data(self, session: aiohttp.ClientSession, 
-                                   lat: float, lon: float,
+    async def _fetch_worldclim_data(self, lat: float, lon: float,
                                    idx: int = 0) -> Optional[Dict]:
         """
         Fetch clima data desde Open-Meteo API
-        Fallback: estimaciones basadas en coordenadas
+
+        Sin datos reales devuelve None (cuenta como fallida); con el host
+        limitado o el breaker abierto propaga UpstreamUnavailable
         """
         try:
             # Intenta con Open-Meteo Archive API
@@ -283,87 +289,36 @@ class AgronomicEnrichmentPipeline:
                 "elevation": "true"
             }
             
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    
-                    # Extraer datos
-                    temp_data = data.get('monthly', {}).get('temperature_2m_mean', [])
-                    rain_data = data.get('monthly', {}).get('precipitation_sum', [])
+            data = await upstream.get_json_async(url, params=params, timeout=10)
+            if data:
+                # Extraer datos
+                temp_data = data.get('monthly', {}).get('temperature_2m_mean', [])
+                rain_data = data.get('monthly', {}).get('precipitation_sum', [])
+                
+                if temp_data and rain_data:
+                    climate = {
+                        'temp': float(np.mean(temp_data)),
+                        'rainfall': float(np.sum(rain_data)),  # suma anual de precipitación
+                        'altitude': float(data.get('elevation', 0))
+                    }
+                    logger.debug(f" Ocurrencia {idx}: lat={lat}, lon={lon}, "
+                               f"temp={climate['temp']:.1f}°C, rain={climate['rainfall']:.0f}mm, alt={climate['altitude']:.0f}m")
+                    return climate
+                else:
+                    logger.debug(f"  Open-Meteo sin datos para {lat},{lon}")
                     
-                    if temp_data and rain_data:
-                        climate = {
-                            'temp': float(np.mean(temp_data)),
-                            'rainfall': float(np.sum(rain_data)),  # suma anual de precipitación
-                            'altitude': float(data.get('elevation', 0))
-                        }
-                        logger.debug(f" Ocurrencia {idx}: lat={lat}, lon={lon}, "
-                                   f"temp={climate['temp']:.1f}°C, rain={climate['rainfall']:.0f}mm, alt={climate['altitude']:.0f}m")
-                        return climate
-                    else:
-                        logger.debug(f"  Open-Meteo sin datos para {lat},{lon}")
-                        
+        except upstream.UpstreamUnavailable:
+            raise
         except asyncio.TimeoutError:
             logger.debug(f"  Timeout en Open-Meteo para {lat},{lon}")
         except Exception as e:
             logger.debug(f" Error en Open-Meteo: {str(e)}")
         
-        # FALLBACK: Estimaciones basadas en coordenadas (regresión simple)
-        try:
-            logger.debug(f" Usando fallback para {lat},{lon}")
-            climate = self._estimate_climate_from_coords(lat, lon)
-            if climate:
-                logger.debug(f" Estimado {idx}: lat={lat}, lon={lon}, "
-                           f"temp={climate['temp']:.1f}°C, rain={climate['rainfall']:.0f}mm, alt={climate['altitude']:.0f}m")
-            return climate
-        except Exception as e:
-            logger.debug(f"Error en estimación: {str(e)}")
-            return None
-    
-    def _estimate_climate_from_coords(self, lat: float, lon: float) -> Optional[Dict]:
-        """
-        Estimación simplificada de clima basada en latitud y altitud aproximada
-        Basado en patrones globales conocidos
-        """
-        try:
-            # Temperatura basada en latitud (simplificado)
-            # Ecuador: ~25°C, Trópicos: ~20°C, Templados: ~10-15°C
-            abs_lat = abs(lat)
-            if abs_lat < 10:  # Ecuatorial
-                temp = 25 - (abs_lat * 0.5)
-            elif abs_lat < 30:  # Tropical
-                temp = 20 - ((abs_lat - 10) * 0.5)
-            elif abs_lat < 50:  # Templado
-                temp = 15 - ((abs_lat - 30) * 0.3)
-            else:  # Boreal
-                temp = 5 - ((abs_lat - 50) * 0.5)
-            
-            # Precipitación: varía según región
-            # Zonas ecuatoriales: más lluvia
-            # Zonas subtropicales: menos lluvia (desiertos)
-            if abs_lat < 5:
-                rainfall = 2000 + np.random.normal(0, 300)
-            elif abs_lat < 20:
-                rainfall = 1200 + np.random.normal(0, 400)
-            elif abs_lat < 30:
-                rainfall = 600 + np.random.normal(0, 300)  # Subtropicales (más secos)
-            else:
-                rainfall = 800 + np.random.normal(0, 400)
-            
-            # Altitud: estimación (mayoría de cultivos en llanuras)
-            altitude = max(0, 200 + np.random.normal(0, 50))
-            
-            return {
-                'temp': float(np.clip(temp, -20, 50)),  # Límites realistas
-                'rainfall': float(np.clip(rainfall, 100, 5000)),  # Límites realistas
-                'altitude': float(altitude)
-            }
-        except Exception as e:
-            logger.debug(f"Error en estimación de coords: {str(e)}")
-            return None
+        return None
     
     # ============= PASOS 4-8: INSERTAR DATOS =============
     
+    @timing.timed("agronomic_enrichment")
     async def _insert_climate_requirements(self, id_species: int) -> Dict:
         """
         PASO 4: Calcula percentiles y inserta climate_requirements
@@ -399,7 +354,7 @@ class AgronomicEnrichmentPipeline:
                 'drought_tolerance': 'moderate'
             }
             
-            with self.db.cursor() as cur:
+            async with async_db.transaction() as cur:
                 sql = """
                     INSERT INTO climate_requirements (
                         id_species, temp_min, temp_opt_min, temp_opt_max, temp_max,
@@ -418,8 +373,8 @@ class AgronomicEnrichmentPipeline:
                         altitude_min = VALUES(altitude_min),
                         altitude_max = VALUES(altitude_max)
                 """
-                cur.execute(sql, tuple(climate_params.values()))
-                self.db.commit()
+                await cur.execute(sql, tuple(climate_params.values()))
+            cache.invalidate("climate_requirements")
             
             logger.info(f"        Temperatura: {climate_params['temp_opt_min']:.1f}°C - {climate_params['temp_opt_max']:.1f}°C (óptimo)")
             logger.info(f"       Precipitación: {climate_params['rainfall_opt_min']:.0f}mm - {climate_params['rainfall_opt_max']:.0f}mm (anual)")
@@ -429,9 +384,9 @@ class AgronomicEnrichmentPipeline:
             
         except Exception as e:
             logger.error(f"       Error insertando climate_requirements: {str(e)}")
-            self.db.rollback()
             return {"status": "error", "error": str(e)}
     
+    @timing.timed("agronomic_enrichment")
     async def _insert_crop_profile(self, id_species: int) -> Dict:
         """
         PASO 5: Inserta crop_profile
@@ -452,7 +407,7 @@ class AgronomicEnrichmentPipeline:
                 'nitrogen_fixing': nitrogen_fixing
             }
             
-            with self.db.cursor() as cur:
+            async with async_db.transaction() as cur:
                 sql = """
                     INSERT INTO crop_profile (
                         id_species, crop_type, planting_method,
@@ -461,8 +416,8 @@ class AgronomicEnrichmentPipeline:
                     ON DUPLICATE KEY UPDATE
                         nitrogen_fixing = VALUES(nitrogen_fixing)
                 """
-                cur.execute(sql, tuple(crop_params.values()))
-                self.db.commit()
+                await cur.execute(sql, tuple(crop_params.values()))
+            cache.invalidate("crop_profile")
             
             n2_status = " Fija Nitrógeno" if nitrogen_fixing else " No fija Nitrógeno"
             logger.info(f"      {n2_status} | Siembra: {crop_params['planting_method']} | Luz: {crop_params['sunlight_requirement']}")
@@ -471,9 +426,9 @@ class AgronomicEnrichmentPipeline:
             
         except Exception as e:
             logger.error(f"       Error insertando crop_profile: {str(e)}")
-            self.db.rollback()
             return {"status": "error", "error": str(e)}
     
+    @timing.timed("agronomic_enrichment")
     async def _insert_soil_requirements(self, id_species: int) -> Dict:
         """
         PASO 6: Inserta soil_requirements con valores por defecto
@@ -489,7 +444,7 @@ class AgronomicEnrichmentPipeline:
                 'organic_matter_need': 'medium'
             }
             
-            with self.db.cursor() as cur:
+            async with async_db.transaction() as cur:
                 sql = """
                     INSERT INTO soil_requirements (
                         id_species, ph_min, ph_max, soil_texture,
@@ -498,8 +453,8 @@ class AgronomicEnrichmentPipeline:
                     ON DUPLICATE KEY UPDATE
                         id_species = id_species
                 """
-                cur.execute(sql, tuple(soil_params.values()))
-                self.db.commit()
+                await cur.execute(sql, tuple(soil_params.values()))
+            cache.invalidate("soil_requirements")
             
             logger.info(f"       pH: {soil_params['ph_min']}-{soil_params['ph_max']} | "
                        f"Textura: {soil_params['soil_texture']} | Drenaje: {soil_params['drainage']}")
@@ -508,9 +463,9 @@ class AgronomicEnrichmentPipeline:
             
         except Exception as e:
             logger.error(f"       Error insertando soil_requirements: {str(e)}")
-            self.db.rollback()
             return {"status": "error", "error": str(e)}
     
+    @timing.timed("agronomic_enrichment")
     async def _insert_planting_calendar(self, id_species: int) -> Dict:
         """
         PASO 7: Genera planting_calendar desde ocurrencias
@@ -554,7 +509,7 @@ class AgronomicEnrichmentPipeline:
                 'hemisphere': 'northern'
             }
             
-            with self.db.cursor() as cur:
+            async with async_db.transaction() as cur:
                 sql = """
                     INSERT INTO planting_calendar (
                         id_species, planting_start_month, planting_end_month,
@@ -563,8 +518,8 @@ class AgronomicEnrichmentPipeline:
                     ON DUPLICATE KEY UPDATE
                         id_species = id_species
                 """
-                cur.execute(sql, tuple(calendar_params.values()))
-                self.db.commit()
+                await cur.execute(sql, tuple(calendar_params.values()))
+            cache.invalidate("planting_calendar")
             
             month_names = ['', 'Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
             logger.info(f"       Siembra: {month_names[planting_start]}-{month_names[planting_end]} | "
@@ -575,9 +530,9 @@ class AgronomicEnrichmentPipeline:
             
         except Exception as e:
             logger.error(f"       Error insertando planting_calendar: {str(e)}")
-            self.db.rollback()
             return {"status": "error", "error": str(e)}
     
+    @timing.timed("agronomic_enrichment")
     async def _insert_companion_plants(self, id_species: int) -> Dict:
         """
         PASO 8: Inserta companions base según familia
@@ -612,10 +567,16 @@ class AgronomicEnrichmentPipeline:
             for rule in companion_matches:
                 try:
                     # Buscar especie compañera por género
-                    with self.db.cursor() as cur:
-                        sql = "SELECT id_species, scientific_name FROM species WHERE genus = %s LIMIT 1"
-                        cur.execute(sql, (rule.get('genus_companion'),))
-                        result = cur.fetchone()
+                    async with async_db.transaction() as cur:
+                        genus_companion = rule.get('genus_companion')
+                        result = cache.get("species", ("by_genus", genus_companion))
+                        if result is None:
+                            generation = cache.generation("species")
+                            sql = "SELECT id_species, scientific_name FROM species WHERE genus = %s LIMIT 1"
+                            await cur.execute(sql, (genus_companion,))
+                            result = await cur.fetchone()
+                            if result:
+                                cache.put("species", ("by_genus", genus_companion), dict(result), generation)
                         
                         if result:
                             companion_id = result['id_species']
@@ -627,13 +588,12 @@ class AgronomicEnrichmentPipeline:
                                 (id_species_a, id_species_b, relationship_type, benefit_type)
                                 VALUES (%s, %s, %s, %s)
                             """
-                            cur.execute(insert_sql, (
+                            await cur.execute(insert_sql, (
                                 id_species,
                                 companion_id,
                                 'compatible',
                                 rule.get('benefit')
                             ))
-                            self.db.commit()
                             inserted.append({
                                 'id_species_a': id_species,
                                 'id_species_b': companion_id,
@@ -655,32 +615,34 @@ class AgronomicEnrichmentPipeline:
 
 
 # ============= FUNCIÓN PRINCIPAL PARA USO EXTERNO =============
-async def enrich_species_agronomy(id_species: int, db_connection) -> Dict:
+async def enrich_species_agronomy(id_species: int) -> Dict:
     """
     Función pública para enriquecer una especie
     
     Args:
         id_species: ID de la especie
-        db_connection: Conexión a la BD
         
     Returns:
         Dict con resultado de operaciones
     """
-    pipeline = AgronomicEnrichmentPipeline(db_connection)
+    pipeline = AgronomicEnrichmentPipeline()
     return await pipeline.enrich_species(id_species)
 
 
-def enrich_species_agronomy_sync(id_species: int, db_connection) -> Dict:
+def enrich_species_agronomy_sync(id_species: int) -> Dict:
     """
     Wrapper sincrónico para enriquecer especie
-    Útil para integración con FastAPI sin async
+    Útil fuera de un event loop (scripts, workers)
     """
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
         result = loop.run_until_complete(
-            enrich_species_agronomy(id_species, db_connection)
+            enrich_species_agronomy(id_species)
         )
         return result
     finally:
+        # El pool y la sesión HTTP están ligados a este loop: cerrarlos antes que el loop
+        loop.run_until_complete(async_db.close_async_pool())
+        loop.run_until_complete(upstream.close_async_session())
         loop.close()
@@ -0,0 +1,119 @@
+# Acceso asíncrono a MySQL (aiomysql)
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+import aiomysql
+
+load_dotenv()
+
+# Un pool por event loop: los pools de aiomysql quedan ligados al loop que los crea
+_pools = {}
+_locks = {}
+
+
+async def get_async_pool():
+    """
+    Devuelve el pool aiomysql del event loop actual, creándolo si hace falta
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is not None and not pool.closed:
+        return pool
+
+    async with _locks.setdefault(loop, asyncio.Lock()):
+        pool = _pools.get(loop)
+        if pool is not None and not pool.closed:
+            return pool
+        pool = await aiomysql.create_pool(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            db=os.getenv("DB_NAME"),
+            minsize=int(os.getenv("DB_ASYNC_POOL_MIN", "1")),
+            maxsize=int(os.getenv("DB_ASYNC_POOL_SIZE", os.getenv("DB_POOL_SIZE", "10"))),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "3600")),
+            cursorclass=aiomysql.DictCursor,
+            autocommit=False,
+        )
+        _pools[loop] = pool
+    return pool
+
+
+async def close_async_pool():
+    """Cierra el pool del event loop actual (llamar antes de cerrar el loop)"""
+    loop = asyncio.get_running_loop()
+    _locks.pop(loop, None)
+    pool = _pools.pop(loop, None)
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+@asynccontextmanager
+async def async_connection():
+    """
+    Presta una conexión del pool asíncrono durante el bloque async with
+    """
+    pool = await get_async_pool()
+    async with pool.acquire() as conn:
+        try:
+            yield conn
+        finally:
+            # No dejar transacciones abiertas en conexiones devueltas al pool
+            await conn.rollback()
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Cursor dentro de una transacción: commit al salir, rollback si hay excepción
+
+    Uso:
+        async with transaction() as cur:
+            await cur.execute("INSERT ...", params)
+    """
+    async with async_connection() as conn:
+        try:
+            async with conn.cursor() as cur:
+                yield cur
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+
+
+async def fetch_one(sql: str, params: tuple = ()):
+    """Ejecuta un SELECT y devuelve la primera fila (dict) o None"""
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone()
+
+
+async def fetch_all(sql: str, params: tuple = ()) -> list:
+    """Ejecuta un SELECT y devuelve todas las filas (lista de dicts)"""
+    async with async_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return list(await cur.fetchall())
+
+
+async def stream(sql: str, params: tuple = (), batch_size: int = 1000):
+    """
+    Itera un SELECT con cursor del lado del servidor (SSDictCursor)
+    sin cargar todo el resultado en memoria
+
+    Uso:
+        async for row in stream("SELECT ... FROM occurrences WHERE id_species=%s", (id,)):
+            ...
+    """
+    async with async_connection() as conn:
+        async with conn.cursor(aiomysql.SSDictCursor) as cur:
+            await cur.execute(sql, params)
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
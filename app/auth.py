@@ -3,12 +3,65 @@ from fastapi import Request, HTTPException
 from jose import jwt
 import bcrypt
 from datetime import datetime, timedelta
+from collections import OrderedDict
+import hashlib
 import os
-from .db import get_connection
+import threading
+import time
+from .db import get_connection, release_connection
 
 SECRET = os.getenv("JWT_SECRET")
 ALGO = os.getenv("JWT_ALGORITHM")
 EXPIRE = int(os.getenv("JWT_EXPIRE_MINUTES"))
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "1024"))
+
+
+class VerifiedTokenCache:
+    """
+    LRU acotado de tokens ya verificados: sha256(token) -> (exp, payload).
+    Cada entrada caduca en el exp del propio token, así un token repetido
+    se resuelve con un lookup en vez de verificar la firma de nuevo.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            exp, payload = entry
+            if exp <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token: str, payload: dict):
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)) or self.max_size <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (exp, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
 
 def verify_password(plain: str, hashed: str) -> bool:
     return bcrypt.checkpw(plain.encode('utf-8'), hashed.encode('utf-8'))
@@ -53,7 +106,7 @@ def get_user_modules(id_user: int) -> list:
         print(f"Error fetching user modules: {e}")
         return []
     finally:
-        conn.close()
+        release_connection(conn)
 
 def create_token(data: dict):
     payload = data.copy()
@@ -70,12 +123,41 @@ async def auth_middleware(request: Request):
         if scheme.lower() != "bearer":
             raise HTTPException(status_code=401, detail="Invalid auth scheme")
 
-        payload = jwt.decode(token, SECRET, algorithms=[ALGO])
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(token, SECRET, algorithms=[ALGO])
+            token_cache.put(token, payload)
         request.state.user = payload
 
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
+ACCESS_LEVELS = {"read": 1, "write": 2, "admin": 3}
+
+
+def require_module(module: str, access_level: str = "read"):
+    """
+    Dependencia FastAPI: exige que el token traiga el módulo con al menos
+    access_level. Usa el claim "modules" del JWT, sin consultar la BD.
+
+    Uso:
+        @router.post("/calculate")
+        def calculate(_=Depends(require_module("climatic"))): ...
+    """
+    required = ACCESS_LEVELS[access_level]
+
+    async def dependency(request: Request):
+        await auth_middleware(request)
+        granted = (request.state.user.get("modules") or {}).get(module)
+        if ACCESS_LEVELS.get(granted, 0) < required:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Module '{module}' requires {access_level} access"
+            )
+        return request.state.user
+
+    return dependency
+
 def login(username: str, password: str):
     conn = get_connection()
     if not conn:
@@ -83,22 +165,32 @@ def login(username: str, password: str):
 
 #nada
     try:
+        # Usuario y módulos activos en una sola consulta (una fila por módulo)
         with conn.cursor() as cur:
             cur.execute(
                 """
                 SELECT 
-                    id_user,
-                    id_person,
-                    username,
-                    password_hash,
-                    status
-                FROM users
-                WHERE username = %s
+                    u.id_user,
+                    u.id_person,
+                    u.username,
+                    u.password_hash,
+                    u.status,
+                    m.id_module,
+                    m.name AS module_name,
+                    m.description,
+                    um.access_level,
+                    um.granted_at
+                FROM users u
+                LEFT JOIN user_modules um ON um.id_user = u.id_user
+                LEFT JOIN modules m ON m.id_module = um.id_module AND m.status = 'active'
+                WHERE u.username = %s
+                ORDER BY m.name
                 """,
                 (username,)
             )
-            user = cur.fetchone()
+            rows = cur.fetchall()
 
+        user = rows[0] if rows else None
         if not user:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
@@ -111,18 +203,32 @@ def login(username: str, password: str):
         if not verify_password(password, user["password_hash"]):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
+        modules = [
+            {
+                "id_module": row["id_module"],
+                "name": row["module_name"],
+                "description": row["description"],
+                "access_level": row["access_level"],
+                "granted_at": row["granted_at"]
+            }
+            for row in rows
+            if row["id_module"] is not None
+        ]
+
         token = create_token({
             "id_user": user["id_user"],
             "id_person": user["id_person"],
             "username": user["username"],
-            "status": user["status"]
+            "status": user["status"],
+            "modules": {m["name"]: m["access_level"] for m in modules}
         })
 
         return {
             "token": token,
-            "id_user": user["id_user"]
+            "id_user": user["id_user"],
+            "modules": modules
         }
 
     finally:
-        conn.close()
+        release_connection(conn)
         
\ No newline at end of file
@@ -0,0 +1,128 @@
+# Cache de lectura en memoria para tablas de referencia
+import os
+import threading
+import time
+from collections import OrderedDict
+from . import metrics
+
+# TTL en segundos por tabla; solo estas tablas se cachean
+DEFAULT_TTLS = {
+    "species": 600,
+    "modules": 300,
+    "climate_requirements": 300,
+    "crop_profile": 300,
+    "soil_requirements": 300,
+    "planting_calendar": 300,
+}
+
+_MISSING = object()
+
+
+class TableCache:
+    """
+    Cache read-through LRU con TTL por tabla.
+
+    Cada tabla lleva un contador de generación que forma parte de la llave:
+    invalidate(table) lo incrementa y todas sus entradas dejan de ser
+    alcanzables al instante (el LRU las expulsa después). Una lectura que
+    empezó antes de una escritura guarda su resultado con la generación
+    vieja, así que nunca reaparece un valor previo a la escritura.
+    """
+
+    def __init__(self, ttls: dict = None, max_entries: int = 2048):
+        self.ttls = dict(ttls or DEFAULT_TTLS)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (table, generation, key) -> (expires_at, value)
+        self._generations = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def is_cached(self, table: str) -> bool:
+        return self.ttls.get(table, 0) > 0
+
+    def generation(self, table: str) -> int:
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def get(self, table: str, key, default=None):
+        """Valor cacheado o default; cuenta hit/miss"""
+        with self._lock:
+            stats = self._stats.setdefault(table, {"hits": 0, "misses": 0, "invalidations": 0})
+            entry_key = (table, self._generations.get(table, 0), key)
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(entry_key)
+                stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[entry_key]
+            stats["misses"] += 1
+            return default
+
+    def put(self, table: str, key, value, generation: int = None):
+        """Guarda un valor; si se pasa generation y ya cambió, se descarta"""
+        if not self.is_cached(table):
+            return
+        with self._lock:
+            current = self._generations.get(table, 0)
+            if generation is not None and generation != current:
+                return
+            entry_key = (table, current, key)
+            self._entries[entry_key] = (time.monotonic() + self.ttls[table], value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, table: str, key, loader, cache_none: bool = True):
+        """
+        Devuelve el valor cacheado o lo carga con loader() y lo guarda
+        """
+        if not self.is_cached(table):
+            return loader()
+
+        value = self.get(table, key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        generation = self.generation(table)
+        value = loader()
+        if value is not None or cache_none:
+            self.put(table, key, value, generation)
+        return value
+
+    def invalidate(self, table: str):
+        """Invalida todas las entradas de una tabla (llamar tras escribir en ella)"""
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            stats = self._stats.setdefault(table, {"hits": 0, "misses": 0, "invalidations": 0})
+            stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Contadores hit/miss por tabla y tamaño actual"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "tables": {table: dict(s) for table, s in self._stats.items()},
+            }
+
+
+def _ttls_from_env() -> dict:
+    """TTL por tabla sobrescribible con CACHE_TTL_<TABLA>=segundos (0 desactiva)"""
+    ttls = dict(DEFAULT_TTLS)
+    for table in DEFAULT_TTLS:
+        value = os.getenv(f"CACHE_TTL_{table.upper()}")
+        if value is not None:
+            ttls[table] = int(value)
+    return ttls
+
+
+cache = TableCache(
+    ttls=_ttls_from_env(),
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "2048")),
+)
+metrics.register_cache("table_cache", cache)
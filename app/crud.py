@@ -1,40 +1,340 @@
 # Lógica CRUD genérica
-from .db import get_connection
+import base64
+import json
+from functools import lru_cache
+import pymysql
+from .db import get_connection, release_connection
+from .schema import schema, SchemaError, SchemaUnavailable
+from .cache import cache
 
-def crud_action(action: str, table: str, data: dict = None, where: dict = None):
+# Filas por sentencia en las acciones masivas
+BULK_CHUNK_SIZE = 500
+# Tope de chunk_size pedido por el cliente; además MySQL no acepta más de
+# 65535 placeholders por sentencia
+MAX_BULK_CHUNK_SIZE = 5000
+MAX_PLACEHOLDERS = 65535
+
+_MISSING = object()
+
+
+def encode_cursor(value) -> str:
+    """Token opaco de paginación a partir del último valor de la llave primaria"""
+    raw = json.dumps({"after": value}, default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(token: str):
+    """Valor de la llave primaria a partir de un token de encode_cursor()"""
+    try:
+        raw = base64.urlsafe_b64decode(token.encode("ascii"))
+        return json.loads(raw)["after"]
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+# ============= SENTENCIAS (memoizadas por acción, tabla y columnas) =============
+# Los nombres de tabla/columna llegan aquí ya validados contra el esquema.
+
+@lru_cache(maxsize=1024)
+def _insert_sql(table: str, columns: tuple) -> str:
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+
+@lru_cache(maxsize=1024)
+def _select_sql(table: str, columns: tuple, where: tuple, key: str = None,
+                has_after: bool = False, has_limit: bool = False) -> str:
+    select_cols = ", ".join(columns) if columns else "*"
+    if key and columns and key not in columns:
+        select_cols = f"{key}, {select_cols}"
+
+    sql = f"SELECT {select_cols} FROM {table}"
+    conditions = [f"{k}=%s" for k in where]
+    if has_after:
+        conditions.append(f"{key} > %s")
+    if conditions:
+        sql = f"{sql} WHERE {' AND '.join(conditions)}"
+    if key:
+        sql = f"{sql} ORDER BY {key}"
+    if has_limit:
+        sql = f"{sql} LIMIT %s"
+    return sql
+
+
+@lru_cache(maxsize=1024)
+def _update_sql(table: str, columns: tuple, where: tuple) -> str:
+    sets = ", ".join(f"{k}=%s" for k in columns)
+    wheres = " AND ".join(f"{k}=%s" for k in where)
+    return f"UPDATE {table} SET {sets} WHERE {wheres}"
+
+
+@lru_cache(maxsize=1024)
+def _delete_sql(table: str, where: tuple) -> str:
+    wheres = " AND ".join(f"{k}=%s" for k in where)
+    return f"DELETE FROM {table} WHERE {wheres}"
+
+
+@lru_cache(maxsize=1024)
+def _multi_insert_sql(table: str, columns: tuple, n_rows: int,
+                      update_columns: tuple = None) -> str:
+    row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES {', '.join([row_placeholder] * n_rows)}"
+    )
+    if update_columns is not None:
+        sets = ", ".join(f"{c}=VALUES({c})" for c in update_columns)
+        sql = f"{sql} ON DUPLICATE KEY UPDATE {sets}"
+    return sql
+
+
+def _upsert_update_columns(table_schema, columns: tuple, update_columns=None) -> tuple:
+    """
+    Columnas del ON DUPLICATE KEY UPDATE: las pedidas, o todas las enviadas
+    salvo las de llave primaria/única (que son las que detectan el duplicado)
+    """
+    if update_columns:
+        return tuple(update_columns)
+    keys = table_schema.key_columns
+    updates = tuple(c for c in columns if c not in keys)
+    # Sin columnas no-llave: no-op que MySQL acepta y no cuenta como cambio
+    return updates or (columns[0],)
+
+
+def _chunk_size(chunk_size, n_columns: int) -> int:
+    """chunk_size del cliente validado (ValueError si no es entero positivo) y acotado"""
+    if chunk_size is None:
+        chunk_size = BULK_CHUNK_SIZE
+    elif isinstance(chunk_size, bool) or not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    return max(1, min(chunk_size, MAX_BULK_CHUNK_SIZE, MAX_PLACEHOLDERS // max(n_columns, 1)))
+
+
+def _bulk_write(cur, table_schema, rows: list, upsert: bool,
+                update_columns: list = None, chunk_size: int = None) -> list:
+    """
+    Inserta filas con sentencias multi-fila de chunk_size filas cada una.
+    Todas las filas deben traer las mismas columnas.
+
+    Returns:
+        Lista con las filas afectadas por cada chunk
+    """
+    chunk_size = _chunk_size(chunk_size, len(rows[0]) if rows else 1)
+    if not rows:
+        return []
+
+    columns = tuple(rows[0].keys())
+    for row in rows:
+        if set(row.keys()) != set(columns):
+            raise ValueError("All rows in a bulk action must have the same columns")
+    schema.validate(table_schema.name, columns, update_columns)
+
+    updates = _upsert_update_columns(table_schema, columns, update_columns) if upsert else None
+    affected = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        sql = _multi_insert_sql(table_schema.name, columns, len(chunk), updates)
+        params = [row[c] for row in chunk for c in columns]
+        affected.append(cur.execute(sql, params))
+    return affected
+
+
+def _keyset_key(table_schema) -> str:
+    """Llave primaria para paginar por keyset (SchemaError si es compuesta o no hay)"""
+    if len(table_schema.primary_key) != 1:
+        raise SchemaError(f"Keyset pagination requires a single-column primary key on {table_schema.name}")
+    return table_schema.primary_key[0]
+
+
+def _stream_rows(table: str, columns: tuple, where: dict, key: str = None,
+                 after=None, limit: int = None, batch_size: int = 1000):
+    """
+    Generador de filas con cursor del lado del servidor (SSDictCursor).
+    La conexión se presta al empezar a iterar y se devuelve al terminar o al
+    cerrar el generador, así que el resultado nunca se materializa completo.
+
+    key/after/limit: ordenar por la llave primaria, empezar después de
+    after (cursor de una página anterior) y enviar como mucho limit filas;
+    se validan antes de crear el generador (ver crud_action).
+    """
+    conn = get_connection()
+    if not conn:
+        return
+
+    try:
+        sql = _select_sql(table, columns, tuple(where), key, after is not None, limit is not None)
+        params = [*where.values()]
+        if after is not None:
+            params.append(after)
+        if limit is not None:
+            params.append(limit)
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cur:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+    finally:
+        release_connection(conn)
+
+
+def _read(table_schema, columns: tuple, where: dict, limit: int = None, cursor: str = None):
     conn = get_connection()
     if not conn:
         return {"connected": False}
 
-    with conn.cursor() as cur:
-        if action == "create":
-            keys = ", ".join(data.keys())
-            values = ", ".join(["%s"] * len(data))
-            sql = f"INSERT INTO {table} ({keys}) VALUES ({values})"
-            cur.execute(sql, tuple(data.values()))
-
-        elif action == "read":
-            sql = f"SELECT * FROM {table}"
-            params = ()
-            if where and isinstance(where, dict):
-                wheres = " AND ".join([f"{k}=%s" for k in where.keys()])
-                sql = f"{sql} WHERE {wheres}"
-                params = tuple(where.values())
+    table = table_schema.name
+    try:
+        with conn.cursor() as cur:
+            if not limit:
+                sql = _select_sql(table, columns, tuple(where))
+                cur.execute(sql, tuple(where.values()))
+                return cur.fetchall()
 
+            key = _keyset_key(table_schema)
+            after = decode_cursor(cursor) if cursor else None
+            sql = _select_sql(table, columns, tuple(where), key, after is not None, True)
+            params = [*where.values()]
+            if after is not None:
+                params.append(after)
+            params.append(int(limit))
             cur.execute(sql, params)
-            return cur.fetchall()
+            rows = cur.fetchall()
+            next_cursor = None
+            if len(rows) == int(limit):
+                next_cursor = encode_cursor(rows[-1][key])
+            return {"rows": rows, "next_cursor": next_cursor}
+    finally:
+        release_connection(conn)
+
+
+def _copy_result(result):
+    # Copias de las filas: quien llama puede mutarlas sin tocar el cache
+    if isinstance(result, dict) and "rows" in result:
+        return {**result, "rows": [dict(row) for row in result["rows"]]}
+    if isinstance(result, (list, tuple)):
+        return [dict(row) for row in result]
+    return result
+
+
+def _cached_read(table_schema, columns: tuple, where: dict, limit: int = None, cursor: str = None):
+    """Lectura a través del cache de tablas de referencia (app.cache)"""
+    table = table_schema.name
+    if not cache.is_cached(table):
+        return _read(table_schema, columns, where, limit, cursor)
+
+    key = json.dumps([columns, where, limit, cursor], sort_keys=True, default=str)
+    cached = cache.get(table, key, _MISSING)
+    if cached is not _MISSING:
+        return _copy_result(cached)
+
+    generation = cache.generation(table)
+    result = _read(table_schema, columns, where, limit, cursor)
+    if not (isinstance(result, dict) and result.get("connected") is False):
+        cache.put(table, key, _copy_result(result), generation)
+    return result
+
+
+def crud_action(action: str, table: str, data=None, where: dict = None,
+                columns: list = None, limit: int = None, cursor: str = None,
+                stream: bool = False, update_columns: list = None,
+                chunk_size: int = None):
+    """
+    Ejecuta una acción CRUD genérica sobre una tabla
+
+    Tablas y columnas se validan contra el esquema cargado de
+    information_schema antes de ir a MySQL (SchemaError si no existen).
+    Las lecturas de tablas de referencia pasan por app.cache y cualquier
+    escritura en la tabla las invalida.
+
+    Acciones masivas (una conexión, una transacción):
+        create_many: data es una lista de dicts
+        upsert / upsert_many: INSERT ... ON DUPLICATE KEY UPDATE; data es un
+               dict o una lista de dicts. update_columns limita las columnas
+               actualizadas (por defecto las enviadas que no son llave)
+        chunk_size: filas por sentencia (entero positivo, ValueError si no;
+               se acota a MAX_BULK_CHUNK_SIZE y al límite de placeholders)
+        Devuelven {"chunks": [filas afectadas por sentencia], "affected": total}.
+        En upsert MySQL cuenta 1 por fila insertada y 2 por fila actualizada.
+
+    Opciones de lectura (action="read"):
+        columns: lista de columnas a proyectar (por defecto *)
+        limit: tamaño de página; activa la paginación por keyset sobre la
+               llave primaria y devuelve {"rows": [...], "next_cursor": str|None}
+        cursor: token next_cursor de la página anterior
+        stream: devuelve un generador de filas (cursor del lado del servidor);
+               con limit/cursor envía como mucho limit filas ordenadas por la
+               llave primaria, después de cursor
+    """
+    where = where if isinstance(where, dict) else {}
+    columns = tuple(columns or ())
+    try:
+        table_schema = schema.validate(
+            table,
+            columns,
+            where.keys(),
+            data.keys() if isinstance(data, dict) else None
+        )
+    except SchemaUnavailable:
+        return {"connected": False}
+
+    if action == "read":
+        if stream:
+            if limit is None and not cursor:
+                return _stream_rows(table, columns, where)
+            # El generador no corre hasta que se itera: validar aquí para que
+            # los errores lleguen antes de empezar la respuesta
+            key = _keyset_key(table_schema)
+            after = decode_cursor(cursor) if cursor else None
+            if limit is not None:
+                if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+                    raise ValueError("limit must be a positive integer")
+            return _stream_rows(table, columns, where, key, after, limit)
+        return _cached_read(table_schema, columns, where, limit, cursor)
+
+    conn = get_connection()
+    if not conn:
+        return {"connected": False}
+
+    try:
+        with conn.cursor() as cur:
+            if action == "create":
+                sql = _insert_sql(table, tuple(data.keys()))
+                cur.execute(sql, tuple(data.values()))
+                result = {"connected": True, "action": action}
+
+            elif action in ("create_many", "upsert", "upsert_many"):
+                rows = [data] if isinstance(data, dict) else list(data or [])
+                chunks = _bulk_write(
+                    cur, table_schema, rows,
+                    upsert=action != "create_many",
+                    update_columns=update_columns,
+                    chunk_size=chunk_size
+                )
+                result = {
+                    "connected": True,
+                    "action": action,
+                    "chunks": chunks,
+                    "affected": sum(chunks)
+                }
+
+            elif action == "update":
+                sql = _update_sql(table, tuple(data.keys()), tuple(where))
+                cur.execute(sql, (*data.values(), *where.values()))
+                result = {"connected": True, "action": action}
 
-        elif action == "update":
-            sets = ", ".join([f"{k}=%s" for k in data.keys()])
-            wheres = " AND ".join([f"{k}=%s" for k in where.keys()])
-            sql = f"UPDATE {table} SET {sets} WHERE {wheres}"
-            cur.execute(sql, (*data.values(), *where.values()))
+            elif action == "delete":
+                sql = _delete_sql(table, tuple(where))
+                cur.execute(sql, tuple(where.values()))
+                result = {"connected": True, "action": action}
 
-        elif action == "delete":
-            wheres = " AND ".join([f"{k}=%s" for k in where.keys()])
-            sql = f"DELETE FROM {table} WHERE {wheres}"
-            cur.execute(sql, tuple(where.values()))
+            else:
+                raise ValueError(f"Unknown action: {action}")
 
-        conn.commit()
+            conn.commit()
+    finally:
+        release_connection(conn)
 
-    return {"connected": True, "action": action}
+    # Cualquier escritura invalida las lecturas cacheadas de la tabla
+    cache.invalidate(table)
+    return result
@@ -1,19 +1,203 @@
-# Conexión a MySQL
+# Conexión a MySQL (pool de conexiones por proceso)
 import pymysql
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from . import metrics
 
 load_dotenv()
 
+
+def _connect():
+    return pymysql.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        cursorclass=pymysql.cursors.DictCursor,
+        # LOAD DATA LOCAL INFILE (carga masiva de ocurrencias); apagado por defecto
+        local_infile=os.getenv("DB_LOCAL_INFILE", "").lower() in ("1", "true", "yes")
+    )
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones pymysql acotado y seguro entre hilos.
+
+    - max_size: máximo de conexiones abiertas a la vez (prestadas + libres)
+    - timeout: segundos que espera acquire() a que se libere una conexión
+    - recycle: segundos tras los cuales una conexión libre se descarta
+    Cada conexión se valida con ping(reconnect=True) al prestarse.
+    """
+
+    def __init__(self, max_size: int = 10, timeout: float = 10.0, recycle: float = 3600.0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = deque()  # (conn, released_at)
+        self._opened = 0
+        self._closed = False  # tras close_all(): no se presta ni se guarda nada
+        self._cond = threading.Condition()
+        self._stats = {
+            "acquired": 0,
+            "released": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    def acquire(self):
+        """
+        Presta una conexión validada del pool
+
+        Returns:
+            Conexión pymysql o None si no se pudo obtener (o el pool se cerró)
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while not self._closed and not self._idle and self._opened >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        return None
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    return None
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    if time.monotonic() - released_at > self.recycle:
+                        self._opened -= 1
+                        self._stats["discarded"] += 1
+                        self._close_quietly(conn)
+                        continue
+                else:
+                    self._opened += 1
+
+            if conn is None:
+                try:
+                    conn = _connect()
+                except Exception:
+                    self._forget()
+                    return None
+                with self._cond:
+                    self._stats["created"] += 1
+            else:
+                try:
+                    conn.ping(reconnect=True)
+                except Exception:
+                    self._close_quietly(conn)
+                    self._forget()
+                    continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._stats["acquired"] += 1
+                self._stats["wait_seconds_total"] += waited
+            metrics.DB_POOL_WAIT.observe(waited)
+            return conn
+
+    def release(self, conn):
+        """
+        Devuelve una conexión al pool. Descarta cualquier transacción abierta
+        para que el siguiente préstamo no herede locks ni snapshots.
+        Si el pool ya se cerró (close_all) la conexión se cierra.
+        """
+        if conn is None:
+            return
+
+        try:
+            conn.rollback()
+        except Exception:
+            self._close_quietly(conn)
+            self._forget()
+            return
+
+        with self._cond:
+            self._stats["released"] += 1
+            if self._closed:
+                self._opened -= 1
+                self._close_quietly(conn)
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        """Snapshot de uso del pool"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "max_size": self.max_size,
+                "opened": self._opened,
+                "idle": idle,
+                "in_use": self._opened - idle,
+                **self._stats,
+            }
+
+    def close_all(self):
+        """
+        Cierra el pool: las conexiones libres se cierran ya, las prestadas al
+        devolverse con release(), y acquire() deja de prestar (devuelve None)
+        """
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._opened -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    def _forget(self):
+        with self._cond:
+            self._opened -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+pool = ConnectionPool(
+    max_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    recycle=float(os.getenv("DB_POOL_RECYCLE", "3600")),
+)
+
+metrics.register_pool_metrics(pool)
+
+
 def get_connection():
+    """Presta una conexión del pool; devolver con release_connection()"""
+    return pool.acquire()
+
+
+def release_connection(conn):
+    """Devuelve al pool una conexión obtenida con get_connection()"""
+    pool.release(conn)
+
+
+@contextmanager
+def db_connection():
+    """
+    Presta una conexión del pool durante el bloque with
+
+    Yields:
+        Conexión pymysql o None si el pool no pudo entregar una
+    """
+    conn = get_connection()
     try:
-        conn = pymysql.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        return conn
-    except Exception as e:
-        return None
+        yield conn
+    finally:
+        release_connection(conn)
@@ -0,0 +1,310 @@
+# Cola de trabajos en la BD (tabla jobs, migrations_jobs.sql)
+#
+# Los endpoints largos (import de GBIF, nicho climático, enriquecimiento
+# agronómico) encolan un trabajo y responden con su id; los procesos
+# `python -m app.worker` lo toman con SELECT ... FOR UPDATE SKIP LOCKED.
+import json
+import os
+import socket
+import threading
+import time
+import pymysql
+from .db import db_connection
+from . import metrics
+
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+# Segundos entre sondeos de un worker sin trabajo
+POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "2"))
+# El worker renueva heartbeat_at mientras corre; si deja de hacerlo por
+# STALE_SECONDS (proceso caído) el trabajo vuelve a la cola
+HEARTBEAT_SECONDS = float(os.getenv("JOBS_HEARTBEAT_SECONDS", "30"))
+STALE_SECONDS = int(os.getenv("JOBS_STALE_SECONDS", "300"))
+# Espera antes del reintento n: RETRY_BASE_SECONDS * n^2
+RETRY_BASE_SECONDS = int(os.getenv("JOBS_RETRY_BASE_SECONDS", "30"))
+
+# SKIP LOCKED existe desde MySQL 8.0 / MariaDB 10.6; sin él los workers
+# esperan el lock de la fila en vez de saltarla (correcto, pero más lento)
+_skip_locked = os.getenv("JOBS_SKIP_LOCKED", "1").lower() not in ("0", "false", "no")
+
+_handlers = {}
+
+
+class JobFailed(RuntimeError):
+    """
+    El handler terminó con {"error": ...} (especie no encontrada, sin
+    ocurrencias...): el resultado es determinista, el trabajo falla sin reintentos
+    """
+    pass
+
+
+class JobError(RuntimeError):
+    """La cola de trabajos no está disponible o el trabajo no existe"""
+    pass
+
+
+def handler(kind: str):
+    """
+    Registra la función que ejecuta los trabajos de un tipo
+
+    Uso:
+        @jobs.handler("climate_niche")
+        def run_climate_niche(payload: dict) -> dict:
+            ...  # lanzar excepción si falla (ver require_success)
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def require_success(result):
+    """
+    Los pipelines devuelven {"error": ...} en vez de lanzar (contrato de los
+    endpoints síncronos); en un handler eso debe marcar el trabajo fallido
+    """
+    if isinstance(result, dict) and result.get("error"):
+        raise JobFailed(str(result["error"]))
+    return result
+
+
+def _decode(job: dict) -> dict:
+    job = dict(job)
+    for field in ("payload", "result"):
+        if job.get(field) is not None:
+            job[field] = json.loads(job[field])
+    return job
+
+
+def submit(kind: str, payload: dict, dedupe_key: str = None, max_attempts: int = None) -> dict:
+    """
+    Encola un trabajo. Si ya hay uno sin terminar con el mismo dedupe_key
+    (p.ej. la misma especie) se devuelve ese en vez de crear otro.
+
+    Returns:
+        {"id_job", "status", "joined"}
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    with db_connection() as conn:
+        if not conn:
+            raise JobError("Database connection failed")
+        with conn.cursor() as cur:
+            # LAST_INSERT_ID(id_job): con duplicado, lastrowid es el trabajo en curso
+            affected = cur.execute(
+                """
+                INSERT INTO jobs (kind, payload, dedupe_key, active_key, max_attempts)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE id_job = LAST_INSERT_ID(id_job)
+                """,
+                (kind, json.dumps(payload, default=str), dedupe_key, dedupe_key,
+                 max_attempts or MAX_ATTEMPTS)
+            )
+            id_job = cur.lastrowid
+            cur.execute("SELECT status FROM jobs WHERE id_job = %s", (id_job,))
+            status = cur.fetchone()["status"]
+        conn.commit()
+
+    return {"id_job": id_job, "status": status, "joined": affected != 1}
+
+
+def get_job(id_job: int):
+    """Trabajo con payload y result decodificados, o None"""
+    with db_connection() as conn:
+        if not conn:
+            raise JobError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM jobs WHERE id_job = %s", (id_job,))
+            job = cur.fetchone()
+    return _decode(job) if job else None
+
+
+def claim(worker: str):
+    """
+    Toma el trabajo en cola más antiguo (o None). La fila se bloquea con
+    FOR UPDATE SKIP LOCKED: dos workers nunca toman el mismo trabajo ni se
+    esperan entre sí.
+    """
+    global _skip_locked
+    with db_connection() as conn:
+        if not conn:
+            raise JobError("Database connection failed")
+        try:
+            with conn.cursor() as cur:
+                sql = """
+                    SELECT * FROM jobs
+                    WHERE status = 'queued' AND run_after <= NOW()
+                    ORDER BY id_job
+                    LIMIT 1
+                    FOR UPDATE
+                """
+                try:
+                    cur.execute(f"{sql} SKIP LOCKED" if _skip_locked else sql)
+                except pymysql.err.ProgrammingError as e:
+                    if e.args[0] != 1064 or not _skip_locked:
+                        raise
+                    print("⚠️ El servidor no soporta SKIP LOCKED; los workers esperarán el lock")
+                    _skip_locked = False
+                    conn.rollback()
+                    cur.execute(sql)
+
+                job = cur.fetchone()
+                if job is None:
+                    conn.rollback()
+                    return None
+
+                cur.execute(
+                    """
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, worker = %s,
+                        started_at = NOW(), heartbeat_at = NOW()
+                    WHERE id_job = %s
+                    """,
+                    (worker, job["id_job"])
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    job["attempts"] += 1
+    return _decode(job)
+
+
+def heartbeat(id_job: int):
+    with db_connection() as conn:
+        if not conn:
+            return
+        with conn.cursor() as cur:
+            cur.execute("UPDATE jobs SET heartbeat_at = NOW() WHERE id_job = %s AND status = 'running'", (id_job,))
+        conn.commit()
+
+
+def complete(id_job: int, result):
+    with db_connection() as conn:
+        if not conn:
+            raise JobError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE jobs
+                SET status = 'succeeded', result = %s, error = NULL,
+                    active_key = NULL, finished_at = NOW()
+                WHERE id_job = %s
+                """,
+                (json.dumps(result, default=str), id_job)
+            )
+        conn.commit()
+
+
+def fail(id_job: int, error: str, retry: bool = True):
+    """
+    Vuelve a encolar con backoff si quedan intentos; si no, lo marca failed
+    y libera su dedupe_key
+    """
+    with db_connection() as conn:
+        if not conn:
+            raise JobError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE jobs
+                SET status = IF(%s AND attempts < max_attempts, 'queued', 'failed'),
+                    active_key = IF(%s AND attempts < max_attempts, active_key, NULL),
+                    run_after = NOW() + INTERVAL (%s * attempts * attempts) SECOND,
+                    finished_at = IF(%s AND attempts < max_attempts, NULL, NOW()),
+                    error = %s
+                WHERE id_job = %s
+                """,
+                (retry, retry, RETRY_BASE_SECONDS, retry, error[:10000], id_job)
+            )
+        conn.commit()
+
+
+def requeue_stale() -> int:
+    """Trabajos running sin heartbeat reciente (worker caído) vuelven a la cola"""
+    with db_connection() as conn:
+        if not conn:
+            return 0
+        with conn.cursor() as cur:
+            requeued = cur.execute(
+                """
+                UPDATE jobs
+                SET status = IF(attempts < max_attempts, 'queued', 'failed'),
+                    active_key = IF(attempts < max_attempts, active_key, NULL),
+                    finished_at = IF(attempts < max_attempts, NULL, NOW()),
+                    error = 'Worker sin heartbeat'
+                WHERE status = 'running'
+                  AND heartbeat_at < NOW() - INTERVAL %s SECOND
+                """,
+                (STALE_SECONDS,)
+            )
+        conn.commit()
+    return requeued
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Errores del cliente (HTTPException 4xx, ValueError) o JobFailed: reintentar no sirve"""
+    status = getattr(error, "status_code", None)
+    return isinstance(error, (ValueError, JobFailed)) or (status is not None and status < 500)
+
+
+def run_job(job: dict):
+    """Ejecuta un trabajo ya reclamado, con heartbeat mientras corre"""
+    func = _handlers.get(job["kind"])
+    if func is None:
+        fail(job["id_job"], f"Unknown job kind: {job['kind']}", retry=False)
+        return
+
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(HEARTBEAT_SECONDS):
+            try:
+                heartbeat(job["id_job"])
+            except Exception as e:
+                print(f"⚠️ Error en heartbeat del trabajo {job['id_job']}: {e}")
+
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        print(f"\n▶️ Trabajo {job['id_job']} ({job['kind']}), intento {job['attempts']}")
+        result = func(job["payload"])
+        complete(job["id_job"], result)
+        status = "succeeded"
+        print(f"✓ Trabajo {job['id_job']} terminado")
+    except Exception as e:
+        error = str(getattr(e, "detail", None) or e) or type(e).__name__
+        print(f"❌ Trabajo {job['id_job']} falló: {error}")
+        fail(job["id_job"], error, retry=not _is_permanent(e))
+    finally:
+        done.set()
+        beater.join()
+        metrics.JOB_DURATION.observe(time.perf_counter() - start, job["kind"], status)
+
+
+def run_worker(worker: str = None, once: bool = False):
+    """
+    Bucle del worker: reclama y ejecuta trabajos uno a uno.
+    once=True termina cuando la cola queda vacía.
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    print(f"👷 Worker {worker} esperando trabajos ({', '.join(sorted(_handlers))})")
+    last_sweep = 0.0
+
+    while True:
+        if time.monotonic() - last_sweep >= HEARTBEAT_SECONDS:
+            requeued = requeue_stale()
+            if requeued:
+                print(f"♻️ {requeued} trabajos sin heartbeat devueltos a la cola")
+            last_sweep = time.monotonic()
+
+        job = claim(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_SECONDS)
+            continue
+        run_job(job)
@@ -1,30 +1,82 @@
 # App + endpoint único
-from fastapi import FastAPI, Depends, Request, BackgroundTasks
-from .auth import login, auth_middleware, get_user_modules
+import json
+import time
+from fastapi import FastAPI, Depends, Request, BackgroundTasks, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from .auth import login, auth_middleware
 from .crud import crud_action
-from .db import get_connection
+from .db import db_connection, pool
+from .async_db import close_async_pool
+from .schema import schema
+from .cache import cache
+from . import metrics, timing, upstream
 from routes.gbif import router as gbif_router
 from routes.semantic_translator import router as semantic_translator_router
 from routes.grid_h3 import router as grid_h3_router
 from routes.climatic import router as climatic_router
-from agronomic.agronomic import enrich_species_agronomy_sync
+from routes.jobs import router as jobs_router, enqueue
+from agronomic.agronomic import enrich_species_agronomy, enrich_species_agronomy_sync
+from . import jobs
 
 app = FastAPI()
 
+
+@app.on_event("startup")
+def load_db_schema():
+    # Si la BD no está disponible aquí, el CRUD lo carga en su primer uso
+    try:
+        schema.load()
+    except Exception as e:
+        print(f"Schema not loaded at startup: {e}")
+
+
+@app.on_event("shutdown")
+async def close_db_pools():
+    pool.close_all()
+    await close_async_pool()
+    upstream.close_session()
+    await upstream.close_async_session()
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    timeline = timing.start_timeline()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        # Etapas medidas con app.timing.span() durante la petición
+        response.headers["Server-Timing"] = timeline.header()
+        return response
+    finally:
+        # Plantilla de la ruta (/api/v1/.../{id}) para no crear una serie por URL
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        metrics.REQUEST_LATENCY.observe(
+            time.perf_counter() - start, request.method, path, str(status)
+        )
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render_all(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def health():
-    return {
-        "db_connected": bool(get_connection())
-    }
+    with db_connection() as conn:
+        return {
+            "db_connected": bool(conn),
+            "db_pool": pool.stats(),
+            "cache": cache.stats()
+        }
 
 @app.post("/login")
 def login_endpoint(body: dict):
     login_result = login(body["username"], body["password"])
-    modules = get_user_modules(login_result["id_user"])
     
     return {
         "token": login_result["token"],
-        "modulos": modules
+        "modulos": login_result["modules"]
     }
 
 @app.post("/api/v1/crud")
@@ -33,15 +85,51 @@ async def crud_endpoint(
     request: Request,
     _=Depends(auth_middleware)
 ):
-    return crud_action(
-        action=body["action"],
-        table=body["table"],
-        data=body.get("data"),
-        where=body.get("where")
-    )
+    """
+    Opciones de lectura (action="read"): columns, limit, cursor, stream.
+    Con "stream": true o Accept: application/x-ndjson las filas se envían
+    como NDJSON (una fila JSON por línea) sin cargarlas completas en memoria.
+    """
+    wants_ndjson = "application/x-ndjson" in request.headers.get("accept", "")
+    # crud_action es síncrono (valida contra el esquema): fuera del event loop
+    try:
+        if body["action"] == "read" and (body.get("stream") or wants_ndjson):
+            rows = await run_in_threadpool(
+                crud_action,
+                action="read",
+                table=body["table"],
+                where=body.get("where"),
+                columns=body.get("columns"),
+                limit=body.get("limit"),
+                cursor=body.get("cursor"),
+                stream=True
+            )
+            if isinstance(rows, dict):
+                # Sin conexión/esquema: {"connected": False}
+                return rows
+            # Starlette itera generadores síncronos en el threadpool
+            return StreamingResponse(
+                (json.dumps(row, default=str) + "\n" for row in rows),
+                media_type="application/x-ndjson"
+            )
+
+        return await run_in_threadpool(
+            crud_action,
+            action=body["action"],
+            table=body["table"],
+            data=body.get("data"),
+            where=body.get("where"),
+            columns=body.get("columns"),
+            limit=body.get("limit"),
+            cursor=body.get("cursor"),
+            update_columns=body.get("update_columns"),
+            chunk_size=body.get("chunk_size")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/v1/enrich/agronomy")
-def enrich_agronomy_endpoint(
+async def enrich_agronomy_endpoint(
     body: dict,
     request: Request,
     _=Depends(auth_middleware)
@@ -51,7 +139,9 @@ def enrich_agronomy_endpoint(
     
     Request body:
     {
-        "id_species": int
+        "id_species": int,
+        "include_timings": bool (opcional, duración de cada etapa en ms),
+        "background": bool (opcional, encola el pipeline y responde 202 con el id del trabajo)
     }
     
     Response:
@@ -72,15 +162,20 @@ def enrich_agronomy_endpoint(
     if not id_species:
         return {"error": "Missing id_species in request body"}
     
-    db = get_connection()
-    if not db:
-        return {"error": "Database connection failed"}
+    if body.get("background"):
+        return await run_in_threadpool(
+            enqueue, "agronomy", {"id_species": id_species}, dedupe_key=f"agronomy:{id_species}"
+        )
     
-    try:
-        result = enrich_species_agronomy_sync(id_species, db)
-        return result
-    finally:
-        db.close()
+    result = await enrich_species_agronomy(id_species)
+    if body.get("include_timings"):
+        result["timings"] = timing.current_timings()
+    return result
+
+@jobs.handler("agronomy")
+def run_agronomy_job(payload: dict) -> dict:
+    # El worker no tiene event loop: el wrapper síncrono crea y cierra uno
+    return jobs.require_success(enrich_species_agronomy_sync(payload["id_species"]))
 
 app.include_router(
     gbif_router,
@@ -104,4 +199,10 @@ app.include_router(
     climatic_router,
     prefix="/api/v1/climatic",
     tags=["Climatic Niche"]
-)
\ No newline at end of file
+)
+
+app.include_router(
+    jobs_router,
+    prefix="/api/v1/jobs",
+    tags=["Jobs"]
+)
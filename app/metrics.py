@@ -0,0 +1,226 @@
+# Métricas en memoria expuestas en formato de texto de Prometheus
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(names: tuple, values: tuple, extra: dict = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label_values -> [bucket_counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (bucket_counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = _format_labels(self.labels, label_values, {"le": bound})
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, label_values, {"le": "+Inf"})
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class GaugeCollector:
+    """Gauges calculados al momento del scrape a partir de un callback"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple, collect):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect  # () -> [(label_values, value), ...]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class CounterCollector(GaugeCollector):
+    """Contadores acumulados que lleva otro objeto (p.ej. pool.stats()), leídos en el scrape"""
+    metric_type = "counter"
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_all() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============= MÉTRICAS DE LA APLICACIÓN =============
+
+REQUEST_LATENCY = register(Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta",
+    labels=("method", "route", "status"),
+))
+
+DB_POOL_WAIT = register(Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Tiempo de espera para obtener una conexión del pool",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+))
+
+UPSTREAM_LATENCY = register(Histogram(
+    "upstream_request_duration_seconds",
+    "Latencia de las llamadas a APIs externas por host",
+    labels=("host",),
+))
+
+UPSTREAM_ERRORS = register(Counter(
+    "upstream_errors_total",
+    "Errores de APIs externas por host y tipo (status HTTP o excepción)",
+    labels=("host", "kind"),
+))
+
+UPSTREAM_RETRIES = register(Counter(
+    "upstream_retries_total",
+    "Reintentos a APIs externas por host y motivo (status HTTP o connection)",
+    labels=("host", "reason"),
+))
+
+PIPELINE_STAGE = register(Histogram(
+    "pipeline_stage_duration_seconds",
+    "Duración de cada etapa de los pipelines largos",
+    labels=("pipeline", "stage"),
+))
+
+JOB_DURATION = register(Histogram(
+    "job_duration_seconds",
+    "Duración de los trabajos en segundo plano por tipo y resultado",
+    labels=("kind", "status"),
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+))
+
+
+def register_pool_metrics(pool):
+    """Utilización (gauges) y eventos acumulados (counters) del pool de conexiones (app.db)"""
+    fields = ("max_size", "opened", "idle", "in_use")
+    register(GaugeCollector(
+        "db_pool_connections",
+        "Conexiones del pool por estado",
+        labels=("state",),
+        collect=lambda: [((field,), pool.stats()[field]) for field in fields],
+    ))
+    register(CounterCollector(
+        "db_pool_events_total",
+        "Eventos del pool desde el arranque (acquired, released, created, discarded, timeouts)",
+        labels=("event",),
+        collect=lambda: [
+            ((event,), pool.stats()[event])
+            for event in ("acquired", "released", "created", "discarded", "timeouts")
+        ],
+    ))
+
+
+_caches = {}
+
+
+def register_cache(name: str, cache):
+    """Agrega un cache (con stats()["tables"] de hits/misses) a las métricas"""
+    _caches[name] = cache
+
+
+def _collect_cache_lookups():
+    samples = []
+    for name, cache in _caches.items():
+        for table, stats in cache.stats()["tables"].items():
+            samples.append(((name, table, "hits"), stats["hits"]))
+            samples.append(((name, table, "misses"), stats["misses"]))
+    return samples
+
+
+def _collect_cache_hit_ratio():
+    samples = []
+    for name, cache in _caches.items():
+        for table, stats in cache.stats()["tables"].items():
+            total = stats["hits"] + stats["misses"]
+            samples.append(((name, table), round(stats["hits"] / total, 4) if total else 0))
+    return samples
+
+
+register(CounterCollector(
+    "cache_lookups_total",
+    "Hits y misses de los caches en memoria",
+    labels=("cache", "table", "kind"),
+    collect=_collect_cache_lookups,
+))
+register(GaugeCollector(
+    "cache_hit_ratio",
+    "Hit ratio de los caches en memoria",
+    labels=("cache", "table"),
+    collect=_collect_cache_hit_ratio,
+))
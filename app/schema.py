@@ -0,0 +1,118 @@
+# Introspección del esquema (information_schema) para el CRUD genérico
+import threading
+from .db import db_connection
+
+
+class SchemaError(ValueError):
+    """Tabla o columna que no existe en el esquema"""
+    pass
+
+
+class SchemaUnavailable(RuntimeError):
+    """No se pudo cargar el esquema (BD no disponible)"""
+    pass
+
+
+class TableSchema:
+    def __init__(self, name: str):
+        self.name = name
+        self.columns = []
+        self.primary_key = []
+        self.unique_keys = []
+
+    @property
+    def key_columns(self) -> set:
+        """Columnas de la llave primaria y de cualquier llave única"""
+        keys = set(self.primary_key)
+        for unique in self.unique_keys:
+            keys.update(unique)
+        return keys
+
+
+class SchemaCache:
+    """
+    Tablas, columnas y llaves de la base de datos actual, cargadas una vez
+    desde information_schema. Se carga perezosamente en el primer uso si el
+    arranque no pudo hacerlo (p.ej. BD caída).
+    """
+
+    def __init__(self):
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def load(self, conn=None):
+        """Carga (o recarga) el esquema; devuelve False si no hay BD"""
+        if conn is None:
+            with db_connection() as pooled:
+                return self.load(pooled) if pooled else False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+                """
+            )
+            columns = cur.fetchall()
+            cur.execute(
+                """
+                SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND NON_UNIQUE = 0
+                ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+                """
+            )
+            indexes = cur.fetchall()
+
+        tables = {}
+        for row in columns:
+            table = tables.setdefault(row["TABLE_NAME"], TableSchema(row["TABLE_NAME"]))
+            table.columns.append(row["COLUMN_NAME"])
+
+        unique = {}
+        for row in indexes:
+            unique.setdefault((row["TABLE_NAME"], row["INDEX_NAME"]), []).append(row["COLUMN_NAME"])
+        for (table_name, index_name), cols in unique.items():
+            table = tables.get(table_name)
+            if table is None:
+                continue
+            if index_name == "PRIMARY":
+                table.primary_key = cols
+            else:
+                table.unique_keys.append(tuple(cols))
+
+        with self._lock:
+            self._tables = tables
+        return True
+
+    def table(self, name: str) -> TableSchema:
+        if self._tables is None:
+            with self._lock:
+                loaded = self._tables is not None
+            if not loaded and not self.load():
+                raise SchemaUnavailable("Database schema not available")
+
+        table = self._tables.get(name)
+        if table is None:
+            raise SchemaError(f"Unknown table: {name}")
+        return table
+
+    def validate(self, name: str, *column_groups) -> TableSchema:
+        """
+        Verifica que la tabla y todas las columnas existan
+
+        Raises:
+            SchemaError: tabla o columna desconocida
+        """
+        table = self.table(name)
+        known = set(table.columns)
+        for group in column_groups:
+            unknown = [c for c in (group or ()) if c not in known]
+            if unknown:
+                raise SchemaError(f"Unknown column(s) for {name}: {', '.join(unknown)}")
+        return table
+
+
+schema = SchemaCache()
@@ -0,0 +1,98 @@
+# Spans de tiempo por etapa para los pipelines largos (Server-Timing)
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from . import metrics
+
+# Timeline de la petición actual y ruta del span abierto (para anidar)
+_timeline = ContextVar("timing_timeline", default=None)
+_path = ContextVar("timing_path", default=())
+
+
+class Timeline:
+    """Spans terminados de una petición, en orden de cierre"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # (name, duration_ms)
+
+    def add(self, name: str, duration_ms: float):
+        self.spans.append((name, duration_ms))
+
+    def as_dict(self) -> dict:
+        """{nombre: ms}; si un nombre se repite se suman sus duraciones"""
+        result = {}
+        for name, duration_ms in self.spans:
+            result[name] = round(result.get(name, 0) + duration_ms, 2)
+        return result
+
+    def header(self) -> str:
+        """Valor del header Server-Timing (incluye el total de la petición)"""
+        total_ms = (time.perf_counter() - self.started) * 1000
+        entries = [f"{name};dur={ms}" for name, ms in self.as_dict().items()]
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries)
+
+
+def start_timeline() -> Timeline:
+    """Abre el timeline de la petición actual (lo llama el middleware)"""
+    timeline = Timeline()
+    _timeline.set(timeline)
+    return timeline
+
+
+def current_timings() -> dict:
+    """Spans registrados hasta ahora en la petición actual ({} fuera de una)"""
+    timeline = _timeline.get()
+    return timeline.as_dict() if timeline else {}
+
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """
+    Mide una etapa: alimenta el histograma pipeline_stage_duration_seconds y,
+    dentro de una petición, el header Server-Timing. Los spans anidados se
+    nombran padre.hijo.
+
+    Uso:
+        with span("climate_niche", "percentiles"):
+            ...
+    """
+    path = _path.get() + (stage,)
+    token = _path.set(path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _path.reset(token)
+        metrics.PIPELINE_STAGE.observe(elapsed, pipeline, stage)
+        timeline = _timeline.get()
+        if timeline is not None:
+            timeline.add(".".join(path), elapsed * 1000)
+
+
+def timed(pipeline: str, stage: str = None):
+    """
+    Decorador equivalente a span() para funciones sync o async;
+    por defecto el nombre de la etapa es el de la función
+    """
+    def decorator(func):
+        name = stage or func.__name__.lstrip("_")
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(pipeline, name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(pipeline, name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,469 @@
+# Llamadas HTTP a APIs externas (GBIF, OTOL, Open-Meteo, Open-Elevation, OpenAI)
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from . import metrics
+
+load_dotenv()
+
+# Conexiones keep-alive por host (sync y async) y total del cliente async
+MAX_PER_HOST = int(os.getenv("UPSTREAM_MAX_PER_HOST", "10"))
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+# Timeout de conexión fijo; el de lectura lo elige cada llamada (o el default)
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": os.getenv("UPSTREAM_USER_AGENT", "agro-api/1.0"),
+}
+
+# Peticiones por segundo por host (UPSTREAM_RATE_LIMITS="api.gbif.org=30,api.openai.com=2")
+RATE_LIMITS = {
+    "api.gbif.org": 20,
+    "api.opentreeoflife.org": 5,
+    "archive-api.open-meteo.com": 5,
+    "api.open-elevation.com": 2,
+    "api.openai.com": 5,
+}
+DEFAULT_RATE = float(os.getenv("UPSTREAM_DEFAULT_RATE", "10"))
+
+# Reintentos con backoff exponencial + jitter (o lo que pida Retry-After)
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Un Retry-After mayor a esto no se espera: se abre el breaker por ese tiempo
+MAX_RETRY_AFTER = float(os.getenv("UPSTREAM_MAX_RETRY_AFTER", "60"))
+
+# Circuit breaker: fallos seguidos para abrir y segundos abierto
+BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+
+
+class UpstreamUnavailable(RuntimeError):
+    """El breaker del host está abierto o el host sigue limitando tras los reintentos"""
+    pass
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc or url
+
+
+@contextmanager
+def track(url_or_host: str):
+    """
+    Registra latencia y errores de una llamada externa hecha con otro
+    cliente (aiohttp, SDK de OpenAI). Las excepciones cuentan como error.
+    """
+    host = host_of(url_or_host)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(host, type(e).__name__)
+        raise
+    finally:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, host)
+
+
+# ============= LIMITADOR Y CIRCUIT BREAKER POR HOST =============
+# Estado por proceso, compartido por los hilos (requests) y las tareas
+# async (aiohttp) que llaman al mismo host
+
+
+class TokenBucket:
+    """
+    Token bucket de rate peticiones/segundo.
+
+    Adaptativo: cada 429 reduce el ritmo a la mitad (hasta min_rate) y cada
+    respuesta buena lo recupera un 5% del máximo, así el ritmo se queda
+    cerca de la cuota real del proveedor.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.max_rate = rate
+        self.min_rate = rate / 10
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Toma un token; devuelve los segundos a esperar antes de usarlo"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class CircuitBreaker:
+    """
+    closed -> open tras threshold fallos seguidos. Vencido el cooldown deja
+    pasar una petición de prueba por cooldown (half-open): si sale bien se
+    cierra; si falla sigue abierto otro cooldown.
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.open_until is None:
+            return "closed"
+        return "half_open" if time.monotonic() >= self.open_until else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.open_until is None:
+                return True
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            # Prueba: las demás peticiones esperan otro cooldown
+            self.open_until = now + self.cooldown
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+    def trip(self, seconds: float):
+        """Abre el breaker por un tiempo explícito (p.ej. Retry-After largo)"""
+        with self._lock:
+            self.open_until = time.monotonic() + max(seconds, self.cooldown)
+
+
+def _rates_from_env() -> dict:
+    rates = dict(RATE_LIMITS)
+    for item in os.getenv("UPSTREAM_RATE_LIMITS", "").split(","):
+        host, _, rate = item.partition("=")
+        if host.strip() and rate.strip():
+            rates[host.strip()] = float(rate)
+    return rates
+
+
+_rates = _rates_from_env()
+_limiters = {}
+_breakers = {}
+_policy_lock = threading.Lock()
+
+
+def limiter(host: str) -> TokenBucket:
+    bucket = _limiters.get(host)
+    if bucket is None:
+        with _policy_lock:
+            bucket = _limiters.setdefault(host, TokenBucket(_rates.get(host, DEFAULT_RATE)))
+    return bucket
+
+
+def breaker(host: str) -> CircuitBreaker:
+    circuit = _breakers.get(host)
+    if circuit is None:
+        with _policy_lock:
+            circuit = _breakers.setdefault(host, CircuitBreaker())
+    return circuit
+
+
+def _check_breaker(host: str):
+    if not breaker(host).allow():
+        metrics.UPSTREAM_ERRORS.inc(host, "circuit_open")
+        raise UpstreamUnavailable(f"{host}: circuit breaker abierto")
+
+
+def _retry_after(value) -> float:
+    """Header Retry-After (segundos o fecha HTTP) -> segundos, o None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int, retry_after: float = None) -> float:
+    """Full jitter sobre base * 2^intento; nunca menos que Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _on_status(host: str, status: int, retry_after: float):
+    """Actualiza limitador y breaker según el status; True si vale reintentar"""
+    if status not in RETRY_STATUSES:
+        limiter(host).succeeded()
+        breaker(host).record_success()
+        return False
+    if status == 429:
+        limiter(host).throttled()
+    if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+        breaker(host).trip(retry_after)
+        return False
+    breaker(host).record_failure()
+    return True
+
+
+def call(host: str, func, *args, retry_on: tuple = (), **kwargs):
+    """
+    Llama a un cliente de terceros (SDK de OpenAI) con el limitador, los
+    reintentos y el breaker del host. retry_on: excepciones transitorias;
+    si traen .status_code / .response.headers se respeta Retry-After.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        _check_breaker(host)
+        limiter(host).acquire()
+        try:
+            with track(host):
+                result = func(*args, **kwargs)
+        except retry_on as e:
+            status = getattr(e, "status_code", None) or 503
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            retry_after = _retry_after(headers.get("Retry-After"))
+            if not _on_status(host, status, retry_after) or attempt >= MAX_RETRIES:
+                raise
+            metrics.UPSTREAM_RETRIES.inc(host, str(status))
+            time.sleep(_backoff(attempt, retry_after))
+            continue
+        _on_status(host, 200, None)
+        return result
+
+
+# ============= CLIENTE SÍNCRONO (requests) =============
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Session compartida por todo el proceso: reutiliza conexiones TCP+TLS
+    por host. pool_block=True limita a MAX_PER_HOST conexiones por host;
+    los hilos que excedan el límite esperan a que se libere una.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=16,
+                    pool_maxsize=MAX_PER_HOST,
+                    pool_block=True,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                _session = session
+    return _session
+
+
+def _timeout(timeout) -> tuple:
+    if timeout is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if isinstance(timeout, (int, float)):
+        return (min(CONNECT_TIMEOUT, timeout), timeout)
+    return timeout
+
+
+def request(method: str, url: str, timeout=None, idempotent: bool = None, **kwargs) -> requests.Response:
+    """
+    Petición por la Session compartida con métricas por host;
+    status >= 400 cuenta como error. timeout numérico = timeout de lectura.
+
+    Pasa por el limitador y el breaker del host y reintenta 429/5xx y
+    errores de conexión. Las peticiones no idempotentes (POST salvo
+    idempotent=True) solo se reintentan con 429/503, que no se procesaron.
+
+    Raises:
+        UpstreamUnavailable si el breaker del host está abierto
+    """
+    host = host_of(url)
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+    session = get_session()
+
+    for attempt in range(MAX_RETRIES + 1):
+        _check_breaker(host)
+        limiter(host).acquire()
+        try:
+            with track(host):
+                response = session.request(method, url, timeout=_timeout(timeout), **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker(host).record_failure()
+            if not idempotent or attempt >= MAX_RETRIES:
+                raise
+            metrics.UPSTREAM_RETRIES.inc(host, "connection")
+            time.sleep(_backoff(attempt))
+            continue
+
+        status = response.status_code
+        if status >= 400:
+            metrics.UPSTREAM_ERRORS.inc(host, str(status))
+        retry_after = _retry_after(response.headers.get("Retry-After"))
+        retry = _on_status(host, status, retry_after)
+        if not retry or attempt >= MAX_RETRIES or not (idempotent or status in (429, 503)):
+            return response
+
+        response.close()
+        metrics.UPSTREAM_RETRIES.inc(host, str(status))
+        time.sleep(_backoff(attempt, retry_after))
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# ============= CLIENTE ASÍNCRONO (aiohttp) =============
+# Una sesión por event loop: las sesiones de aiohttp quedan ligadas a su loop
+
+_async_sessions = {}
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """Sesión aiohttp compartida del event loop actual"""
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_PER_HOST,
+            ttl_dns_cache=300,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            headers=DEFAULT_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """Cierra la sesión del event loop actual (llamar antes de cerrar el loop)"""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def get_json_async(url: str, params: dict = None, timeout: float = None):
+    """
+    GET asíncrono por la sesión compartida con métricas por host,
+    con el mismo limitador, reintentos y breaker que request()
+
+    Returns:
+        JSON de la respuesta, o None si el status no es 200
+
+    Raises:
+        UpstreamUnavailable si el breaker está abierto o el host sigue
+        limitando (429) tras los reintentos
+    """
+    host = host_of(url)
+    kwargs = {}
+    if timeout:
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, sock_connect=CONNECT_TIMEOUT)
+    session = get_async_session()
+
+    for attempt in range(MAX_RETRIES + 1):
+        _check_breaker(host)
+        await limiter(host).acquire_async()
+        try:
+            with track(host):
+                async with session.get(url, params=params, **kwargs) as resp:
+                    status = resp.status
+                    retry_after = _retry_after(resp.headers.get("Retry-After"))
+                    data = await resp.json() if status == 200 else None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            breaker(host).record_failure()
+            if attempt >= MAX_RETRIES:
+                raise
+            metrics.UPSTREAM_RETRIES.inc(host, "connection")
+            await asyncio.sleep(_backoff(attempt))
+            continue
+
+        if status != 200:
+            metrics.UPSTREAM_ERRORS.inc(host, str(status))
+        retry = _on_status(host, status, retry_after)
+        if not retry or attempt >= MAX_RETRIES:
+            if status == 429:
+                raise UpstreamUnavailable(f"{host}: limitado (429) tras {attempt + 1} intentos")
+            return data
+
+        metrics.UPSTREAM_RETRIES.inc(host, str(status))
+        await asyncio.sleep(_backoff(attempt, retry_after))
+
+
+def _collect_policies():
+    samples = []
+    for host, bucket in list(_limiters.items()):
+        samples.append(((host, "rate"), round(bucket.rate, 3)))
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    for host, circuit in list(_breakers.items()):
+        samples.append(((host, "breaker_state"), states[circuit.state]))
+    return samples
+
+
+metrics.register(metrics.GaugeCollector(
+    "upstream_policy",
+    "Ritmo actual del limitador (req/s) y estado del breaker (0 cerrado, 1 prueba, 2 abierto) por host",
+    labels=("host", "kind"),
+    collect=_collect_policies,
+))
@@ -0,0 +1,12 @@
+# Worker de la cola de trabajos (app.jobs)
+#
+#   python -m app.worker          # corre indefinidamente
+#   python -m app.worker --once   # termina cuando la cola queda vacía
+#
+# Se pueden correr varios procesos a la vez: cada uno toma trabajos distintos.
+import sys
+from . import jobs
+from . import main  # noqa: F401  (importa las rutas, que registran los handlers)
+
+if __name__ == "__main__":
+    jobs.run_worker(once="--once" in sys.argv[1:])
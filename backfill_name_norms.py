@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Llena las columnas de nombre normalizado de filas ya existentes con la misma
+normalización que usa la aplicación (gbif.normalizer.fold_name), para que
+la deduplicación y las llaves únicas de las migraciones coincidan con lo que
+escribe el código.
+
+Orden (igual para ecological_zones con migrations_zone_names*.sql):
+    migrations_vernacular_names.sql
+    python backfill_name_norms.py vernacular_names
+    migrations_vernacular_names_unique.sql
+"""
+import sys
+from app.db import db_connection
+from gbif.normalizer import fold_name
+
+# tabla: (llave primaria, columna con el nombre, columna normalizada)
+TABLES = {
+    "vernacular_names": ("id_vernacular", "common_name", "common_name_norm"),
+    "ecological_zones": ("id_zone", "zone_name", "zone_name_norm"),
+}
+BATCH_SIZE = 1000
+
+
+def backfill(table: str) -> int:
+    """Recalcula la columna normalizada de todas las filas; devuelve cuántas cambiaron"""
+    key, name, norm = TABLES[table]
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT `{key}`, `{name}`, `{norm}` FROM `{table}`")
+            rows = cur.fetchall()
+
+        # Comparación binaria: la collation general_ci daría por iguales
+        # valores con distintos acentos
+        updates = [
+            (fold_name(row[name]), row[key])
+            for row in rows
+            if (row[norm] or "").encode() != fold_name(row[name]).encode()
+        ]
+        with conn.cursor() as cur:
+            for i in range(0, len(updates), BATCH_SIZE):
+                cur.executemany(
+                    f"UPDATE `{table}` SET `{norm}` = %s WHERE `{key}` = %s",
+                    updates[i:i + BATCH_SIZE]
+                )
+                conn.commit()
+
+    print(f"✓ {table}: {len(updates)} de {len(rows)} filas normalizadas")
+    return len(updates)
+
+
+if __name__ == "__main__":
+    for table in sys.argv[1:] or TABLES:
+        backfill(table)
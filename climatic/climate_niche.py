@@ -4,6 +4,7 @@ Orquesta todo el pipeline desde ocurrencias hasta percentiles
 """
 from typing import Dict, List
 from app.crud import crud_action
+from app.timing import span
 from .open_meteo_client import OpenMeteoClient
 from .open_elevation_client import OpenElevationClient
 from .grid_sampling import GridSampler
@@ -34,7 +35,8 @@ class ClimateNicheCalculator:
         """
         # PASO 1: Obtener ocurrencias
         print(f"[1/5] Obteniendo ocurrencias para especie {id_species}")
-        occurrences = ClimateNicheCalculator._get_occurrences(id_species)
+        with span("climate_niche", "occurrences"):
+            occurrences = ClimateNicheCalculator._get_occurrences(id_species)
         
         if not occurrences:
             return {
@@ -46,11 +48,12 @@ class ClimateNicheCalculator:
         
         # PASO 2: Muestreo inteligente
         print(f"[2/5] Realizando muestreo estratificado")
-        sampled = GridSampler.stratified_random_sample(
-            occurrences,
-            sample_size=sample_size,
-            grid_resolution=5
-        )
+        with span("climate_niche", "sampling"):
+            sampled = GridSampler.stratified_random_sample(
+                occurrences,
+                sample_size=sample_size,
+                grid_resolution=5
+            )
         print(f"  → {len(sampled)} puntos seleccionados después del muestreo")
         
         # PASO 3: Obtener clima histórico
@@ -58,23 +61,24 @@ class ClimateNicheCalculator:
         climate_list = []
         coords_for_elevation = []
         
-        for i, occ in enumerate(sampled):
-            lat = occ.get("decimal_latitude")
-            lon = occ.get("decimal_longitude")
-            
-            if lat is None or lon is None:
-                continue
-            
-            # Obtener clima
-            daily_data = OpenMeteoClient.get_climate_data(lat, lon)
-            annual_stats = OpenMeteoClient.calculate_annual_stats(daily_data)
-            
-            if annual_stats:
-                climate_list.append(annual_stats)
-                coords_for_elevation.append((lat, lon))
-            
-            if (i + 1) % 5 == 0:
-                print(f"  → {i + 1}/{len(sampled)} puntos procesados")
+        with span("climate_niche", "climate"):
+            for i, occ in enumerate(sampled):
+                lat = occ.get("decimal_latitude")
+                lon = occ.get("decimal_longitude")
+                
+                if lat is None or lon is None:
+                    continue
+                
+                # Obtener clima
+                daily_data = OpenMeteoClient.get_climate_data(lat, lon)
+                annual_stats = OpenMeteoClient.calculate_annual_stats(daily_data)
+                
+                if annual_stats:
+                    climate_list.append(annual_stats)
+                    coords_for_elevation.append((lat, lon))
+                
+                if (i + 1) % 5 == 0:
+                    print(f"  → {i + 1}/{len(sampled)} puntos procesados")
         
         print(f"  → {len(climate_list)} puntos con datos climáticos válidos")
         
@@ -88,7 +92,8 @@ class ClimateNicheCalculator:
         print(f"[4/5] Obteniendo datos de altitud")
         elevation_list = []
         if coords_for_elevation:
-            elevation_list = OpenElevationClient.get_elevations_batch(coords_for_elevation)
+            with span("climate_niche", "elevation"):
+                elevation_list = OpenElevationClient.get_elevations_batch(coords_for_elevation)
             print(f"  → {sum(1 for e in elevation_list if e is not None)} altitudes obtenidas")
         
         # PASO 5: Calcular percentiles
@@ -100,12 +105,13 @@ class ClimateNicheCalculator:
         )
         
         # Calcular percentiles
-        niche_data = PercentileCalculator.calculate_climate_percentiles(
-            temp_min_list,
-            temp_max_list,
-            rainfall_list,
-            elevation_list
-        )
+        with span("climate_niche", "percentiles"):
+            niche_data = PercentileCalculator.calculate_climate_percentiles(
+                temp_min_list,
+                temp_max_list,
+                rainfall_list,
+                elevation_list
+            )
         
         niche_data["id_species"] = id_species
         niche_data["points_sampled"] = len(sampled)
@@ -127,10 +133,12 @@ class ClimateNicheCalculator:
             Lista de ocurrencias con coordenadas
         """
         try:
+            # Solo coordenadas: evita traer columnas de texto (habitat, locality...)
             result = crud_action(
                 action="read",
                 table="occurrences",
-                where={"id_species": id_species}
+                where={"id_species": id_species},
+                columns=["decimal_latitude", "decimal_longitude"]
             )
             return result if result else []
         except Exception as e:
@@ -1,7 +1,7 @@
 """
 Cliente para obtener datos de altitud desde Open-Elevation API
 """
-import requests
+from app import upstream
 from typing import List, Dict
 
 
@@ -25,7 +25,7 @@ class OpenElevationClient:
         }
         
         try:
-            response = requests.get(OpenElevationClient.BASE_URL, params=params, timeout=10)
+            response = upstream.get(OpenElevationClient.BASE_URL, params=params, timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -60,7 +60,7 @@ class OpenElevationClient:
             }
             
             try:
-                response = requests.get(
+                response = upstream.get(
                     OpenElevationClient.BASE_URL,
                     params=params,
                     timeout=30
@@ -1,7 +1,7 @@
 """
 Cliente para obtener datos climáticos históricos de Open-Meteo
 """
-import requests
+from app import upstream
 from typing import Dict, List, Tuple
 import statistics
 from datetime import datetime, timedelta
@@ -45,7 +45,7 @@ class OpenMeteoClient:
         }
         
         try:
-            response = requests.get(OpenMeteoClient.BASE_URL, params=params, timeout=30)
+            response = upstream.get(OpenMeteoClient.BASE_URL, params=params, timeout=30)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -1,9 +1,27 @@
-import requests
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from app import upstream
+from gbif import metadata_cache
 
 GBIF_URL = "https://api.gbif.org/v1"
 OTOL_URL = "https://api.opentreeoflife.org/v3"
 INATURALIST_URL = "https://api.inaturalist.org/v1"
 
+# Páginas de occurrence/search pedidas en paralelo
+GBIF_PAGE_WORKERS = int(os.getenv("GBIF_PAGE_WORKERS", "4"))
+# Nombres resueltos en paralelo por search_species_batch
+GBIF_RESOLVE_WORKERS = int(os.getenv("GBIF_RESOLVE_WORKERS", "8"))
+# Nombres por petición a TNRS y lineages de OTOL pedidos en paralelo
+OTOL_TNRS_BATCH = 1000
+OTOL_LINEAGE_WORKERS = int(os.getenv("OTOL_LINEAGE_WORKERS", "8"))
+# Límite de ocurrencias con coordenadas por importación
+GBIF_MAX_OCCURRENCES = 100000
+# occurrence/search rechaza offset + limit > 100,000
+GBIF_MAX_OFFSET = 100000
+
 def get_occurrence_taxon_key(species):
     return species["key"] if species["rank"] == "SPECIES" else species["usageKey"]
 
@@ -11,6 +29,11 @@ def search_species(name: str):
     """
     Busca una especie en GBIF por nombre común o científico
     """
+    return _search_species(name, get_species)
+
+
+def _search_species(name: str, fetch_species):
+    """search_species con el /species/{key} inyectable (ver search_species_batch)"""
     try:
         print(f"\n🔍 Buscando especie: {name}")
 
@@ -34,7 +57,7 @@ def search_species(name: str):
                 key = match["usageKey"]
 
                 try:
-                    full = get_species(key)
+                    full = fetch_species(key)
                     print(f"✓ Taxón aceptado: key={key}")
                     return full
                 except Exception:
@@ -44,13 +67,12 @@ def search_species(name: str):
                 print(" Match no confiable, usando fallback search")
 
         # Fallback
-        res = requests.get(
+        data = metadata_cache.fetch_json(
+            "species_search", "GET",
             f"{GBIF_URL}/species/search",
-            params={"q": name, "limit": 10},
-            timeout=10
+            params={"q": name, "limit": 10}
         )
-        res.raise_for_status()
-        results = res.json().get("results", [])
+        results = (data or {}).get("results", [])
 
         if results:
             for r in results:
@@ -68,6 +90,56 @@ def search_species(name: str):
         return None
 
 
+def _shared_lookup(fetch):
+    """
+    Envuelve fetch(key) para que hilos concurrentes que piden la misma llave
+    compartan una sola llamada (y su resultado o excepción)
+    """
+    futures = {}
+    lock = threading.Lock()
+
+    def lookup(key):
+        with lock:
+            future = futures.get(key)
+            owner = future is None
+            if owner:
+                future = futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(fetch(key))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    return lookup
+
+
+def search_species_batch(names: list, workers: int = None) -> dict:
+    """
+    Resuelve muchos nombres a la vez con search_species en paralelo
+
+    Los nombres se deduplican (sin distinguir mayúsculas ni espacios) y se
+    resuelven con hasta `workers` hilos; los nombres que caen en el mismo
+    taxón comparten una sola consulta a /species/{key}.
+
+    Returns:
+        {nombre original: resultado de search_species (dict o None)}
+    """
+    workers = workers or GBIF_RESOLVE_WORKERS
+    unique = {}
+    for name in names:
+        unique.setdefault(" ".join(str(name).split()).casefold(), name)
+
+    fetch_species = _shared_lookup(get_species)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resolved = dict(zip(
+            unique.keys(),
+            executor.map(lambda name: _search_species(name, fetch_species), unique.values())
+        ))
+
+    return {name: resolved[" ".join(str(name).split()).casefold()] for name in names}
+
+
 def match_species(name: str):
     """
     Resuelve una especie a un taxonKey canónico usando GBIF (/species/match)
@@ -75,15 +147,13 @@ def match_species(name: str):
     try:
         print(f"\n Resolviendo especie: {name}")
 
-        res = requests.get(
+        data = metadata_cache.fetch_json(
+            "species_match", "GET",
             f"{GBIF_URL}/species/match",
-            params={"name": name},
-            timeout=10
+            params={"name": name}
         )
-        res.raise_for_status()
-        data = res.json()
 
-        if "usageKey" in data:
+        if data and "usageKey" in data:
             print(f"✓ Match: {data.get('scientificName')} (key: {data['usageKey']})")
             return data
         else:
@@ -96,73 +166,148 @@ def match_species(name: str):
 
 
 def get_species(gbif_key: int):
-    res = requests.get(
-        f"{GBIF_URL}/species/{gbif_key}",
-        timeout=10
-    )
-    res.raise_for_status()
-    return res.json()
+    data = metadata_cache.fetch_json("species", "GET", f"{GBIF_URL}/species/{gbif_key}")
+    if data is None:
+        raise ValueError(f"GBIF species {gbif_key} not found")
+    return data
 
 
-def get_taxonomy_from_otol(scientific_name: str):
+def get_taxonomy_from_otol(scientific_name: str, kingdom: str = None):
     """
     Obtiene la taxonomía completa (phylum, class, order, family, genus) 
     desde OpenTreeOfLife
+
+    kingdom: reino según GBIF; permite reusar el lineage de un género ya
+             visto sin confundirlo con un homónimo de otro reino
     """
-    try:
-        # Buscar la especie en OTOL - debe ser POST con JSON
-        res = requests.post(
+    kingdoms = {scientific_name: kingdom} if kingdom else None
+    return get_taxonomy_from_otol_batch([scientific_name], kingdoms=kingdoms).get(scientific_name, {})
+
+
+def _otol_match_names(names: list) -> dict:
+    """
+    Resuelve nombres con TNRS en peticiones de hasta OTOL_TNRS_BATCH nombres
+
+    Returns:
+        {nombre: taxon del primer match (con ott_id)}
+    """
+    taxa = {}
+    for start in range(0, len(names), OTOL_TNRS_BATCH):
+        chunk = names[start:start + OTOL_TNRS_BATCH]
+        data = metadata_cache.fetch_json(
+            "otol_match_names", "POST",
             f"{OTOL_URL}/tnrs/match_names",
-            json={"names": [scientific_name]},
-            timeout=10
-        )
-        res.raise_for_status()
-        data = res.json()
-        
-        results = data.get("results", [])
-        
-        if not results:
-            print(f" Sin resultados de OTOL")
-            return {}
-        
-        first_result = results[0]
-        matches = first_result.get("matches", [])
-        
-        if not matches:
-            print(f" No se encontró '{scientific_name}' en OpenTreeOfLife")
-            return {}
-        
-        match = matches[0]
-        ott_id = match.get("taxon", {}).get("ott_id")
-        
-        if not ott_id:
-            print(f" No se encontró ott_id en el match")
-            return {}
-        
-        print(f"✓ Encontrado en OTOL con ott_id: {ott_id}")
-        
-        # Obtener la taxonomía completa con lineage
-        res = requests.post(
-            f"{OTOL_URL}/taxonomy/taxon_info",
-            json={"ott_id": ott_id, "include_lineage": True},
-            timeout=10
+            json_body={"names": chunk}
         )
-        res.raise_for_status()
-        taxon_data = res.json()
-        
-        print(f"📍 Datos del taxón con lineage: {taxon_data}")
-        
-        # Extraer taxonomía del lineage
-        taxonomy = extract_taxonomy_from_lineage(taxon_data)
-        taxonomy["ott_id"] = ott_id
-        
-        return taxonomy
-        
+        for result in (data or {}).get("results", []):
+            matches = result.get("matches", [])
+            if matches and matches[0].get("taxon", {}).get("ott_id"):
+                taxa[result.get("name")] = matches[0]["taxon"]
+    return taxa
+
+
+def _genus_of(taxon: dict):
+    """Género a partir del nombre aceptado del taxón (solo especies e inferiores)"""
+    if (taxon.get("rank") or "").lower() not in ("species", "subspecies", "variety", "forma"):
+        return None
+    name = taxon.get("unique_name") or taxon.get("name") or ""
+    return name.split()[0] if " " in name else None
+
+
+def _genus_index_key(kingdom: str, genus: str):
+    """
+    Llave del índice género -> ott_id. Hay géneros homónimos en distintos
+    reinos (Morus la planta y Morus el ave): sin reino no se usa el índice.
+    """
+    if not (kingdom and genus):
+        return None
+    return f"{kingdom.strip().lower()}:{genus}"
+
+
+def _otol_lineage(taxon: dict, kingdom: str = None) -> list:
+    """
+    Lineage [padre, abuelo, ...] de un taxón de OTOL
+
+    Los nodos de género y familia se guardan por ott_id en el cache de
+    metadatos (junto con un índice reino + género -> ott_id): una especie
+    cuyo género ya se vio en el mismo reino arma su lineage sin llamar a
+    taxon_info.
+    """
+    genus_key = _genus_index_key(kingdom, _genus_of(taxon))
+    if genus_key and not metadata_cache.is_bypassed():
+        hit, genus_ott = metadata_cache.cache.get("otol_genus", genus_key)
+        if hit and genus_ott:
+            hit, lineage = metadata_cache.cache.get("otol_lineage", str(genus_ott))
+            if hit and lineage:
+                return lineage
+
+    taxon_data = metadata_cache.fetch_json(
+        "otol_taxon_info", "POST",
+        f"{OTOL_URL}/taxonomy/taxon_info",
+        json_body={"ott_id": taxon["ott_id"], "include_lineage": True}
+    ) or {}
+
+    lineage = [
+        {"ott_id": node.get("ott_id"), "name": node.get("name"), "rank": node.get("rank")}
+        for node in taxon_data.get("lineage", [])
+    ]
+    for i, node in enumerate(lineage):
+        rank = (node["rank"] or "").lower()
+        if rank in ("genus", "family") and node["ott_id"]:
+            metadata_cache.cache.put("otol_lineage", str(node["ott_id"]), lineage[i:])
+            # Solo el género del propio taxón (el que lleva su nombre)
+            if rank == "genus" and genus_key and node["name"] == _genus_of(taxon):
+                metadata_cache.cache.put("otol_genus", genus_key, node["ott_id"])
+    return lineage
+
+
+def get_taxonomy_from_otol_batch(names: list, workers: int = None, kingdoms: dict = None) -> dict:
+    """
+    Taxonomía de OTOL para muchos nombres: una llamada TNRS para todos y
+    lineages en paralelo. Las especies del mismo género (y reino) se
+    procesan en secuencia para que solo la primera consulte taxon_info.
+
+    kingdoms: {nombre: reino de GBIF}; sin reino cada especie consulta su
+              propio lineage (ver _genus_index_key)
+
+    Returns:
+        {nombre: {phylum, class, order, family, genus, ott_id}} ({} si no se resolvió)
+    """
+    workers = workers or OTOL_LINEAGE_WORKERS
+    kingdoms = kingdoms or {}
+    unique = list(dict.fromkeys(names))
+    taxonomies = {name: {} for name in unique}
+
+    try:
+        taxa = _otol_match_names(unique)
     except Exception as e:
         print(f" Error consultando OpenTreeOfLife: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {}
+        return taxonomies
+
+    missing = [name for name in unique if name not in taxa]
+    if missing:
+        print(f" No se encontraron en OpenTreeOfLife: {', '.join(missing)}")
+
+    by_genus = {}
+    for name, taxon in taxa.items():
+        genus_key = _genus_index_key(kingdoms.get(name), _genus_of(taxon))
+        by_genus.setdefault(genus_key or f"ott{taxon['ott_id']}", []).append(name)
+
+    def resolve_group(group):
+        for name in group:
+            taxon = taxa[name]
+            try:
+                taxonomy = extract_taxonomy_from_lineage({"lineage": _otol_lineage(taxon, kingdoms.get(name))})
+                taxonomy["ott_id"] = taxon["ott_id"]
+                taxonomies[name] = taxonomy
+            except Exception as e:
+                print(f" Error obteniendo lineage de '{name}' (ott_id={taxon['ott_id']}): {e}")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(resolve_group, by_genus.values()))
+
+    print(f"✓ OTOL: {sum(1 for t in taxonomies.values() if t)}/{len(unique)} taxonomías resueltas")
+    return taxonomies
 
 
 def extract_taxonomy_from_lineage(taxon_data: dict) -> dict:
@@ -223,7 +368,7 @@ def get_occurrences(taxon_key: int, limit: int = 1000, country_code: str = "MX",
             params["stateProvince"] = state_province
         
         # Primer intento: con coordenadas válidas
-        res = requests.get(
+        res = upstream.get(
             f"{GBIF_URL}/occurrence/search",
             params=params,
             timeout=30
@@ -243,7 +388,7 @@ def get_occurrences(taxon_key: int, limit: int = 1000, country_code: str = "MX",
             # Quitar filtro de coordenadas
             params.pop("hasCoordinate")
             
-            res = requests.get(
+            res = upstream.get(
                 f"{GBIF_URL}/occurrence/search",
                 params=params,
                 timeout=30
@@ -283,10 +428,199 @@ def get_occurrences(taxon_key: int, limit: int = 1000, country_code: str = "MX",
         return []
 
 
+def _fetch_occurrence_page(params: dict, offset: int) -> dict:
+    res = upstream.get(
+        f"{GBIF_URL}/occurrence/search",
+        params={**params, "offset": offset},
+        timeout=30
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+def _with_valid_coords(results: list, filter_country: bool) -> list:
+    """Solo ocurrencias con coordenadas (y de México si no se filtró por país en GBIF)"""
+    with_coords = [
+        occ for occ in results
+        if occ.get("decimalLatitude") is not None
+        and occ.get("decimalLongitude") is not None
+    ]
+    if filter_country:
+        with_coords = [
+            occ for occ in with_coords
+            if (occ.get("country") or "").upper() == "MEXICO"
+        ]
+    return with_coords
+
+
+def _facet_counts(params: dict, field: str, facet_limit: int = 1000):
+    """
+    Conteo total y por valor de `field` de una búsqueda, en una sola petición
+
+    Returns:
+        (total, {valor: conteo})
+    """
+    data = _fetch_occurrence_page(
+        {**params, "limit": 0, "facet": field, "facetLimit": facet_limit}, 0
+    )
+    facets = data.get("facets") or [{}]
+    counts = {item["name"]: item["count"] for item in facets[0].get("counts", [])}
+    return data.get("count", 0), counts
+
+
+def plan_occurrence_partitions(taxon_key: int, limit: int = 300, country_code: str = "MX",
+                               state_province: str = None, extra_params: dict = None):
+    """
+    Divide la búsqueda en particiones que caben bajo el límite de paginación
+    de GBIF (offset + limit <= 100,000) usando facetas:
+
+    - si el total cabe, una sola partición
+    - si no, una partición por stateProvince (faceta)
+    - los estados (o el estado pedido) que no caben se parten por year
+
+    Los registros sin stateProvince/year en una búsqueda que no cabe no se
+    pueden alcanzar con occurrence/search (ver gbif.download para esos casos).
+
+    extra_params: filtros adicionales de occurrence/search (p.ej. lastInterpreted);
+                  con ellos no se hace el fallback global si no hay resultados
+
+    Returns:
+        (particiones [(params, conteo)], filter_country, total)
+    """
+    base = {"taxonKey": taxon_key, "limit": limit, **(extra_params or {})}
+    if country_code:
+        base["country"] = country_code
+    if state_province:
+        base["stateProvince"] = state_province
+
+    print(f"Planeando descarga: facetas por stateProvince (country={country_code})...")
+    total, states = _facet_counts(base, "stateProvince")
+    print(f"    Total de ocurrencias en {country_code}: {total}")
+
+    filter_country = False
+    if total == 0 and extra_params:
+        # Sincronización incremental sin cambios: no hay nada que cosechar
+        # (el fallback global pediría todo el delta del mundo)
+        print(f"   Sin registros nuevos en {country_code or 'la búsqueda'}")
+        return [], filter_country, 0
+    if total == 0 and country_code:
+        print(f"   No hay ocurrencias en {country_code}")
+        print(f"   Intentando obtener todos los resultados globales y filtrar por país...")
+        base.pop("country")
+        filter_country = True  # Obtener todo y filtrar en código
+        total, states = _facet_counts(base, "stateProvince")
+        print(f"    Total de ocurrencias GLOBALES: {total}")
+
+    if total <= GBIF_MAX_OFFSET:
+        return [(base, total)], filter_country, total
+
+    if state_province:
+        groups = [(base, total)]
+        unreachable = 0
+    else:
+        groups = [({**base, "stateProvince": name}, count) for name, count in states.items()]
+        unreachable = total - sum(states.values())
+
+    partitions = []
+    for params, count in groups:
+        if count <= GBIF_MAX_OFFSET:
+            partitions.append((params, count))
+            continue
+        _, years = _facet_counts(params, "year", facet_limit=500)
+        for year, year_count in years.items():
+            partitions.append(({**params, "year": year}, year_count))
+            unreachable += max(0, year_count - GBIF_MAX_OFFSET)
+        unreachable += count - sum(years.values())
+
+    print(f"    {len(partitions)} particiones para {total} ocurrencias")
+    if unreachable > 0:
+        print(f"   ⚠️ {unreachable} ocurrencias no caben en ninguna partición (usar /import-download)")
+    return partitions, filter_country, total
+
+
+def iter_occurrence_pages(taxon_key: int, limit: int = 300, country_code: str = "MX",
+                          state_province: str = None, workers: int = None,
+                          max_occurrences: int = GBIF_MAX_OCCURRENCES,
+                          extra_params: dict = None):
+    """
+    Generador de páginas de ocurrencias de GBIF (ya filtradas: con coordenadas)
+
+    plan_occurrence_partitions() da el conteo de cada partición, así que
+    todas las páginas (partición, offset) se conocen de antemano: se piden
+    hasta `workers` páginas a la vez, de cualquier partición, y se entregan
+    en orden. Solo hay `workers` páginas en vuelo, así que la memoria no
+    crece con el tamaño de la especie. Se detiene al llegar a
+    max_occurrences ocurrencias con coordenadas (None = sin límite; el
+    fallback global sin filtro de país siempre se corta en
+    GBIF_MAX_OCCURRENCES registros recorridos).
+
+    Yields:
+        Lista de ocurrencias (dicts de GBIF) de cada página
+    """
+    workers = workers or GBIF_PAGE_WORKERS
+
+    partitions, filter_country, total_count = plan_occurrence_partitions(
+        taxon_key, limit, country_code, state_province, extra_params
+    )
+    # GBIF no pagina más allá de offset + limit = 100,000 en occurrence/search:
+    # la última página de cada partición pide solo lo que falta hasta el tope
+    tasks = iter([
+        (params if offset + limit <= GBIF_MAX_OFFSET else {**params, "limit": GBIF_MAX_OFFSET - offset}, offset)
+        for params, count in partitions
+        for offset in range(0, min(count, GBIF_MAX_OFFSET), limit)
+    ])
+    if filter_country:
+        # Fallback global (sin resultados en el país): se recorre como mucho
+        # GBIF_MAX_OCCURRENCES registros crudos aunque max_occurrences sea None
+        tasks = islice(tasks, -(-GBIF_MAX_OCCURRENCES // limit))
+    pending = deque()
+    total_fetched = 0
+    occurrences_with_coords = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                pending.append((task[1], executor.submit(_fetch_occurrence_page, *task)))
+
+        for _ in range(workers):
+            submit_next()
+
+        try:
+            while pending:
+                offset, future = pending.popleft()
+                results = future.result().get("results", [])
+                submit_next()
+
+                # Partición agotada antes de lo que decía su conteo
+                if not results:
+                    continue
+
+                with_coords = _with_valid_coords(results, filter_country)
+                total_fetched += len(results)
+                occurrences_with_coords += len(with_coords)
+
+                # Mostrar progreso
+                print(f"    ✓ offset={offset}: {len(results)} registros, {len(with_coords)} con coordenadas (total: {occurrences_with_coords})")
+                print(f"       ({total_fetched}/{total_count})")
+
+                yield with_coords
+
+                # Limitar para no tardar demasiado
+                if max_occurrences and occurrences_with_coords >= max_occurrences:
+                    print(f"Se alcanzó el límite de {max_occurrences:,} ocurrencias")
+                    break
+        finally:
+            # Páginas pedidas de más (corte o error): no esperar a las que no empezaron
+            for _, future in pending:
+                future.cancel()
+
+
 def get_occurrences_from_gbif(taxon_key: int, limit: int = 300, country_code: str = "MX", state_province: str = None) -> list:
     """
     Obtiene ocurrencias de GBIF usando el endpoint occurrence/search
-    Con paginación automática para obtener todos los registros con coordenadas
+    Con paginación automática (páginas en paralelo, ver iter_occurrence_pages)
+    para obtener todos los registros con coordenadas
     
     country_code: Código ISO del país (ej: 'MX' para México)
     state_province: Nombre del estado o provincia
@@ -295,115 +629,8 @@ def get_occurrences_from_gbif(taxon_key: int, limit: int = 300, country_code: st
         print(f"\n Obteniendo ocurrencias de GBIF para taxonKey: {taxon_key} en {country_code}")
         
         all_occurrences = []
-        offset = 0
-        total_fetched = 0
-        occurrences_with_coords = 0
-        
-        # Primero, intentar sin filtro de país para debug
-        print(f"Intento 1: Sin filtro de país...")
-        res = requests.get(
-            f"{GBIF_URL}/occurrence/search",
-            params={
-                "taxonKey": taxon_key,
-                "limit": 1,
-                "offset": 0
-            },
-            timeout=30
-        )
-        res.raise_for_status()
-        data = res.json()
-        total_global = data.get("count", 0)
-        print(f"    Total de ocurrencias GLOBALES: {total_global}")
-        
-        # Ahora intenta con país
-        print(f"Intento 2: Con filtro country={country_code}...")
-        search_params = {
-            "taxonKey": taxon_key,
-            "country": country_code,
-            "limit": 1,
-            "offset": 0
-        }
-        if state_province:
-            search_params["stateProvince"] = state_province
-
-        res = requests.get(
-            f"{GBIF_URL}/occurrence/search",
-            params=search_params,
-            timeout=30
-        )
-        res.raise_for_status()
-        data = res.json()
-        total_mexico = data.get("count", 0)
-        print(f"    Total de ocurrencias en {country_code}: {total_mexico}")
-        
-        # Si hay resultados, proceder con paginación
-        if total_mexico == 0:
-            print(f"   No hay ocurrencias en {country_code}")
-            print(f"   Intentando obtener todos los resultados globales y filtrar por país...")
-            country_code = None  # Obtener todo y filtrar en código
-        
-        offset = 0
-        
-        while True:
-            print(f"   Descargando registros offset={offset}...")
-            
-            params = {
-                "taxonKey": taxon_key,
-                "limit": limit,
-                "offset": offset
-            }
-            
-            if country_code:
-                params["country"] = country_code
-            if state_province:
-                params["stateProvince"] = state_province
-            
-            res = requests.get(
-                f"{GBIF_URL}/occurrence/search",
-                params=params,
-                timeout=30
-            )
-            res.raise_for_status()
-            data = res.json()
-            
-            results = data.get("results", [])
-            total_count = data.get("count", 0)
-            
-            if not results:
-                print(f"  ✓ No hay más resultados")
-                break
-            
-            # Filtrar solo aquellas con coordenadas válidas
-            with_coords = [
-                occ for occ in results 
-                if occ.get("decimalLatitude") is not None 
-                and occ.get("decimalLongitude") is not None
-            ]
-            
-            # Si no usamos filtro de país, filtrar por country
-            if not country_code:
-                with_coords = [
-                    occ for occ in with_coords
-                    if occ.get("country", "").upper() in ["MEXICO", country_code]
-                ]
-            
-            all_occurrences.extend(with_coords)
-            occurrences_with_coords += len(with_coords)
-            total_fetched += len(results)
-            offset += limit
-            
-            # Mostrar progreso
-            print(f"    ✓ {len(results)} registros, {len(with_coords)} con coordenadas (total: {occurrences_with_coords})")
-            print(f"       ({total_fetched}/{total_count})")
-            
-            # Limitar a primeras 100,000 para no tardar demasiado
-            if occurrences_with_coords >= 100000:
-                print(f"Se alcanzó el límite de 100,000 ocurrencias")
-                break
-            
-            # Si ya tenemos todos los resultados, romper
-            if total_fetched >= total_count:
-                break
+        for page in iter_occurrence_pages(taxon_key, limit, country_code, state_province):
+            all_occurrences.extend(page)
         
         print(f"✓ GBIF: {len(all_occurrences)} ocurrencias CON COORDENADAS encontradas")
         return all_occurrences
@@ -415,16 +642,11 @@ def get_occurrences_from_gbif(taxon_key: int, limit: int = 300, country_code: st
         return []
 
 
-def extract_ecological_zones_from_gbif_occurrences(occurrences: list) -> dict:
+def accumulate_zone_counts(zones_data: dict, occurrences) -> dict:
     """
-    Procesa ocurrencias de GBIF para extraer zonas ecológicas ÚNICAS
-    Agrupa por estado (state_province) para crear zonas temáticas
+    Suma las ocurrencias por zona (país|estado) en zones_data.
+    Se puede llamar página por página sin guardar las ocurrencias.
     """
-    zones_data = {}
-    
-    print(f"\n Procesando {len(occurrences)} ocurrencias de GBIF...")
-    
-    # Agrupar por zona (estado)
     for occ in occurrences:
         try:
             country = occ.get("country", "Unknown")
@@ -447,11 +669,27 @@ def extract_ecological_zones_from_gbif_occurrences(occurrences: list) -> dict:
             print(f" Error procesando ocurrencia: {e}")
             continue
     
+    return zones_data
+
+
+def print_zones_summary(zones_data: dict):
     print(f"✓ Se extrajeron {len(zones_data)} zonas ecológicas ÚNICAS")
     
     # Mostrar zonas extraídas
     for zone_key, zone_info in sorted(zones_data.items()):
         print(f"  - {zone_key}: {zone_info['observation_count']} observaciones")
+
+
+def extract_ecological_zones_from_gbif_occurrences(occurrences: list) -> dict:
+    """
+    Procesa ocurrencias de GBIF para extraer zonas ecológicas ÚNICAS
+    Agrupa por estado (state_province) para crear zonas temáticas
+    """
+    print(f"\n Procesando {len(occurrences)} ocurrencias de GBIF...")
+    
+    # Agrupar por zona (estado)
+    zones_data = accumulate_zone_counts({}, occurrences)
+    print_zones_summary(zones_data)
     
     return {
         "zones": zones_data,
@@ -0,0 +1,239 @@
+"""
+Ingesta de ocurrencias mediante las descargas asíncronas de GBIF (Darwin Core Archive)
+
+occurrence/search no pagina más allá de 100,000 registros; para especies
+grandes (p.ej. Zea mays) se pide una descarga DWCA, se espera a que GBIF
+la prepare y se lee occurrence.txt directamente del zip, sin extraerlo.
+"""
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from app import upstream
+from gbif import metadata_cache
+from gbif.client import GBIF_URL
+
+# Base de la API de descargas; se puede apuntar a un servidor de prueba
+GBIF_DOWNLOAD_URL = os.getenv("GBIF_DOWNLOAD_URL", GBIF_URL)
+# Las descargas requieren una cuenta de GBIF
+GBIF_USER = os.getenv("GBIF_USER")
+GBIF_PASSWORD = os.getenv("GBIF_PASSWORD")
+GBIF_EMAIL = os.getenv("GBIF_EMAIL")
+
+DOWNLOAD_POLL_SECONDS = float(os.getenv("GBIF_DOWNLOAD_POLL_SECONDS", "30"))
+DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("GBIF_DOWNLOAD_TIMEOUT_SECONDS", str(3 * 3600)))
+# Filas de occurrence.txt por página (una transacción por página)
+ARCHIVE_PAGE_SIZE = 1000
+
+# occurrence.txt trae campos largos (remarks, dynamicProperties...)
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+_INT_FIELDS = ("year", "month", "day")
+_FLOAT_FIELDS = ("decimalLatitude", "decimalLongitude", "coordinateUncertaintyInMeters", "elevation")
+_TEXT_FIELDS = (
+    "stateProvince", "municipality", "locality", "eventDate", "habitat",
+    "basisOfRecord", "datasetKey", "institutionCode", "recordedBy", "identifiedBy",
+)
+
+
+class DownloadError(RuntimeError):
+    """La descarga de GBIF no se pudo pedir, falló o no terminó a tiempo"""
+    pass
+
+
+def request_download(taxon_key: int, country_code: str = None, state_province: str = None) -> str:
+    """
+    Pide a GBIF una descarga DWCA de las ocurrencias con coordenadas del taxón
+
+    Returns:
+        Clave de la descarga (p.ej. "0001234-240101123456789")
+    """
+    if not (GBIF_USER and GBIF_PASSWORD):
+        raise DownloadError("GBIF_USER y GBIF_PASSWORD son necesarios para descargas de GBIF")
+
+    predicates = [
+        {"type": "equals", "key": "TAXON_KEY", "value": str(taxon_key)},
+        {"type": "equals", "key": "HAS_COORDINATE", "value": "true"},
+    ]
+    if country_code:
+        predicates.append({"type": "equals", "key": "COUNTRY", "value": country_code})
+    if state_province:
+        predicates.append({"type": "equals", "key": "STATE_PROVINCE", "value": state_province})
+
+    body = {
+        "creator": GBIF_USER,
+        "format": "DWCA",
+        "predicate": {"type": "and", "predicates": predicates},
+    }
+    if GBIF_EMAIL:
+        body["notificationAddresses"] = [GBIF_EMAIL]
+        body["sendNotification"] = True
+
+    res = upstream.post(
+        f"{GBIF_DOWNLOAD_URL}/occurrence/download/request",
+        json=body,
+        auth=(GBIF_USER, GBIF_PASSWORD),
+        timeout=30
+    )
+    if res.status_code >= 400:
+        raise DownloadError(f"GBIF rechazó la descarga ({res.status_code}): {res.text[:200]}")
+
+    key = res.text.strip()
+    print(f"✓ Descarga de GBIF solicitada: {key}")
+    return key
+
+
+def wait_for_download(key: str, poll_seconds: float = None, timeout: float = None) -> str:
+    """
+    Espera a que GBIF prepare la descarga
+
+    Returns:
+        URL del zip (downloadLink)
+    """
+    poll_seconds = DOWNLOAD_POLL_SECONDS if poll_seconds is None else poll_seconds
+    deadline = time.monotonic() + (timeout or DOWNLOAD_TIMEOUT_SECONDS)
+
+    while True:
+        res = upstream.get(f"{GBIF_DOWNLOAD_URL}/occurrence/download/{key}", timeout=30)
+        res.raise_for_status()
+        data = res.json()
+        status = data.get("status")
+
+        if status == "SUCCEEDED":
+            print(f"✓ Descarga {key} lista: {data.get('totalRecords')} registros")
+            return data["downloadLink"]
+        if status in ("FAILED", "KILLED", "CANCELLED", "FILE_ERASED"):
+            raise DownloadError(f"La descarga {key} terminó con estado {status}")
+        if time.monotonic() >= deadline:
+            raise DownloadError(f"La descarga {key} no terminó a tiempo (estado {status})")
+
+        print(f"   Descarga {key}: {status}...")
+        time.sleep(poll_seconds)
+
+
+def fetch_archive(url: str) -> str:
+    """
+    Descarga el zip a un archivo temporal en bloques (sin cargarlo en memoria)
+
+    Returns:
+        Ruta del archivo; quien llama lo borra
+    """
+    fd, path = tempfile.mkstemp(prefix="gbif-dwca-", suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            res = upstream.get(url, stream=True, timeout=300)
+            res.raise_for_status()
+            for block in res.iter_content(chunk_size=1024 * 1024):
+                out.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def get_country_names() -> dict:
+    """
+    countryCode -> nombre del país tal como lo devuelve occurrence/search
+    (enumeration/country de GBIF, en el cache de metadatos)
+
+    El DWCA solo trae countryCode y las zonas se agrupan por nombre de país:
+    con el código quedarían zonas distintas a las de /import para el mismo
+    lugar, así que sin la tabla no se importa.
+    """
+    try:
+        data = metadata_cache.fetch_json("country_enumeration", "GET", f"{GBIF_URL}/enumeration/country")
+    except Exception as e:
+        raise DownloadError(f"No se pudo obtener la lista de países de GBIF: {e}")
+    names = {c["iso2"]: c["title"] for c in data or [] if c.get("iso2") and c.get("title")}
+    if not names:
+        raise DownloadError("GBIF devolvió una lista de países vacía")
+    return names
+
+
+def _row_to_occurrence(row: dict, country_names: dict) -> dict:
+    """Fila de occurrence.txt -> dict con las llaves de la API de búsqueda"""
+    code = row.get("countryCode") or None
+    occurrence = {
+        "key": int(row["gbifID"]) if row.get("gbifID") else None,
+        "country": row.get("country") or country_names.get(code, code),
+    }
+    for field in _TEXT_FIELDS:
+        occurrence[field] = row.get(field) or None
+    for field in _FLOAT_FIELDS:
+        try:
+            occurrence[field] = float(row[field]) if row.get(field) else None
+        except ValueError:
+            occurrence[field] = None
+    for field in _INT_FIELDS:
+        try:
+            occurrence[field] = int(row[field]) if row.get(field) else None
+        except ValueError:
+            occurrence[field] = None
+    return occurrence
+
+
+def iter_archive_pages(archive_path: str, page_size: int = ARCHIVE_PAGE_SIZE):
+    """
+    Lee occurrence.txt del DWCA en streaming (directo del zip)
+
+    Yields:
+        Listas de hasta page_size ocurrencias con coordenadas, en el mismo
+        formato que occurrence/search (ver gbif.client.parse_occurrence)
+    """
+    country_names = get_country_names()
+    with zipfile.ZipFile(archive_path) as archive:
+        if "occurrence.txt" not in archive.namelist():
+            raise DownloadError(f"{archive_path} no contiene occurrence.txt")
+
+        with archive.open("occurrence.txt") as raw:
+            text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+            reader = csv.DictReader(text, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+            page = []
+            for row in reader:
+                occurrence = _row_to_occurrence(row, country_names)
+                if occurrence["decimalLatitude"] is None or occurrence["decimalLongitude"] is None:
+                    continue
+                page.append(occurrence)
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+
+def ingest_download(taxon_key: int, id_species: int, country_code: str = "MX",
+                    state_province: str = None, archive_path: str = None,
+                    download_key: str = None, loader: str = None) -> dict:
+    """
+    Importa todas las ocurrencias de un taxón desde un DWCA de GBIF
+
+    archive_path: zip ya descargado (no se borra); si no se da, se pide la
+                  descarga a GBIF (o se reutiliza download_key), se espera y
+                  se descarga a un temporal
+    loader: "insert" o "load_data" (ver gbif.occurrences_handler.import_occurrence_pages)
+
+    Devuelve las estadísticas de gbif.zones_handler.import_occurrences_and_zones
+    """
+    from gbif.zones_handler import import_occurrences_and_zones
+
+    temporary = None
+    if archive_path is None:
+        download_key = download_key or request_download(taxon_key, country_code, state_province)
+        link = wait_for_download(download_key)
+        archive_path = temporary = fetch_archive(link)
+
+    try:
+        print(f"\n📦 Importando ocurrencias desde {archive_path}...")
+        stats = import_occurrences_and_zones(
+            iter_archive_pages(archive_path), taxon_key, id_species, loader=loader
+        )
+        stats["download_key"] = download_key
+        return stats
+    finally:
+        if temporary:
+            os.remove(temporary)
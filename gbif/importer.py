@@ -1,17 +1,34 @@
-from app.db import get_connection
+from app.db import get_connection, release_connection, db_connection
+from app.cache import cache
+from gbif.normalizer import fold_name
 from gbif.vernacular import get_vernacular_names_by_taxon_key
 import pymysql
 
+# Nombres comunes por sentencia en insert_vernacular_names
+VERNACULAR_CHUNK_SIZE = 500
+
 def species_exists(conn, taxon_key: int):
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    def load():
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+
+        sql = "SELECT id_species FROM species WHERE taxonKey = %s"
+        cursor.execute(sql, (taxon_key,))
+        result = cursor.fetchone()
+
+        cursor.close()
 
-    sql = "SELECT id_species FROM species WHERE id_species = %s"
-    cursor.execute(sql, (taxon_key,))
-    result = cursor.fetchone()
+        return result["id_species"] if result else None
 
-    cursor.close()
+    # Solo se cachean especies existentes: un "no existe" caduca al importarla
+    return cache.get_or_load("species", ("id_by_taxonKey", taxon_key), load, cache_none=False)
 
-    return result["id_species"] if result else None
+
+def get_species_id_by_taxon_key(taxon_key: int):
+    """id_species de una especie ya importada (con cache de lectura)"""
+    with db_connection() as conn:
+        if not conn:
+            return None
+        return species_exists(conn, taxon_key)
 
 
 def insert_species(conn, data: dict):
@@ -43,22 +60,56 @@ def insert_species(conn, data: dict):
         )
 
         conn.commit()
+        cache.invalidate("species")
         return cur.lastrowid
 
 
-def insert_vernacular_names(conn, species_id, vernacular_names):
-    if not vernacular_names:
-        return
+def normalize_vernacular_names(vernacular_names) -> list:
+    """
+    Deja un nombre por (idioma, nombre normalizado) en una pasada: recorta
+    espacios, idioma en minúsculas ('' si falta) y llave con fold_name
+    (sin mayúsculas ni acentos). Se conserva la primera grafía vista.
+
+    Returns:
+        Lista de (language, common_name, common_name_norm)
+    """
+    unique = {}
+    for name_info in vernacular_names or []:
+        common_name = " ".join((name_info.get("vernacularName") or "").split())
+        if not common_name:
+            continue
+        language = (name_info.get("language") or "").strip().lower()
+        norm = fold_name(common_name)
+        unique.setdefault((language, norm), (language, common_name, norm))
+    return list(unique.values())
 
+
+def insert_vernacular_names(conn, species_id, vernacular_names) -> int:
+    """
+    Upsert en bloque de los nombres comunes de una especie, con llave única
+    (id_species, language, common_name_norm) de migrations_vernacular_names.sql:
+    reimportar no duplica. No hace commit (lo hace quien llama).
+
+    Returns:
+        Filas afectadas (1 por nombre nuevo, 2 si cambió la grafía)
+    """
+    rows = normalize_vernacular_names(vernacular_names)
+    if not rows:
+        return 0
+
+    affected = 0
     with conn.cursor() as cur:
-        for name_info in vernacular_names:
-            cur.execute(
-                """
-                INSERT INTO vernacular_names (id_species, language, common_name)
-                VALUES (%s, %s, %s)
+        for start in range(0, len(rows), VERNACULAR_CHUNK_SIZE):
+            chunk = rows[start:start + VERNACULAR_CHUNK_SIZE]
+            affected += cur.execute(
+                f"""
+                INSERT INTO vernacular_names (id_species, language, common_name, common_name_norm)
+                VALUES {", ".join(["(%s, %s, %s, %s)"] * len(chunk))}
+                ON DUPLICATE KEY UPDATE common_name = VALUES(common_name)
                 """,
-                (species_id, name_info['language'], name_info['vernacularName'])
+                [value for row in chunk for value in (species_id, *row)]
             )
+    return affected
 
 def import_species(data: dict) -> dict:
     conn = get_connection()
@@ -77,4 +128,5 @@ def import_species(data: dict) -> dict:
 
         return {"status": "inserted", "id_species": species_id}
     finally:
-        conn.close()
+        release_connection(conn)
+
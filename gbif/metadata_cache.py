@@ -0,0 +1,225 @@
+"""
+Cache persistente (SQLite) de las consultas de metadatos a GBIF y OpenTreeOfLife
+
+Lo comparten todos los procesos de la máquina: una especie importada por un
+worker no vuelve a consultar /species/match, /species/{key}, vernacularNames
+ni OTOL en los demás hasta que vence su TTL. Las respuestas vacías o 404 se
+guardan con un TTL corto (cache negativo).
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+from app import metrics, upstream
+
+load_dotenv()
+
+# TTL en segundos por endpoint (sobrescribible con METADATA_TTL_<ENDPOINT>)
+DEFAULT_TTLS = {
+    "species_match": 7 * 86400,
+    "species_search": 86400,
+    "species": 7 * 86400,
+    "vernacular_names": 3 * 86400,
+    "otol_match_names": 30 * 86400,
+    "otol_taxon_info": 30 * 86400,
+    # Nodos de género/familia por ott_id e índice reino:género -> ott_id (gbif.client)
+    "otol_lineage": 30 * 86400,
+    "otol_genus": 30 * 86400,
+    # countryCode -> nombre de país de GBIF (gbif.download)
+    "country_enumeration": 30 * 86400,
+}
+# TTL de los "no encontrado" (404, matchType NONE, results vacíos)
+NEGATIVE_TTL = int(os.getenv("METADATA_NEGATIVE_TTL", "3600"))
+
+DISABLED = os.getenv("METADATA_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+_bypass = ContextVar("metadata_cache_bypass", default=False)
+
+
+class MetadataCache:
+    """
+    Tabla SQLite (endpoint, key) -> JSON con expiración.
+
+    - max_entries: al superarse se descartan primero las entradas vencidas
+      y luego las que vencen antes
+    - Cualquier error de SQLite se ignora: el cache nunca tumba una consulta
+    """
+
+    def __init__(self, path: str, ttls: dict = None, max_entries: int = 50000):
+        self.path = path
+        self.ttls = dict(ttls or DEFAULT_TTLS)
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS metadata_cache (
+                    endpoint TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (endpoint, key)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_metadata_cache_expires ON metadata_cache (expires_at)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, endpoint: str, field: str):
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {"hits": 0, "misses": 0, "errors": 0})
+            stats[field] += 1
+
+    def get(self, endpoint: str, key: str):
+        """
+        Returns:
+            (True, valor) si hay entrada vigente (valor None = negativo),
+            (False, None) si no
+        """
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM metadata_cache WHERE endpoint = ? AND key = ? AND expires_at > ?",
+                (endpoint, key, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            self._count(endpoint, "errors")
+            return False, None
+
+        if row is None:
+            self._count(endpoint, "misses")
+            return False, None
+        self._count(endpoint, "hits")
+        return True, (json.loads(row[0]) if row[0] is not None else None)
+
+    def put(self, endpoint: str, key: str, value, negative: bool = False):
+        ttl = NEGATIVE_TTL if negative else self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO metadata_cache (endpoint, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (endpoint, key, json.dumps(value) if value is not None else None, time.time() + ttl)
+            )
+            with self._lock:
+                self._puts += 1
+                check = self._puts % 100 == 1
+            if check:
+                self._evict(conn)
+        except sqlite3.Error:
+            self._count(endpoint, "errors")
+
+    def _evict(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM metadata_cache WHERE expires_at <= ?", (time.time(),))
+        (count,) = conn.execute("SELECT COUNT(*) FROM metadata_cache").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                """
+                DELETE FROM metadata_cache WHERE rowid IN (
+                    SELECT rowid FROM metadata_cache ORDER BY expires_at LIMIT ?
+                )
+                """,
+                (count - self.max_entries,)
+            )
+
+    def clear(self, endpoint: str = None):
+        conn = self._conn()
+        if endpoint:
+            conn.execute("DELETE FROM metadata_cache WHERE endpoint = ?", (endpoint,))
+        else:
+            conn.execute("DELETE FROM metadata_cache")
+
+    def stats(self) -> dict:
+        """Hits/misses por endpoint de este proceso"""
+        with self._lock:
+            return {"tables": {endpoint: dict(s) for endpoint, s in self._stats.items()}}
+
+
+def _ttls_from_env() -> dict:
+    ttls = dict(DEFAULT_TTLS)
+    for endpoint in DEFAULT_TTLS:
+        value = os.getenv(f"METADATA_TTL_{endpoint.upper()}")
+        if value is not None:
+            ttls[endpoint] = int(value)
+    return ttls
+
+
+def _is_negative(data) -> bool:
+    """Respuesta 200 que en realidad es un "no encontrado" """
+    if not data:
+        return True
+    if isinstance(data, dict):
+        return data.get("matchType") == "NONE" or data.get("results") == []
+    return False
+
+
+@contextmanager
+def bypass(enabled: bool = True):
+    """
+    Dentro del bloque las consultas van siempre a la API (y refrescan el cache)
+
+    Uso:
+        with metadata_cache.bypass(body.refresh):
+            search_species(name)
+    """
+    token = _bypass.set(enabled)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def is_bypassed() -> bool:
+    return DISABLED or _bypass.get()
+
+
+def fetch_json(endpoint: str, method: str, url: str, params: dict = None,
+               json_body=None, timeout: float = 10):
+    """
+    Consulta una API de metadatos a través del cache
+
+    Returns:
+        JSON de la respuesta, o None si la API respondió 404
+
+    Raises:
+        requests.HTTPError para otros status de error (no se cachean)
+    """
+    key = json.dumps([method, url, params, json_body], sort_keys=True, default=str)
+    if not is_bypassed():
+        hit, value = cache.get(endpoint, key)
+        if hit:
+            return value
+
+    # Consultas de solo lectura (también los POST de OTOL): se pueden reintentar
+    res = upstream.request(method, url, params=params, json=json_body, timeout=timeout, idempotent=True)
+    if res.status_code == 404:
+        cache.put(endpoint, key, None, negative=True)
+        return None
+    res.raise_for_status()
+
+    data = res.json()
+    cache.put(endpoint, key, data, negative=_is_negative(data))
+    return data
+
+
+cache = MetadataCache(
+    path=os.getenv("METADATA_CACHE_PATH", os.path.join(tempfile.gettempdir(), "agro_metadata_cache.sqlite3")),
+    ttls=_ttls_from_env(),
+    max_entries=int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "50000")),
+)
+metrics.register_cache("metadata_cache", cache)
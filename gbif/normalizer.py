@@ -1,3 +1,13 @@
+import unicodedata
+
+
+def fold_name(text: str) -> str:
+    """Llave de comparación de un nombre: minúsculas, sin acentos y espacios colapsados"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.casefold().split())
+
+
 def normalize_species(gbif_data: dict, otol_data: dict = None) -> dict:
     """
     Normaliza datos de GBIF, completando con datos de OpenTreeOfLife cuando sea necesario
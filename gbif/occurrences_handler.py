@@ -2,11 +2,42 @@
 Módulo para manejar la importación de ocurrencias a la base de datos
 Almacena datos de distribución geográfica y temporal de especies
 """
-from app.db import get_connection
-from gbif.client import get_occurrences_from_gbif, parse_occurrence
+import os
+import random
+import tempfile
+import time
+from functools import lru_cache
+import pymysql
+from pymysql.constants import CLIENT
+from app.db import get_connection, release_connection, db_connection
+from gbif.client import iter_occurrence_pages, parse_occurrence
 
+# Columnas de occurrences que llena gbif.client.parse_occurrence
+OCCURRENCE_COLUMNS = (
+    "gbif_occurrence_id", "id_species", "decimal_latitude", "decimal_longitude",
+    "coordinate_uncertainty_meters", "country", "state_province", "municipality",
+    "locality", "event_date", "year", "month", "day", "habitat", "elevation",
+    "basis_of_record", "dataset_key", "institution_code", "recorded_by", "identified_by",
+)
 
-def insert_occurrence(conn, occurrence_data: dict) -> bool:
+# Filas por INSERT multi-fila (cada chunk es su propia transacción)
+OCCURRENCE_CHUNK_SIZE = int(os.getenv("OCCURRENCE_CHUNK_SIZE", "500"))
+# Reintentos de un chunk ante deadlock (1213) o lock wait timeout (1205)
+LOCK_RETRIES = int(os.getenv("OCCURRENCE_LOCK_RETRIES", "3"))
+_LOCK_ERRORS = (1213, 1205)
+
+# Modo de carga: "insert" (INSERT multi-fila) o "load_data" (TSV temporal +
+# LOAD DATA LOCAL INFILE a una tabla staging); requiere DB_LOCAL_INFILE=1 y
+# local_infile=ON en el servidor, si no se usa "insert"
+OCCURRENCE_LOADER = os.getenv("OCCURRENCE_LOADER", "insert")
+# Filas por archivo TSV / LOAD DATA (cada carga es su propia transacción)
+LOAD_DATA_ROWS = int(os.getenv("OCCURRENCE_LOAD_DATA_ROWS", "100000"))
+
+# None = aún no se ha comprobado en este proceso
+_load_data_enabled = None
+
+
+def insert_occurrence(conn, occurrence_data: dict) -> int:
     """
     Inserta una ocurrencia individual en la tabla occurrences
     
@@ -20,53 +51,276 @@ def insert_occurrence(conn, occurrence_data: dict) -> bool:
     - elevation, habitat: Detalles ecológicos
     - basis_of_record, dataset_key, institution_code: Metadata
     - recorded_by, identified_by: Responsables
+
+    Returns:
+        1 si se insertó, 0 si ya existía (INSERT IGNORE), -1 si hubo error
     """
     try:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                INSERT IGNORE INTO occurrences 
-                (gbif_occurrence_id, id_species, decimal_latitude, decimal_longitude,
-                 coordinate_uncertainty_meters, country, state_province, municipality,
-                 locality, event_date, year, month, day, habitat, elevation,
-                 basis_of_record, dataset_key, institution_code, recorded_by, identified_by)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                f"""
+                INSERT IGNORE INTO occurrences ({", ".join(OCCURRENCE_COLUMNS)})
+                VALUES ({", ".join(["%s"] * len(OCCURRENCE_COLUMNS))})
                 """,
-                (
-                    occurrence_data.get("gbif_occurrence_id"),
-                    occurrence_data.get("id_species"),
-                    occurrence_data.get("decimal_latitude"),
-                    occurrence_data.get("decimal_longitude"),
-                    occurrence_data.get("coordinate_uncertainty_meters"),
-                    occurrence_data.get("country"),
-                    occurrence_data.get("state_province"),
-                    occurrence_data.get("municipality"),
-                    occurrence_data.get("locality"),
-                    occurrence_data.get("event_date"),
-                    occurrence_data.get("year"),
-                    occurrence_data.get("month"),
-                    occurrence_data.get("day"),
-                    occurrence_data.get("habitat"),
-                    occurrence_data.get("elevation"),
-                    occurrence_data.get("basis_of_record"),
-                    occurrence_data.get("dataset_key"),
-                    occurrence_data.get("institution_code"),
-                    occurrence_data.get("recorded_by"),
-                    occurrence_data.get("identified_by"),
-                )
+                tuple(occurrence_data.get(column) for column in OCCURRENCE_COLUMNS)
             )
-            return cur.rowcount > 0
+            return 1 if cur.rowcount > 0 else 0
     except Exception as e:
         print(f" Error insertando ocurrencia: {e}")
-        return False
+        return -1
+
+
+def upsert_occurrence(conn, occurrence_data: dict) -> int:
+    """
+    Inserta o actualiza (por gbif_occurrence_id) una ocurrencia; se usa en la
+    sincronización incremental, donde GBIF devuelve registros modificados
+
+    Returns:
+        1 si se insertó, 2 si se actualizó, 0 si no cambió, -1 si hubo error
+    """
+    updates = ", ".join(f"{c}=VALUES({c})" for c in OCCURRENCE_COLUMNS if c != "gbif_occurrence_id")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO occurrences ({", ".join(OCCURRENCE_COLUMNS)})
+                VALUES ({", ".join(["%s"] * len(OCCURRENCE_COLUMNS))})
+                ON DUPLICATE KEY UPDATE {updates}
+                """,
+                tuple(occurrence_data.get(column) for column in OCCURRENCE_COLUMNS)
+            )
+            return cur.rowcount
+    except Exception as e:
+        print(f" Error actualizando ocurrencia: {e}")
+        return -1
+
+
+@lru_cache(maxsize=64)
+def _occurrences_sql(n_rows: int, upsert: bool) -> str:
+    row_placeholder = "(" + ", ".join(["%s"] * len(OCCURRENCE_COLUMNS)) + ")"
+    sql = (
+        f"INSERT {'' if upsert else 'IGNORE '}INTO occurrences ({', '.join(OCCURRENCE_COLUMNS)}) "
+        f"VALUES {', '.join([row_placeholder] * n_rows)}"
+    )
+    if upsert:
+        updates = ", ".join(f"{c}=VALUES({c})" for c in OCCURRENCE_COLUMNS if c != "gbif_occurrence_id")
+        sql = f"{sql} ON DUPLICATE KEY UPDATE {updates}"
+    return sql
+
+
+def _existing_ids(cur, ids: list) -> int:
+    """Cuántos gbif_occurrence_id del chunk ya están en occurrences"""
+    cur.execute(
+        f"SELECT COUNT(*) AS n FROM occurrences WHERE gbif_occurrence_id IN ({', '.join(['%s'] * len(ids))})",
+        ids
+    )
+    return cur.fetchone()["n"]
+
+
+def _write_chunk(conn, chunk: list, stats: dict, upsert: bool):
+    """
+    Escribe un chunk con un solo INSERT multi-fila y lo confirma.
+
+    INSERT IGNORE: filas afectadas = insertadas; el resto son duplicadas.
+    Upsert: MySQL cuenta 1 por insertada y 2 por actualizada (0 si no
+    cambió); las insertadas salen de contar antes las que ya existían.
+
+    Deadlock o lock wait: rollback y se reintenta el chunk con backoff.
+    Otro error: rollback y se escribe fila por fila para aislar las malas.
+    """
+    if upsert:
+        # Un id repetido dentro del chunk rompería la cuenta: gana el último
+        unique = {occ["gbif_occurrence_id"]: occ for occ in chunk}
+        stats["duplicated"] += len(chunk) - len(unique)
+        chunk = list(unique.values())
+
+    params = [occ.get(column) for occ in chunk for column in OCCURRENCE_COLUMNS]
+    sql = _occurrences_sql(len(chunk), upsert)
+
+    for attempt in range(LOCK_RETRIES + 1):
+        try:
+            with conn.cursor() as cur:
+                existing = _existing_ids(cur, [occ["gbif_occurrence_id"] for occ in chunk]) if upsert else 0
+                affected = cur.execute(sql, params)
+            conn.commit()
+            break
+        except pymysql.err.OperationalError as e:
+            conn.rollback()
+            if e.args[0] not in _LOCK_ERRORS or attempt >= LOCK_RETRIES:
+                print(f" Error escribiendo chunk de {len(chunk)} ocurrencias: {e}")
+                return _write_rows(conn, chunk, stats, upsert)
+            print(f" Bloqueo en chunk de ocurrencias ({e.args[0]}), reintento {attempt + 1}")
+            time.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+        except pymysql.err.MySQLError as e:
+            conn.rollback()
+            print(f" Error escribiendo chunk de {len(chunk)} ocurrencias: {e}")
+            return _write_rows(conn, chunk, stats, upsert)
+
+    if upsert:
+        inserted = len(chunk) - existing
+        updated = (affected - inserted) // 2
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["duplicated"] += existing - updated
+    else:
+        stats["inserted"] += affected
+        stats["duplicated"] += len(chunk) - affected
+
+
+def _write_rows(conn, chunk: list, stats: dict, upsert: bool):
+    """Camino lento de un chunk fallido: una sentencia por fila"""
+    for occ in chunk:
+        result = upsert_occurrence(conn, occ) if upsert else insert_occurrence(conn, occ)
+        if result == 1:
+            stats["inserted"] += 1
+        elif result == 2:
+            stats["updated"] += 1
+        elif result == 0:
+            stats["duplicated"] += 1
+        else:
+            stats["errors"] += 1
+    conn.commit()
+
+
+def _import_occurrences(conn, occurrences, stats: dict, upsert: bool = False,
+                        chunk_size: int = None):
+    """
+    Inserta ocurrencias parseadas en chunks de chunk_size filas (un commit
+    por chunk) sumando inserted/duplicated/errors en stats (y updated si
+    upsert=True)
+    """
+    chunk_size = chunk_size or OCCURRENCE_CHUNK_SIZE
+    chunk = []
+    for occ in occurrences:
+        # Validar datos esenciales
+        if not occ.get("gbif_occurrence_id"):
+            stats["errors"] += 1
+            continue
+        
+        if not (occ.get("decimal_latitude") and occ.get("decimal_longitude")):
+            stats["errors"] += 1
+            continue
+        
+        chunk.append(occ)
+        if len(chunk) >= chunk_size:
+            _write_chunk(conn, chunk, stats, upsert)
+            chunk = []
+    if chunk:
+        _write_chunk(conn, chunk, stats, upsert)
+
+
+def _tsv_value(value) -> str:
+    """Valor en el formato por defecto de LOAD DATA (\\N = NULL, escapes con \\)"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def load_data_available(conn) -> bool:
+    """
+    LOAD DATA LOCAL necesita permiso en el cliente (DB_LOCAL_INFILE) y en
+    el servidor (@@local_infile); se comprueba una vez por proceso
+    """
+    global _load_data_enabled
+    if _load_data_enabled is None:
+        enabled = bool(conn.client_flag & CLIENT.LOCAL_FILES)
+        if enabled:
+            with conn.cursor() as cur:
+                cur.execute("SELECT @@GLOBAL.local_infile AS local_infile")
+                enabled = bool(int(cur.fetchone()["local_infile"]))
+        _load_data_enabled = enabled
+    return _load_data_enabled
+
+
+def _load_file(conn, path: str, stats: dict):
+    """
+    Carga un TSV a occurrences_staging (tabla temporal sin índices) y lo
+    fusiona con INSERT IGNORE ... SELECT: gbif_occurrence_id UNIQUE descarta
+    los duplicados. insertadas = filas afectadas del merge.
+    """
+    columns = ", ".join(OCCURRENCE_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS occurrences_staging "
+            f"AS SELECT {columns} FROM occurrences LIMIT 0"
+        )
+        cur.execute("DELETE FROM occurrences_staging")
+        loaded = cur.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE occurrences_staging "
+            f"CHARACTER SET utf8mb4 ({columns})",
+            (path,)
+        )
+        inserted = cur.execute(
+            f"INSERT IGNORE INTO occurrences ({columns}) "
+            f"SELECT {columns} FROM occurrences_staging"
+        )
+    conn.commit()
+    stats["inserted"] += inserted
+    stats["duplicated"] += loaded - inserted
+    print(f"   LOAD DATA: {loaded} filas cargadas, {inserted} nuevas")
+
+
+def _load_occurrences(conn, occurrences, stats: dict, batch_rows: int = None):
+    """
+    Camino LOAD DATA: vuelca las ocurrencias parseadas (en el orden de
+    OCCURRENCE_COLUMNS) a un TSV temporal y lo carga cada batch_rows filas
+    """
+    batch_rows = batch_rows or LOAD_DATA_ROWS
+    fd, path = tempfile.mkstemp(prefix="occurrences-", suffix=".tsv")
+    os.close(fd)
+    try:
+        spool = open(path, "w", encoding="utf-8", newline="")
+        rows = 0
+        try:
+            for occ in occurrences:
+                # Mismas validaciones que el camino INSERT
+                if not occ.get("gbif_occurrence_id"):
+                    stats["errors"] += 1
+                    continue
+                if not (occ.get("decimal_latitude") and occ.get("decimal_longitude")):
+                    stats["errors"] += 1
+                    continue
+
+                spool.write("\t".join(_tsv_value(occ.get(column)) for column in OCCURRENCE_COLUMNS) + "\n")
+                rows += 1
+                if rows >= batch_rows:
+                    spool.close()
+                    _load_file(conn, path, stats)
+                    spool = open(path, "w", encoding="utf-8", newline="")
+                    rows = 0
+        finally:
+            spool.close()
+        if rows:
+            _load_file(conn, path, stats)
+    finally:
+        os.remove(path)
+        with conn.cursor() as cur:
+            cur.execute("DROP TEMPORARY TABLE IF EXISTS occurrences_staging")
+
+
+def _print_import_stats(stats: dict):
+    print(f"✓ Ocurrencias importadas: {stats['inserted']}")
+    if stats.get("updated"):
+        print(f"  Actualizadas (modificadas en GBIF): {stats['updated']}")
+    if stats["duplicated"] > 0:
+        print(f"  Duplicadas (gbif_occurrence_id ya existe): {stats['duplicated']}")
+    if stats["errors"] > 0:
+        print(f" Errores: {stats['errors']}")
 
 
-def import_occurrences_batch(occurrences_list: list) -> dict:
+def import_occurrences_batch(occurrences_list: list, chunk_size: int = None) -> dict:
     """
     Importa un lote de ocurrencias a la base de datos
     Para crear mapas de distribución geográfica
     
-    Usa INSERT IGNORE para evitar duplicados via gbif_occurrence_id UNIQUE
+    Usa INSERT IGNORE multi-fila (chunks de chunk_size, un commit por chunk)
+    para evitar duplicados via gbif_occurrence_id UNIQUE
     """
     conn = get_connection()
     stats = {
@@ -78,68 +332,84 @@ def import_occurrences_batch(occurrences_list: list) -> dict:
     try:
         print(f"\n📍 Importando {len(occurrences_list)} ocurrencias de GBIF...")
         
-        for occ in occurrences_list:
-            try:
-                # Validar datos esenciales
-                if not occ.get("gbif_occurrence_id"):
-                    stats["errors"] += 1
-                    continue
-                
-                if not (occ.get("decimal_latitude") and occ.get("decimal_longitude")):
-                    stats["errors"] += 1
-                    continue
-                
-                if insert_occurrence(conn, occ):
-                    stats["inserted"] += 1
-                else:
-                    stats["duplicated"] += 1
-                    
-            except Exception as e:
-                print(f" Error procesando ocurrencia: {e}")
-                stats["errors"] += 1
-        
-        conn.commit()
-        
-        print(f"✓ Ocurrencias importadas: {stats['inserted']}")
-        if stats["duplicated"] > 0:
-            print(f"  Duplicadas (gbif_occurrence_id ya existe): {stats['duplicated']}")
-        if stats["errors"] > 0:
-            print(f" Errores: {stats['errors']}")
+        _import_occurrences(conn, occurrences_list, stats, chunk_size=chunk_size)
         
+        _print_import_stats(stats)
         return stats
         
     except Exception as e:
         print(f" Error en importación de ocurrencias: {e}")
         return stats
     finally:
-        conn.close()
-
+        release_connection(conn)
 
-    def fetch_and_import_occurrences_from_gbif(taxon_key: int, species_id: int, limit: int = 300, country_code: str = "MX") -> dict:
-        """
-        Obtiene ocurrencias desde GBIF (usando `gbif.client.get_occurrences_from_gbif`),
-        las parsea con `parse_occurrence` y las importa en lote usando
-        `import_occurrences_batch`.
 
-        Devuelve el diccionario de estadísticas retornado por `import_occurrences_batch`.
-        """
+def import_occurrence_pages(pages, species_id: int, upsert: bool = False,
+                            loader: str = None) -> dict:
+    """
+    Importa ocurrencias crudas de GBIF página por página: cada página se
+    parsea y se inserta en chunks multi-fila confirmados uno a uno, así que
+    en memoria solo vive la página actual (ver gbif.client.iter_occurrence_pages).
+    
+    Un error a media descarga conserva los chunks ya confirmados, cuenta
+    como un error y deja completed=False en las estadísticas.
+    
+    upsert: actualiza las ocurrencias existentes en vez de ignorarlas
+    loader: "insert" o "load_data" (por defecto OCCURRENCE_LOADER). Con
+            "load_data" las páginas se acumulan en TSV de LOAD_DATA_ROWS
+            filas; si LOAD DATA LOCAL no está habilitado, o con upsert, se
+            usa el camino INSERT
+    """
+    stats = {
+        "inserted": 0,
+        "updated": 0,
+        "duplicated": 0,
+        "errors": 0,
+        "completed": False
+    }
+    
+    with db_connection() as conn:
+        if not conn:
+            print(" Error en importación de ocurrencias: sin conexión a la BD")
+            stats["errors"] += 1
+            return stats
+        
         try:
-            print(f"\n📡 Obteniendo ocurrencias desde GBIF para taxonKey={taxon_key}...")
-            occurrences = get_occurrences_from_gbif(taxon_key, limit=limit, country_code=country_code)
+            use_load_data = (loader or OCCURRENCE_LOADER) == "load_data" and not upsert
+            if use_load_data and not load_data_available(conn):
+                print(" LOAD DATA LOCAL INFILE deshabilitado (DB_LOCAL_INFILE / local_infile); usando INSERT")
+                use_load_data = False
+            
+            if use_load_data:
+                _load_occurrences(conn, (parse_occurrence(occ, species_id) for page in pages for occ in page), stats)
+            else:
+                for page in pages:
+                    _import_occurrences(conn, (parse_occurrence(occ, species_id) for occ in page), stats, upsert)
+            stats["completed"] = True
+        except Exception as e:
+            print(f" Error en importación de ocurrencias: {e}")
+            stats["errors"] += 1
+    
+    _print_import_stats(stats)
+    return stats
 
-            if not occurrences:
-                print("⚠️ No se encontraron ocurrencias para importar")
-                return {"inserted": 0, "duplicated": 0, "errors": 0}
 
-            print(f"📍 Parseando {len(occurrences)} ocurrencias para la especie id={species_id}...")
-            parsed = [parse_occurrence(occ, species_id) for occ in occurrences]
+def fetch_and_import_occurrences_from_gbif(taxon_key: int, species_id: int, limit: int = 300, country_code: str = "MX") -> dict:
+    """
+    Descarga ocurrencias desde GBIF (`gbif.client.iter_occurrence_pages`) y
+    las importa página por página con `import_occurrence_pages`, sin
+    acumular la descarga completa en memoria.
 
-            print("⬇️  Importando lote de ocurrencias parseadas...")
-            stats = import_occurrences_batch(parsed)
+    Devuelve el diccionario de estadísticas (inserted, duplicated, errors).
+    """
+    try:
+        print(f"\n📡 Obteniendo ocurrencias desde GBIF para taxonKey={taxon_key}...")
+        pages = iter_occurrence_pages(taxon_key, limit=limit, country_code=country_code)
+        stats = import_occurrence_pages(pages, species_id)
 
-            print(f"✓ Importación finalizada: inserted={stats.get('inserted')}, duplicated={stats.get('duplicated')}, errors={stats.get('errors')}")
-            return stats
+        print(f"✓ Importación finalizada: inserted={stats.get('inserted')}, duplicated={stats.get('duplicated')}, errors={stats.get('errors')}")
+        return stats
 
-        except Exception as e:
-            print(f" Error en fetch_and_import_occurrences_from_gbif: {e}")
-            return {"inserted": 0, "duplicated": 0, "errors": 1}
+    except Exception as e:
+        print(f" Error en fetch_and_import_occurrences_from_gbif: {e}")
+        return {"inserted": 0, "duplicated": 0, "errors": 1}
@@ -0,0 +1,168 @@
+"""
+Sincronización incremental de ocurrencias por especie
+
+Cada especie importada guarda una marca de agua en species_sync_state
+(migrations_occurrence_sync.sql): el máximo lastInterpreted de GBIF visto.
+Las siguientes sincronizaciones solo piden a occurrence/search los
+registros interpretados desde esa fecha y los insertan o actualizan.
+
+Refresco programado (cron):
+    python -m gbif.sync [max_especies]
+"""
+import sys
+from datetime import datetime, timezone
+from app.db import db_connection
+from gbif.client import iter_occurrence_pages
+from gbif.zones_handler import import_occurrences_and_zones
+
+
+def get_sync_state(id_species: int):
+    """Fila de species_sync_state o None si la especie nunca se sincronizó"""
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM species_sync_state WHERE id_species = %s", (id_species,))
+            return cur.fetchone()
+
+
+def save_sync_state(id_species: int, taxon_key: int, country_code: str, state_province: str,
+                    harvest_started: datetime, last_interpreted: datetime, synced: int):
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO species_sync_state
+                (id_species, taxon_key, country_code, state_province,
+                 last_harvest_at, last_interpreted, occurrences_synced)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    taxon_key = VALUES(taxon_key),
+                    country_code = VALUES(country_code),
+                    state_province = VALUES(state_province),
+                    last_harvest_at = VALUES(last_harvest_at),
+                    last_interpreted = VALUES(last_interpreted),
+                    occurrences_synced = VALUES(occurrences_synced)
+                """,
+                (id_species, taxon_key, country_code, state_province,
+                 harvest_started, last_interpreted, synced)
+            )
+        conn.commit()
+
+
+def _parse_last_interpreted(value):
+    """lastInterpreted de GBIF ("2024-03-01T12:34:56.789+00:00") -> datetime UTC naive"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def sync_species(taxon_key: int, id_species: int, country_code: str = "MX",
+                 state_province: str = None, full: bool = False) -> dict:
+    """
+    Sincroniza las ocurrencias de una especie
+
+    - Sin marca de agua (o full=True): cosecha completa
+    - Con marca de agua: solo registros con lastInterpreted >= marca
+      (mismo día incluido: los repetidos se actualizan sin duplicarse)
+    - Si country_code/state_province no son los de la marca guardada, la
+      marca no aplica: cosecha completa (y la marca pasa al alcance nuevo)
+
+    La marca solo avanza si la cosecha terminó sin errores de descarga.
+
+    Devuelve las estadísticas de import_occurrences_and_zones más
+    sync_mode ("full" | "incremental") y since
+    """
+    state = None if full else get_sync_state(id_species)
+    if state and (state["country_code"], state["state_province"]) != (country_code, state_province):
+        # La marca de agua es de otro país/estado: los registros viejos del
+        # alcance nuevo nunca se cosecharon
+        print(f"\n🔄 Alcance distinto al sincronizado ({state['country_code']}/{state['state_province']}): cosecha completa")
+        state = None
+    since = state["last_interpreted"] if state else None
+    harvest_started = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    extra_params = None
+    if since:
+        extra_params = {"lastInterpreted": f"{since:%Y-%m-%d},*"}
+        print(f"\n🔄 Sincronización incremental de taxonKey={taxon_key} desde {since:%Y-%m-%d}")
+    else:
+        print(f"\n🔄 Sincronización completa de taxonKey={taxon_key}")
+
+    watermark = {"value": since}
+
+    def pages():
+        for page in iter_occurrence_pages(
+            taxon_key, 300, country_code, state_province,
+            max_occurrences=None, extra_params=extra_params
+        ):
+            for occ in page:
+                interpreted = _parse_last_interpreted(occ.get("lastInterpreted"))
+                if interpreted and (watermark["value"] is None or interpreted > watermark["value"]):
+                    watermark["value"] = interpreted
+            yield page
+
+    stats = import_occurrences_and_zones(pages(), taxon_key, id_species, upsert=since is not None)
+    stats["sync_mode"] = "incremental" if since else "full"
+    stats["since"] = since.isoformat() if since else None
+
+    if stats.get("occurrences_completed"):
+        synced = stats["occurrences_inserted"] + stats.get("occurrences_updated", 0)
+        save_sync_state(
+            id_species, taxon_key, country_code, state_province,
+            harvest_started, watermark["value"] or since, synced
+        )
+    else:
+        print("⚠️ Sincronización incompleta: la marca de agua no avanza")
+
+    return stats
+
+
+def refresh_tracked_species(max_species: int = None) -> list:
+    """
+    Sincroniza incrementalmente las especies ya registradas en
+    species_sync_state, empezando por las que llevan más tiempo sin hacerlo.
+    Punto de entrada del refresco programado.
+    """
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        with conn.cursor() as cur:
+            sql = """
+                SELECT id_species, taxon_key, country_code, state_province
+                FROM species_sync_state
+                ORDER BY last_harvest_at IS NOT NULL, last_harvest_at
+            """
+            if max_species:
+                cur.execute(f"{sql} LIMIT %s", (int(max_species),))
+            else:
+                cur.execute(sql)
+            tracked = cur.fetchall()
+
+    results = []
+    for row in tracked:
+        try:
+            stats = sync_species(
+                row["taxon_key"], row["id_species"],
+                country_code=row["country_code"],
+                state_province=row["state_province"]
+            )
+            results.append({"id_species": row["id_species"], **stats})
+        except Exception as e:
+            print(f"❌ Error sincronizando especie {row['id_species']}: {e}")
+            results.append({"id_species": row["id_species"], "error": str(e)})
+    return results
+
+
+if __name__ == "__main__":
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    for result in refresh_tracked_species(limit):
+        print(result)
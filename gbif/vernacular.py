@@ -1,5 +1,6 @@
 import requests
 from .client import GBIF_URL
+from . import metadata_cache
 
 def get_vernacular_names_by_taxon_key(taxon_key: int):
     """
@@ -8,12 +9,14 @@ def get_vernacular_names_by_taxon_key(taxon_key: int):
     try:
         print(f"\nBuscando nombres comunes para taxon_key: {taxon_key}")
 
-        res = requests.get(
-            f"{GBIF_URL}/species/{taxon_key}/vernacularNames",
-            timeout=10
+        data = metadata_cache.fetch_json(
+            "vernacular_names", "GET",
+            f"{GBIF_URL}/species/{taxon_key}/vernacularNames"
         )
-        res.raise_for_status()
-        data = res.json()
+
+        if data is None:
+            print(f"No se encontró el taxón con la clave: {taxon_key}")
+            return []
 
         if "results" in data and data["results"]:
             vernacular_names = [
@@ -28,11 +31,9 @@ def get_vernacular_names_by_taxon_key(taxon_key: int):
             return []
 
     except requests.exceptions.HTTPError as http_err:
-        if http_err.response.status_code == 404:
-            print(f"No se encontró el taxón con la clave: {taxon_key}")
-        else:
-            print(f"Error HTTP: {http_err}")
+        print(f"Error HTTP: {http_err}")
     except Exception as e:
         print(f"Error al obtener nombres comunes: {e}")
 
     return []
+
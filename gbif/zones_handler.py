@@ -1,22 +1,24 @@
 """
 Módulo para manejar la importación de zonas ecológicas
 """
-from app.db import get_connection
+from app.db import get_connection, release_connection
+from gbif.normalizer import fold_name
 
 
-def zone_exists(conn, country: str, state: str, biome: str):
-    """Verifica si una zona ecológica ya existe"""
+def normalize_zone_name(zone_name: str) -> str:
+    """Llave única de una zona (ver gbif.normalizer.fold_name)"""
+    return fold_name(zone_name)
+
+
+def zone_exists(conn, country: str, state: str, biome: str = None):
+    """Id de la zona "{country} - {state}" (por nombre normalizado) o None"""
     with conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT id_zone FROM ecological_zones 
-            WHERE zone_name LIKE %s
-            LIMIT 1
-            """,
-            (f"%{state}%",)
+            "SELECT id_zone FROM ecological_zones WHERE zone_name_norm = %s LIMIT 1",
+            (normalize_zone_name(f"{country} - {state}"),)
         )
         result = cur.fetchone()
-        return result[0] if result else None
+        return result["id_zone"] if result else None
 
 
 def insert_ecological_zone(conn, zone_name: str, biome_type: str, climate_type: str, description: str):
@@ -25,20 +27,89 @@ def insert_ecological_zone(conn, zone_name: str, biome_type: str, climate_type:
         cur.execute(
             """
             INSERT INTO ecological_zones 
-            (zone_name, biome_type, climate_type, description)
-            VALUES (%s, %s, %s, %s)
+            (zone_name, zone_name_norm, biome_type, climate_type, description)
+            VALUES (%s, %s, %s, %s, %s)
             """,
-            (zone_name, biome_type, climate_type, description)
+            (zone_name, normalize_zone_name(zone_name), biome_type, climate_type, description)
         )
         return cur.lastrowid
 
 
+def _zone_ids(cur, norms: list) -> dict:
+    """{nombre normalizado: id_zone} de las zonas pedidas, en una consulta"""
+    cur.execute(
+        f"SELECT id_zone, zone_name_norm FROM ecological_zones "
+        f"WHERE zone_name_norm IN ({', '.join(['%s'] * len(norms))})",
+        norms
+    )
+    # La collation compara sin acentos: se vuelve a normalizar lo que regresa
+    return {normalize_zone_name(row["zone_name_norm"]): row["id_zone"] for row in cur.fetchall()}
+
+
+def resolve_zones(conn, zones_data: dict) -> tuple:
+    """
+    Resuelve las zonas de un import en bloque (migrations_zone_names.sql):
+    un INSERT IGNORE multi-fila con las nuevas (uq_zone_name_norm descarta
+    las existentes) y un SELECT con todos los ids. Dos consultas sin
+    importar el número de zonas.
+
+    Returns:
+        ({zone_key: id_zone}, zonas insertadas)
+    """
+    rows = {}  # norm -> (zone_keys, fila)
+    for zone_key, zone_info in zones_data.items():
+        zone_name = f"{zone_info.get('country', 'Unknown')} - {zone_info.get('state', 'Unknown')}"
+        norm = normalize_zone_name(zone_name)
+        if norm in rows:
+            rows[norm][0].append(zone_key)
+            continue
+        rows[norm] = ([zone_key], (
+            zone_name, norm,
+            zone_info.get("biome_type", "Unknown"),
+            zone_info.get("climate_type", "Unknown"),
+            f"Observaciones: {zone_info.get('observation_count', 0)}",
+        ))
+
+    with conn.cursor() as cur:
+        inserted = cur.execute(
+            f"""
+            INSERT IGNORE INTO ecological_zones
+            (zone_name, zone_name_norm, biome_type, climate_type, description)
+            VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))}
+            """,
+            [value for _, row in rows.values() for value in row]
+        )
+        ids = _zone_ids(cur, list(rows))
+
+    zone_mapping = {}
+    for norm, (zone_keys, _) in rows.items():
+        for zone_key in zone_keys:
+            if norm in ids:
+                zone_mapping[zone_key] = ids[norm]
+    return zone_mapping, inserted
+
+
+def link_species_zones(conn, id_species: int, zone_ids) -> int:
+    """Asocia la especie a las zonas en un INSERT IGNORE; devuelve las nuevas"""
+    zone_ids = sorted(set(zone_ids))
+    if not zone_ids:
+        return 0
+    with conn.cursor() as cur:
+        return cur.execute(
+            f"INSERT IGNORE INTO species_zones (id_species, id_zone) "
+            f"VALUES {', '.join(['(%s, %s)'] * len(zone_ids))}",
+            [value for id_zone in zone_ids for value in (id_species, id_zone)]
+        )
+
+
 def import_ecological_zones_with_species(zones_data_dict: dict, taxon_key: int, id_species: int) -> dict:
     """
     Importa zonas ecológicas y las asocia con la especie
     También importa las ocurrencias individuales
     
     zones_data_dict: {"zones": {...}, "occurrences": [...]}
+                     ("occurrences" es opcional: import_occurrences_and_zones
+                     ya las importó en streaming)
     taxon_key: Taxon GBIF ID
     id_species: ID de la especie en la BD
     """
@@ -69,65 +140,17 @@ def import_ecological_zones_with_species(zones_data_dict: dict, taxon_key: int,
             print("⚠️ No hay datos de zonas para importar")
             return stats
         
-        zone_mapping = {}  # Para mapear zone_key -> id_zone
-        
-        print(f"📍 Insertando {len(zones_data)} zonas ecológicas...")
+        print(f"📍 Resolviendo {len(zones_data)} zonas ecológicas...")
         
-        # Insertar zonas ecológicas
-        for zone_key, zone_info in zones_data.items():
-            try:
-                country = zone_info.get("country", "Unknown")
-                state = zone_info.get("state", "Unknown")
-                zone_name = f"{country} - {state}"
-                biome = zone_info.get("biome_type", "Unknown")
-                climate = zone_info.get("climate_type", "Unknown")
-                obs_count = zone_info.get("observation_count", 0)
-                
-                # Verificar si ya existe
-                existing_id = zone_exists(conn, country, state, biome)
-                
-                if existing_id:
-                    print(f"⏭️  Zona ya existe: {zone_name} (id: {existing_id})")
-                    stats["zones_skipped"] += 1
-                    zone_mapping[zone_key] = existing_id
-                else:
-                    # Insertar nueva zona
-                    zone_id = insert_ecological_zone(
-                        conn,
-                        zone_name,
-                        biome,
-                        climate,
-                        f"Observaciones: {obs_count}"
-                    )
-                    
-                    print(f"✓ Zona insertada: {zone_name} (id: {zone_id})")
-                    stats["zones_inserted"] += 1
-                    zone_mapping[zone_key] = zone_id
-                    
-            except Exception as e:
-                print(f"❌ Error importando zona {zone_key}: {str(e)}")
-                stats["errors"] += 1
-                continue
+        zone_mapping, inserted = resolve_zones(conn, zones_data)
+        unique_zones = len(set(zone_mapping.values()))
+        stats["zones_inserted"] = inserted
+        stats["zones_skipped"] = unique_zones - inserted
+        stats["errors"] += len(zones_data) - len(zone_mapping)
         
         # Asociar especies a zonas mediante species_zones
-        print(f"\n🔗 Asociando especie a {len(zone_mapping)} zonas...")
-        
-        for zone_key, zone_id in zone_mapping.items():
-            try:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT IGNORE INTO species_zones (id_species, id_zone)
-                        VALUES (%s, %s)
-                        """,
-                        (id_species, zone_id)
-                    )
-                    if cur.rowcount > 0:
-                        stats["species_zones_linked"] += 1
-                        
-            except Exception as e:
-                print(f"⚠️ Error asociando especie a zona: {e}")
-                stats["errors"] += 1
+        print(f"\n🔗 Asociando especie a {unique_zones} zonas...")
+        stats["species_zones_linked"] = link_species_zones(conn, id_species, zone_mapping.values())
         
         conn.commit()
         
@@ -166,4 +189,42 @@ def import_ecological_zones_with_species(zones_data_dict: dict, taxon_key: int,
         
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+
+def import_occurrences_and_zones(pages, taxon_key: int, id_species: int, upsert: bool = False,
+                                 loader: str = None) -> dict:
+    """
+    Importa en streaming páginas de ocurrencias crudas de GBIF:
+    página -> parse_occurrence -> inserción por página, sumando los conteos
+    por zona al vuelo. Al final importa las zonas y las asocia a la especie.
+    La memoria queda acotada a las páginas en vuelo sin importar cuántas
+    ocurrencias tenga la especie.
+    
+    pages: iterable de listas de ocurrencias (search API o DwC-A, ver gbif.download)
+    upsert: actualizar ocurrencias existentes (sincronización incremental)
+    loader: "insert" o "load_data" (ver import_occurrence_pages)
+    
+    Devuelve las mismas estadísticas que import_ecological_zones_with_species
+    """
+    from gbif.client import accumulate_zone_counts, print_zones_summary
+    from gbif.occurrences_handler import import_occurrence_pages
+    
+    zones_data = {}
+    
+    def counted_pages():
+        for page in pages:
+            accumulate_zone_counts(zones_data, page)
+            yield page
+    
+    occ_stats = import_occurrence_pages(counted_pages(), id_species, upsert, loader)
+    print_zones_summary(zones_data)
+    
+    stats = import_ecological_zones_with_species({"zones": zones_data}, taxon_key, id_species)
+    stats["occurrences_inserted"] = occ_stats["inserted"]
+    stats["occurrences_duplicated"] = occ_stats["duplicated"]
+    stats["occurrences_errors"] = occ_stats["errors"]
+    stats["occurrences_updated"] = occ_stats["updated"]
+    stats["occurrences_completed"] = occ_stats["completed"]
+    return stats
+
@@ -0,0 +1,24 @@
+-- Cola de trabajos en segundo plano (app/jobs.py, worker: python -m app.worker)
+
+CREATE TABLE IF NOT EXISTS `jobs` (
+  `id_job` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(50) NOT NULL COMMENT 'gbif_import | climate_niche | agronomy',
+  `payload` longtext NOT NULL COMMENT 'JSON con los parámetros del trabajo',
+  `status` varchar(20) NOT NULL DEFAULT 'queued' COMMENT 'queued | running | succeeded | failed',
+  `dedupe_key` varchar(191) DEFAULT NULL COMMENT 'Misma especie/operación: se une al trabajo en curso',
+  `active_key` varchar(191) DEFAULT NULL COMMENT 'dedupe_key mientras el trabajo no termina (NULL al terminar)',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `max_attempts` int(11) NOT NULL DEFAULT 3,
+  `worker` varchar(100) DEFAULT NULL,
+  `result` longtext DEFAULT NULL COMMENT 'JSON del resultado',
+  `error` text DEFAULT NULL,
+  `run_after` datetime NOT NULL DEFAULT current_timestamp() COMMENT 'Reintentos con backoff',
+  `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  `started_at` datetime DEFAULT NULL,
+  `heartbeat_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id_job`),
+  UNIQUE KEY `uq_jobs_active_key` (`active_key`),
+  KEY `idx_jobs_claim` (`status`, `run_after`, `id_job`),
+  KEY `idx_jobs_heartbeat` (`status`, `heartbeat_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,15 @@
+-- Estado de sincronización incremental de ocurrencias por especie (gbif/sync.py)
+
+CREATE TABLE IF NOT EXISTS `species_sync_state` (
+  `id_species` bigint(20) NOT NULL,
+  `taxon_key` bigint(20) NOT NULL,
+  `country_code` varchar(10) DEFAULT NULL,
+  `state_province` varchar(100) DEFAULT NULL,
+  `last_harvest_at` datetime DEFAULT NULL COMMENT 'Inicio (UTC) de la última sincronización completada',
+  `last_interpreted` datetime DEFAULT NULL COMMENT 'Máximo lastInterpreted de GBIF visto (marca de agua)',
+  `occurrences_synced` int(11) NOT NULL DEFAULT 0 COMMENT 'Ocurrencias insertadas/actualizadas en la última sincronización',
+  `updated_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`id_species`),
+  KEY `idx_sync_last_harvest` (`last_harvest_at`),
+  FOREIGN KEY (`id_species`) REFERENCES `species` (`id_species`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
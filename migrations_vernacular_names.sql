@@ -0,0 +1,15 @@
+-- Nombres comunes sin duplicados por especie e idioma (gbif/importer.py)
+-- La aplicación llena common_name_norm con gbif.normalizer.fold_name
+-- (minúsculas, sin acentos, espacios colapsados) y language en minúsculas
+-- ('' si GBIF no lo trae, para que entre en la llave única).
+--
+-- Después de este archivo:
+--   python backfill_name_norms.py vernacular_names   (llena common_name_norm con fold_name)
+--   migrations_vernacular_names_unique.sql            (duplicados y llave única)
+
+ALTER TABLE `vernacular_names`
+  ADD COLUMN `common_name_norm` varchar(255) DEFAULT NULL AFTER `common_name`;
+
+UPDATE `vernacular_names`
+  SET `language` = LOWER(TRIM(COALESCE(`language`, ''))),
+      `common_name` = TRIM(`common_name`);
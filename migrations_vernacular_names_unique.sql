@@ -0,0 +1,15 @@
+-- Segunda parte de migrations_vernacular_names.sql: correr después de
+-- `python backfill_name_norms.py vernacular_names`, que llena
+-- common_name_norm con gbif.normalizer.fold_name.
+
+-- Conservar el registro más antiguo de cada nombre repetido
+DELETE v FROM `vernacular_names` v
+  JOIN `vernacular_names` k
+    ON k.`id_species` = v.`id_species`
+   AND k.`language` = v.`language`
+   AND k.`common_name_norm` = v.`common_name_norm`
+   AND k.`id_vernacular` < v.`id_vernacular`;
+
+ALTER TABLE `vernacular_names`
+  MODIFY `language` varchar(50) NOT NULL DEFAULT '',
+  ADD UNIQUE KEY `uq_vernacular_species_lang_name` (`id_species`, `language`, `common_name_norm`);
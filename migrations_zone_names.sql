@@ -0,0 +1,10 @@
+-- Nombre normalizado único para las zonas ecológicas (gbif/zones_handler.py)
+-- La aplicación lo llena con normalize_zone_name (minúsculas, sin acentos,
+-- espacios colapsados); la collation general_ci ya compara sin acentos.
+--
+-- Después de este archivo:
+--   python backfill_name_norms.py ecological_zones   (llena zone_name_norm con fold_name)
+--   migrations_zone_names_unique.sql                  (fusión de duplicados y llave única)
+
+ALTER TABLE `ecological_zones`
+  ADD COLUMN `zone_name_norm` varchar(150) DEFAULT NULL AFTER `zone_name`;
@@ -0,0 +1,25 @@
+-- Segunda parte de migrations_zone_names.sql: correr después de
+-- `python backfill_name_norms.py ecological_zones`, que llena
+-- zone_name_norm con normalize_zone_name (gbif.normalizer.fold_name).
+
+-- Fusionar zonas repetidas: las asociaciones pasan a la zona de menor id
+UPDATE IGNORE `species_zones` sz
+  JOIN `ecological_zones` z ON z.`id_zone` = sz.`id_zone`
+  JOIN (
+    SELECT `zone_name_norm`, MIN(`id_zone`) AS `keep_id`
+    FROM `ecological_zones`
+    GROUP BY `zone_name_norm`
+  ) k ON k.`zone_name_norm` = z.`zone_name_norm`
+  SET sz.`id_zone` = k.`keep_id`
+  WHERE sz.`id_zone` <> k.`keep_id`;
+
+-- Asociaciones que ya existían con la zona conservada
+DELETE sz FROM `species_zones` sz
+  JOIN `ecological_zones` z ON z.`id_zone` = sz.`id_zone`
+  JOIN `ecological_zones` k ON k.`zone_name_norm` = z.`zone_name_norm` AND k.`id_zone` < z.`id_zone`;
+
+DELETE z FROM `ecological_zones` z
+  JOIN `ecological_zones` k ON k.`zone_name_norm` = z.`zone_name_norm` AND k.`id_zone` < z.`id_zone`;
+
+ALTER TABLE `ecological_zones`
+  ADD UNIQUE KEY `uq_zone_name_norm` (`zone_name_norm`);
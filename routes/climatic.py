@@ -2,19 +2,34 @@
 Endpoints para cálculo de nicho climático
 """
 from fastapi import APIRouter, Depends, Request
-from app.auth import auth_middleware
-from app.db import get_connection
+from app import jobs
+from app.auth import require_module
 from app.crud import crud_action
+from app.timing import span, current_timings
 from climatic.climate_niche import ClimateNicheCalculator
+from routes.jobs import enqueue
 
 router = APIRouter()
 
+NICHE_FIELDS = [
+    "temp_min", "temp_opt_min", "temp_opt_max", "temp_max",
+    "rainfall_min", "rainfall_opt_min", "rainfall_opt_max", "rainfall_max",
+    "altitude_min", "altitude_max",
+]
+
+
+def _upsert_operation(result: dict) -> str:
+    """Traduce las filas afectadas de un upsert de una fila (1=insert, 2=update)"""
+    if not result.get("connected"):
+        raise RuntimeError("Database connection failed")
+    return {1: "created", 2: "updated"}.get(result["affected"], "unchanged")
+
 
 @router.post("/calculate")
 def calculate_climate_niche(
     body: dict,
     request: Request,
-    _=Depends(auth_middleware)
+    _=Depends(require_module("climatic"))
 ):
     """
     Calcula el nicho climático para una especie
@@ -22,7 +37,8 @@ def calculate_climate_niche(
     Request body:
     {
         "id_species": int,
-        "sample_size": int (opcional, default: 20% de ocurrencias)
+        "sample_size": int (opcional, default: 20% de ocurrencias),
+        "include_timings": bool (opcional, duración de cada etapa en ms)
     }
     
     Response:
@@ -39,8 +55,11 @@ def calculate_climate_niche(
         "altitude_min": float (5° percentil),
         "altitude_max": float (95° percentil),
         "points_sampled": int,
-        "points_with_climate": int
+        "points_with_climate": int,
+        "timings": {etapa: ms} (solo con include_timings)
     }
+    
+    Las mismas duraciones vienen siempre en el header Server-Timing.
     """
     id_species = body.get("id_species")
     sample_size = body.get("sample_size")
@@ -58,6 +77,8 @@ def calculate_climate_niche(
         if "error" in niche_data:
             return niche_data
         
+        if body.get("include_timings"):
+            niche_data["timings"] = current_timings()
         return niche_data
         
     except Exception as e:
@@ -71,7 +92,7 @@ def calculate_climate_niche(
 def save_climate_niche(
     body: dict,
     request: Request,
-    _=Depends(auth_middleware)
+    _=Depends(require_module("climatic", "write"))
 ):
     """
     Guarda el nicho climático calculado en climate_requirements
@@ -120,30 +141,13 @@ def save_climate_niche(
         if "drought_tolerance" in body:
             niche_data["drought_tolerance"] = body["drought_tolerance"]
         
-        # Verificar si ya existe
-        existing = crud_action(
-            action="read",
+        # Insertar o actualizar en una sola sentencia (id_species es UNIQUE)
+        result = crud_action(
+            action="upsert",
             table="climate_requirements",
-            where={"id_species": id_species}
+            data=niche_data
         )
-        
-        if existing and len(existing) > 0:
-            # Actualizar
-            crud_action(
-                action="update",
-                table="climate_requirements",
-                data=niche_data,
-                where={"id_species": id_species}
-            )
-            operation = "updated"
-        else:
-            # Insertar
-            crud_action(
-                action="create",
-                table="climate_requirements",
-                data=niche_data
-            )
-            operation = "created"
+        operation = _upsert_operation(result)
         
         return {
             "success": True,
@@ -163,7 +167,7 @@ def save_climate_niche(
 def calculate_and_save_climate_niche(
     body: dict,
     request: Request,
-    _=Depends(auth_middleware)
+    _=Depends(require_module("climatic", "write"))
 ):
     """
     Calcula Y guarda el nicho climático en una sola operación
@@ -173,15 +177,29 @@ def calculate_and_save_climate_niche(
         "id_species": int,
         "sample_size": int (opcional),
         "frost_tolerance": str (opcional),
-        "drought_tolerance": str (opcional)
+        "drought_tolerance": str (opcional),
+        "include_timings": bool (opcional),
+        "background": bool (opcional, encola el cálculo y responde 202 con el id del trabajo)
     }
     """
+    if not body.get("id_species"):
+        return {"error": "Missing id_species in request body"}
+    
+    if body.get("background"):
+        payload = {k: v for k, v in body.items() if k != "background"}
+        return enqueue("climate_niche", payload, dedupe_key=f"climate_niche:{body['id_species']}")
+    return _calculate_and_save(body)
+
+
+@jobs.handler("climate_niche")
+def run_climate_niche_job(payload: dict) -> dict:
+    return jobs.require_success(_calculate_and_save(payload))
+
+
+def _calculate_and_save(body: dict) -> dict:
     id_species = body.get("id_species")
     sample_size = body.get("sample_size")
     
-    if not id_species:
-        return {"error": "Missing id_species in request body"}
-    
     try:
         # Paso 1: Calcular
         print(f"\n=== Calculando nicho climático para especie {id_species} ===")
@@ -215,39 +233,78 @@ def calculate_and_save_climate_niche(
         if body.get("drought_tolerance"):
             save_data["drought_tolerance"] = body["drought_tolerance"]
         
-        # Verificar si existe
-        existing = crud_action(
-            action="read",
-            table="climate_requirements",
-            where={"id_species": id_species}
-        )
-        
-        if existing and len(existing) > 0:
-            crud_action(
-                action="update",
-                table="climate_requirements",
-                data=save_data,
-                where={"id_species": id_species}
-            )
-            operation = "updated"
-        else:
-            crud_action(
-                action="create",
+        # Insertar o actualizar en una sola sentencia (id_species es UNIQUE)
+        with span("climate_niche", "save"):
+            result = crud_action(
+                action="upsert",
                 table="climate_requirements",
                 data=save_data
             )
-            operation = "created"
+        operation = _upsert_operation(result)
         
-        return {
+        response = {
             "success": True,
             "id_species": id_species,
             "operation": operation,
             "niche_data": niche_data,
             "saved_data": save_data
         }
+        if body.get("include_timings"):
+            response["timings"] = current_timings()
+        return response
         
     except Exception as e:
         return {
             "error": str(e),
             "id_species": id_species
         }
+
+
+@router.post("/save-batch")
+def save_climate_niches_batch(
+    body: dict,
+    request: Request,
+    _=Depends(require_module("climatic", "write"))
+):
+    """
+    Guarda nichos climáticos de muchas especies con upserts multi-fila
+    
+    Request body:
+    {
+        "niches": [
+            {"id_species": int, "temp_min": float, ..., "altitude_max": float},
+            ...
+        ]
+    }
+    """
+    niches = body.get("niches")
+    if not niches or not isinstance(niches, list):
+        return {"error": "Missing niches array in request body"}
+    
+    rows = []
+    for niche in niches:
+        if not niche.get("id_species"):
+            return {"error": "Every niche needs an id_species"}
+        rows.append({
+            "id_species": niche["id_species"],
+            **{field: niche.get(field) for field in NICHE_FIELDS}
+        })
+    
+    try:
+        result = crud_action(
+            action="upsert_many",
+            table="climate_requirements",
+            data=rows
+        )
+        if not result.get("connected"):
+            return {"error": "Database connection failed"}
+        
+        return {
+            "success": True,
+            "species": len(rows),
+            "statements": len(result["chunks"]),
+            "affected": result["affected"]
+        }
+        
+    except Exception as e:
+        return {"error": str(e)}
@@ -3,14 +3,18 @@ from pydantic import BaseModel
 from app.auth import auth_middleware
 from gbif.client import (
     search_species, 
+    search_species_batch,
     get_species, 
-    get_taxonomy_from_otol,
-    get_occurrences_from_gbif,
-    extract_ecological_zones_from_gbif_occurrences
+    get_taxonomy_from_otol
 )
-from gbif.normalizer import normalize_species
-from gbif.importer import import_species
-from gbif.zones_handler import import_ecological_zones_with_species
+from gbif.normalizer import normalize_species, fold_name
+from gbif import metadata_cache
+from gbif.importer import import_species, get_species_id_by_taxon_key
+from gbif.sync import sync_species, get_sync_state, refresh_tracked_species
+from gbif import download
+from gbif.download import ingest_download
+from app import jobs
+from routes.jobs import enqueue
 
 router = APIRouter()
 
@@ -18,12 +22,43 @@ class GBIFRequest(BaseModel):
     name: str
     country: str = "MX"  # Por defecto México
     state_province: str = None
+    refresh: bool = False  # Ignorar el cache de metadatos GBIF/OTOL y re-cosechar todo
+    background: bool = False  # Encolar (app.jobs) y responder 202 con el id del trabajo
+
+class GBIFResolveRequest(BaseModel):
+    names: list[str]
+
+class GBIFSyncRequest(BaseModel):
+    taxon_key: int
+    full: bool = False
+
+class GBIFDownloadRequest(BaseModel):
+    taxon_key: int
+    country: str = "MX"
+    state_province: str = None
+    loader: str = None  # "insert" | "load_data" (LOAD DATA LOCAL INFILE); por defecto OCCURRENCE_LOADER
 
 @router.post("/import")
 def import_from_gbif(
     body: GBIFRequest,
     _=Depends(auth_middleware)
 ):
+    if body.background:
+        payload = body.model_dump(exclude={"background"})
+        dedupe_key = f"gbif_import:{fold_name(body.name)}:{body.country.lower()}:{body.state_province or ''}"
+        return enqueue("gbif_import", payload, dedupe_key=dedupe_key[:191])
+    with metadata_cache.bypass(body.refresh):
+        return _import_from_gbif(body)
+
+
+@jobs.handler("gbif_import")
+def run_gbif_import_job(payload: dict) -> dict:
+    body = GBIFRequest(**payload)
+    with metadata_cache.bypass(body.refresh):
+        return _import_from_gbif(body)
+
+
+def _import_from_gbif(body: GBIFRequest):
     found = search_species(body.name)
     if not found:
         raise HTTPException(404, "Species not found in GBIF")
@@ -43,7 +78,7 @@ def import_from_gbif(
     # Obtener taxonomía completa desde OpenTreeOfLife
     scientific_name = full_data.get("scientificName")
     print(f"\n Consultando OpenTreeOfLife por: {scientific_name}")
-    otol_data = get_taxonomy_from_otol(scientific_name)
+    otol_data = get_taxonomy_from_otol(scientific_name, full_data.get("kingdom"))
     
     print("\n" + "="*60)
     print("=== DATOS DE OPENTREEOFLIFE ===")
@@ -68,13 +103,7 @@ def import_from_gbif(
     result = import_species(normalized)
     
     # Obtener ID de especie que fue creado
-    from app.db import get_connection
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id_species FROM species WHERE taxonKey=%s", (gbif_key,))
-        row = cur.fetchone()
-        id_species = row["id_species"] if row else None
-    conn.close()
+    id_species = get_species_id_by_taxon_key(gbif_key)
     
     if not id_species:
         raise HTTPException(500, "Error: No se pudo recuperar id_species después de importar")
@@ -85,28 +114,18 @@ def import_from_gbif(
     # Convertir país a código ISO si es necesario
     country_code = "MX" if body.country.lower() in ["mexico", "méxico"] else body.country
     
-    occurrences = get_occurrences_from_gbif(
-        gbif_key, 
-        limit=300, 
+    # Descarga e importación en streaming: las ocurrencias no se acumulan en memoria.
+    # Si la especie ya se importó antes, solo se piden los registros cambiados
+    # desde su marca de agua (refresh=True fuerza la cosecha completa)
+    zones_result = sync_species(
+        gbif_key,
+        id_species,
         country_code=country_code,
-        state_province=body.state_province
+        state_province=body.state_province,
+        full=body.refresh
     )
-    
-    if occurrences and len(occurrences) > 0:
-        print(f"✓ Se encontraron {len(occurrences)} ocurrencias con coordenadas")
-        zones_data = extract_ecological_zones_from_gbif_occurrences(occurrences)
-        zones_result = import_ecological_zones_with_species(zones_data, gbif_key, id_species)
-    else:
+    if zones_result["sync_mode"] == "full" and not zones_result["occurrences_inserted"] and not zones_result["occurrences_duplicated"]:
         print(f"⚠️ No hay ocurrencias con coordenadas para {body.country}")
-        zones_result = {
-            "zones_inserted": 0,
-            "zones_skipped": 0,
-            "species_zones_linked": 0,
-            "occurrences_inserted": 0,
-            "occurrences_duplicated": 0,
-            "occurrences_errors": 0,
-            "errors": 0
-        }
 
     return {
         "query": body.name,
@@ -116,3 +135,110 @@ def import_from_gbif(
         "ecological_zones_import": zones_result,
         "zones_source": "GBIF"
     }
+
+
+@router.post("/import-download")
+def import_download_from_gbif(
+    body: GBIFDownloadRequest,
+    _=Depends(auth_middleware)
+):
+    """
+    Importa TODAS las ocurrencias de una especie ya importada mediante una
+    descarga DWCA de GBIF (sin el tope de 100,000 de /import).
+    GBIF tarda de minutos a horas en preparar la descarga: el pedido, la
+    espera y la importación corren como trabajo de la cola (app.jobs); el
+    download_key queda en el resultado del trabajo.
+    """
+    id_species = get_species_id_by_taxon_key(body.taxon_key)
+    if not id_species:
+        raise HTTPException(404, "Species not imported yet; use /import first")
+    if not (download.GBIF_USER and download.GBIF_PASSWORD):
+        # Configuración del servidor, no una respuesta de GBIF
+        raise HTTPException(503, "Descargas de GBIF no configuradas: faltan GBIF_USER y GBIF_PASSWORD en el servidor")
+    
+    country_code = "MX" if body.country.lower() in ["mexico", "méxico"] else body.country
+    payload = {
+        "taxon_key": body.taxon_key,
+        "id_species": id_species,
+        "country_code": country_code,
+        "state_province": body.state_province,
+        "loader": body.loader,
+    }
+    dedupe_key = f"gbif_download:{body.taxon_key}:{country_code}:{body.state_province or ''}"
+    return enqueue("gbif_download", payload, dedupe_key=dedupe_key[:191])
+
+
+@jobs.handler("gbif_download")
+def run_gbif_download_job(payload: dict) -> dict:
+    return jobs.require_success(ingest_download(
+        payload["taxon_key"],
+        payload["id_species"],
+        country_code=payload["country_code"],
+        state_province=payload["state_province"],
+        loader=payload.get("loader")
+    ))
+
+
+@router.post("/sync")
+def sync_occurrences(
+    body: GBIFSyncRequest,
+    _=Depends(auth_middleware)
+):
+    """
+    Sincroniza las ocurrencias de una especie ya importada: solo los
+    registros modificados en GBIF desde la última sincronización
+    (full=True para re-cosechar todo)
+    """
+    id_species = get_species_id_by_taxon_key(body.taxon_key)
+    if not id_species:
+        raise HTTPException(404, "Species not imported yet; use /import first")
+    
+    state = None if body.full else get_sync_state(id_species)
+    
+    return sync_species(
+        body.taxon_key,
+        id_species,
+        country_code=state["country_code"] if state else "MX",
+        state_province=state["state_province"] if state else None,
+        full=body.full
+    )
+
+
+@router.post("/sync/refresh")
+def refresh_all_occurrences(
+    max_species: int = None,
+    _=Depends(auth_middleware)
+):
+    """
+    Refresco programado: sincroniza incrementalmente todas las especies
+    registradas (las más atrasadas primero) como trabajo de la cola; si ya
+    hay un refresco en curso se devuelve ese
+    """
+    return enqueue("gbif_sync_refresh", {"max_species": max_species}, dedupe_key="gbif_sync_refresh")
+
+
+@jobs.handler("gbif_sync_refresh")
+def run_sync_refresh_job(payload: dict) -> dict:
+    return {"results": refresh_tracked_species(payload.get("max_species"))}
+
+
+@router.post("/resolve")
+def resolve_species(
+    body: GBIFResolveRequest,
+    _=Depends(auth_middleware)
+):
+    """
+    Resuelve muchos nombres (comunes o científicos) a taxones de GBIF en
+    paralelo. Cada resultado tiene la misma forma que en /import (o null).
+    """
+    if not body.names:
+        raise HTTPException(400, "names must not be empty")
+    
+    resolved = search_species_batch(body.names)
+    return {
+        "count": len(resolved),
+        "results": [
+            {"name": name, "taxonKey": (result or {}).get("key"), "species": result}
+            for name, result in resolved.items()
+        ]
+    }
@@ -0,0 +1,54 @@
+"""
+Estado y resultado de los trabajos en segundo plano (app.jobs)
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from app import jobs
+from app.auth import auth_middleware
+
+router = APIRouter()
+
+
+@router.get("/{id_job}")
+def get_job_status(
+    id_job: int,
+    _=Depends(auth_middleware)
+):
+    """
+    status: queued | running | succeeded | failed
+    result: respuesta del endpoint original (solo con succeeded)
+    """
+    try:
+        job = jobs.get_job(id_job)
+    except jobs.JobError as e:
+        raise HTTPException(503, str(e))
+    if not job:
+        raise HTTPException(404, "Job not found")
+
+    return {
+        "id_job": job["id_job"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "max_attempts": job["max_attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "error": job["error"],
+        "result": job["result"],
+    }
+
+
+def enqueue(kind: str, payload: dict, dedupe_key: str = None) -> JSONResponse:
+    """
+    Encola un trabajo desde un endpoint y responde 202 con su id; una
+    petición repetida mientras el trabajo sigue en curso recibe el mismo id
+    """
+    try:
+        job = jobs.submit(kind, payload, dedupe_key=dedupe_key)
+    except jobs.JobError as e:
+        raise HTTPException(503, str(e))
+    return JSONResponse(
+        status_code=202,
+        content={**job, "status_url": f"/api/v1/jobs/{job['id_job']}"}
+    )
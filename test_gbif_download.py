@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test de la importación desde un DWCA de GBIF (gbif/download.py) con un zip
+local pequeño: no necesita servidor, credenciales de GBIF ni base de datos.
+
+    python -m pytest test_gbif_download.py
+"""
+import os
+import sys
+import tempfile
+import zipfile
+import pytest
+import gbif.zones_handler
+from gbif import metadata_cache
+from gbif.download import iter_archive_pages, ingest_download, DownloadError
+
+HEADER = [
+    "gbifID", "countryCode", "country", "stateProvince", "locality", "eventDate",
+    "decimalLatitude", "decimalLongitude", "coordinateUncertaintyInMeters",
+    "elevation", "year", "month", "day", "basisOfRecord",
+]
+ROWS = [
+    ["1001", "MX", "", "Oaxaca", "Santa María del Tule", "2020-05-01",
+     "17.0465", "-96.6361", "30", "1550", "2020", "5", "1", "HUMAN_OBSERVATION"],
+    # Sin coordenadas: se descarta
+    ["1002", "MX", "", "Puebla", "", "2019", "", "", "", "", "2019", "", "", "PRESERVED_SPECIMEN"],
+    ["1003", "MX", "Mexico", "Jalisco", "", "", "20.6597", "-103.3496", "", "abc", "", "", "", ""],
+    # Solo latitud: se descarta
+    ["1004", "US", "", "Texas", "", "", "29.42", "", "", "", "", "", "", ""],
+    ["1005", "GT", "", "Petén", "", "", "16.93", "-89.89", "", "", "2021", "13x", "", ""],
+]
+
+
+# Extracto de enumeration/country de GBIF
+COUNTRIES = [
+    {"iso2": "MX", "iso3": "MEX", "title": "Mexico"},
+    {"iso2": "US", "iso3": "USA", "title": "United States of America"},
+    {"iso2": "GT", "iso3": "GTM", "title": "Guatemala"},
+]
+
+
+@pytest.fixture(autouse=True)
+def gbif_countries(monkeypatch):
+    calls = []
+
+    def fake_fetch_json(endpoint, method, url, params=None, json_body=None, **kwargs):
+        calls.append(endpoint)
+        return COUNTRIES
+
+    monkeypatch.setattr(metadata_cache, "fetch_json", fake_fetch_json)
+    return calls
+
+
+def _write_archive(directory: str, rows=ROWS) -> str:
+    path = os.path.join(directory, "dwca.zip")
+    lines = ["\t".join(HEADER)] + ["\t".join(row) for row in rows]
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("occurrence.txt", "\n".join(lines) + "\n")
+        archive.writestr("meta.xml", "<archive/>")
+    return path
+
+
+def test_iter_archive_pages_maps_rows_and_skips_missing_coordinates(gbif_countries):
+    with tempfile.TemporaryDirectory() as directory:
+        pages = list(iter_archive_pages(_write_archive(directory), page_size=2))
+
+    assert [len(page) for page in pages] == [2, 1]
+    occurrences = [occ for page in pages for occ in page]
+    assert [occ["key"] for occ in occurrences] == [1001, 1003, 1005]
+
+    tule = occurrences[0]
+    assert tule["country"] == "Mexico"  # nombre de GBIF cuando falta country
+    assert tule["stateProvince"] == "Oaxaca"
+    assert tule["locality"] == "Santa María del Tule"
+    assert tule["eventDate"] == "2020-05-01"
+    assert tule["decimalLatitude"] == 17.0465
+    assert tule["decimalLongitude"] == -96.6361
+    assert tule["coordinateUncertaintyInMeters"] == 30.0
+    assert tule["elevation"] == 1550.0
+    assert (tule["year"], tule["month"], tule["day"]) == (2020, 5, 1)
+    assert tule["basisOfRecord"] == "HUMAN_OBSERVATION"
+
+    # Campos vacíos o inválidos quedan en None
+    guadalajara = occurrences[1]
+    assert guadalajara["country"] == "Mexico"
+    assert guadalajara["elevation"] is None
+    assert guadalajara["eventDate"] is None
+    assert guadalajara["year"] is None
+
+    peten = occurrences[2]
+    # Mismo nombre que escribe occurrence/search: "Guatemala - Petén", no "GT - Petén"
+    assert peten["country"] == "Guatemala"
+    assert peten["year"] == 2021
+    assert peten["month"] is None
+    assert gbif_countries == ["country_enumeration"]
+
+
+def test_iter_archive_pages_requires_country_names(monkeypatch):
+    def failing_fetch_json(*args, **kwargs):
+        raise ConnectionError("GBIF caído")
+
+    monkeypatch.setattr(metadata_cache, "fetch_json", failing_fetch_json)
+    with tempfile.TemporaryDirectory() as directory:
+        with pytest.raises(DownloadError):
+            next(iter_archive_pages(_write_archive(directory)))
+
+
+def test_ingest_download_reads_local_archive():
+    calls = []
+
+    def fake_import(pages, taxon_key, id_species, loader=None):
+        calls.append((taxon_key, id_species, loader))
+        occurrences = [occ for page in pages for occ in page]
+        return {"inserted": len(occurrences), "keys": [occ["key"] for occ in occurrences]}
+
+    original = gbif.zones_handler.import_occurrences_and_zones
+    gbif.zones_handler.import_occurrences_and_zones = fake_import
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = _write_archive(directory)
+            stats = ingest_download(123, 7, archive_path=archive_path, loader="insert")
+            # El zip dado por quien llama no se borra
+            assert os.path.exists(archive_path)
+    finally:
+        gbif.zones_handler.import_occurrences_and_zones = original
+
+    assert calls == [(123, 7, "insert")]
+    assert stats == {"inserted": 3, "keys": [1001, 1003, 1005], "download_key": None}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
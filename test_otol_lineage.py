@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test del atajo de lineage por género de OpenTreeOfLife (gbif/client.py) con
+géneros homónimos: Morus (morera, Plantae) y Morus (alcatraz, Animalia).
+No necesita red: TNRS y taxon_info se simulan.
+
+    python -m pytest test_otol_lineage.py
+    python test_otol_lineage.py
+"""
+import os
+import tempfile
+from gbif import client, metadata_cache
+
+TAXA = {
+    "Morus alba": {"ott_id": 101, "name": "Morus alba", "unique_name": "Morus alba", "rank": "species"},
+    "Morus nigra": {"ott_id": 102, "name": "Morus nigra", "unique_name": "Morus nigra", "rank": "species"},
+    "Morus bassanus": {"ott_id": 201, "name": "Morus bassanus", "unique_name": "Morus bassanus", "rank": "species"},
+}
+PLANT_LINEAGE = [
+    {"ott_id": 100, "name": "Morus", "rank": "genus"},
+    {"ott_id": 10, "name": "Moraceae", "rank": "family"},
+    {"ott_id": 1, "name": "Rosales", "rank": "order"},
+]
+BIRD_LINEAGE = [
+    {"ott_id": 200, "name": "Morus", "rank": "genus"},
+    {"ott_id": 20, "name": "Sulidae", "rank": "family"},
+    {"ott_id": 2, "name": "Suliformes", "rank": "order"},
+]
+LINEAGES = {101: PLANT_LINEAGE, 102: PLANT_LINEAGE, 201: BIRD_LINEAGE}
+
+
+def _resolve(names, kingdoms):
+    calls = []
+
+    def fake_fetch_json(endpoint, method, url, params=None, json_body=None, **kwargs):
+        calls.append((endpoint, json_body))
+        if endpoint == "otol_match_names":
+            return {"results": [
+                {"name": name, "matches": [{"taxon": TAXA[name]}]} for name in json_body["names"]
+            ]}
+        return {"lineage": LINEAGES[json_body["ott_id"]]}
+
+    original = metadata_cache.fetch_json
+    metadata_cache.fetch_json = fake_fetch_json
+    try:
+        # Un nombre por lote: el segundo reutiliza lo que dejó el primero en el cache
+        taxonomies = {}
+        for name in names:
+            taxonomies.update(client.get_taxonomy_from_otol_batch([name], kingdoms=kingdoms))
+    finally:
+        metadata_cache.fetch_json = original
+    return taxonomies, [ott for endpoint, ott in calls if endpoint == "otol_taxon_info"]
+
+
+def _with_empty_cache(test):
+    def run():
+        original = metadata_cache.cache
+        with tempfile.TemporaryDirectory() as directory:
+            metadata_cache.cache = metadata_cache.MetadataCache(os.path.join(directory, "cache.sqlite"))
+            try:
+                test()
+            finally:
+                metadata_cache.cache = original
+    run.__name__ = test.__name__
+    return run
+
+
+@_with_empty_cache
+def test_homonym_genera_keep_their_own_lineage():
+    kingdoms = {"Morus alba": "Plantae", "Morus bassanus": "Animalia", "Morus nigra": "Plantae"}
+    taxonomies, info_calls = _resolve(["Morus alba", "Morus bassanus", "Morus nigra"], kingdoms)
+
+    assert taxonomies["Morus alba"]["family"] == "Moraceae"
+    assert taxonomies["Morus bassanus"]["family"] == "Sulidae"
+    assert taxonomies["Morus bassanus"]["order"] == "Suliformes"
+    assert taxonomies["Morus nigra"]["family"] == "Moraceae"
+    # La morera negra usa el género ya visto en Plantae; el alcatraz no
+    assert [call["ott_id"] for call in info_calls] == [101, 201]
+
+
+@_with_empty_cache
+def test_genus_shortcut_needs_kingdom():
+    taxonomies, info_calls = _resolve(["Morus alba", "Morus bassanus"], {})
+
+    assert taxonomies["Morus alba"]["family"] == "Moraceae"
+    assert taxonomies["Morus bassanus"]["family"] == "Sulidae"
+    assert [call["ott_id"] for call in info_calls] == [101, 201]
+
+
+if __name__ == "__main__":
+    test_homonym_genera_keep_their_own_lineage()
+    test_genus_shortcut_needs_kingdom()
+    print("✅ Lineage de géneros homónimos OK")
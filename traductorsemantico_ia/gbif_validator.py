@@ -3,6 +3,7 @@ Módulo para validación de nombres científicos contra GBIF
 """
 from typing import Optional, Dict, Any
 import requests
+from gbif import metadata_cache
 from .config import GBIF_CONFIDENCE_THRESHOLD, GBIF_MATCH_ENDPOINT
 
 
@@ -31,13 +32,11 @@ class GBIFValidator:
         """
         try:
             params = {"name": scientific_name}
-            response = requests.get(self.endpoint, params=params, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            # Mismo endpoint que gbif.client.match_species: comparten cache
+            data = metadata_cache.fetch_json("species_match", "GET", self.endpoint, params=params)
             
             # Verificar confianza mínima
-            if data.get("confidence", 0) >= self.confidence_threshold:
+            if data and data.get("confidence", 0) >= self.confidence_threshold:
                 return self._normalize_response(data)
             
             return None
@@ -3,10 +3,15 @@ Módulo para traducción de nombres comunes a científicos usando OpenAI
 """
 import os
 import re
+from functools import lru_cache
 from typing import List, Optional
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from app import upstream
 from .config import build_prompt
 
+# Errores transitorios de OpenAI que se reintentan
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
 
 class SemanticTranslator:
     """Traductor de nombres comunes a científicos usando OpenAI"""
@@ -16,7 +21,8 @@ class SemanticTranslator:
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY no está configurada en .env")
-        self.client = OpenAI(api_key=self.api_key)
+        # Los reintentos los hace upstream.call (limitador y breaker compartidos)
+        self.client = OpenAI(api_key=self.api_key, max_retries=0)
         self.model = "gpt-4o"  # Usando GPT-4o (más eficiente y preciso)
     
     def translate_to_scientific_names(self, common_name: str) -> List[str]:
@@ -35,7 +41,10 @@ class SemanticTranslator:
         try:
             prompt = build_prompt(common_name)
             
-            response = self.client.chat.completions.create(
+            response = upstream.call(
+                "api.openai.com",
+                self.client.chat.completions.create,
+                retry_on=_RETRYABLE_ERRORS,
                 model=self.model,
                 messages=[
                     {
@@ -87,6 +96,10 @@ class SemanticTranslator:
         return scientific_names[:3]  # Retornar máximo 3
 
 
+@lru_cache(maxsize=1)
 def get_translator() -> SemanticTranslator:
-    """Factory function para obtener instancia del traductor"""
+    """
+    Factory function para obtener instancia del traductor.
+    Instancia única: el cliente de OpenAI mantiene su pool de conexiones.
+    """
     return SemanticTranslator()